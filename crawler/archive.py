@@ -0,0 +1,387 @@
+# flake8: noqa
+
+import os
+import re
+import glob
+import json
+import mmap
+import struct
+import argparse
+import tempfile
+
+from bill_text import expand_bill_versions
+from storage import replace_file
+
+
+DATA_DIR = os.path.abspath(
+    os.path.join(
+        os.path.dirname( __file__ ),
+        '..',
+        'data'
+    )
+)
+
+PACK_FILE = os.path.abspath(
+    os.path.join(
+        os.path.dirname( __file__ ),
+        '..',
+        'exports',
+        'sd-legislature.pack'
+    )
+)
+
+# A pack file is MAGIC, then one record per object, then a JSON index and
+# a footer. Each record is a small JSON header mapping field name ->
+# [offset, length] (relative to the end of the header), followed by every
+# field as its own JSON segment. Bill text is split out of bill_versions
+# into a segment per version, so nothing reads it unless it's asked for.
+# The index maps object type -> ID -> [record offset, header length,
+# session ID]; the footer is the index's offset and MAGIC again
+MAGIC = b'SDLPACK1'
+FOOTER = struct.Struct('<Q8s')
+
+# object type -> data files, by glob relative to the data directory
+SOURCES = {
+    'sessions': 'sessions/sd-legislature-session-*.json',
+    'bills': 'bills/sd-legislature-bill-*.json',
+    'legislators': 'legislators/sd-legislature-legislator-*.json',
+    'committees': 'committees/sd-legislature-committee-*.json'
+}
+
+ID_RE = re.compile(r'-(\d+)\.json$')
+
+
+def text_field(position):
+    ''' Segment name for the text of the bill version at this position '''
+
+    return f'bill_versions/{position}/bill_text'
+
+
+def record_segments(object_type, data):
+    ''' A data file's fields as (name, JSON bytes) pairs, with bill text in segments of its own '''
+
+    if object_type == 'bills':
+        data = expand_bill_versions(data)
+
+    segments = []
+
+    for field, value in data.items():
+        if object_type == 'bills' and field == 'bill_versions':
+            versions = value or []
+
+            value = [{k: v for k, v in x.items() if k != 'bill_text'} for x in versions]
+
+            segments.extend(
+                (text_field(i), json.dumps(x.get('bill_text')).encode())
+                for i, x in enumerate(versions)
+            )
+
+        segments.append((field, json.dumps(value).encode()))
+
+    return segments
+
+
+def build_archive(data_dir=DATA_DIR, filepath=PACK_FILE):
+    ''' Pack every data file into one archive, via a temp file so readers never see half of one '''
+
+    filepath = os.path.abspath(filepath)
+
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filepath), suffix='.tmp')
+
+    index = {}
+
+    try:
+        with os.fdopen(fd, 'wb') as outfile:
+            outfile.write(MAGIC)
+
+            for object_type, pattern in SOURCES.items():
+                paths = {}
+
+                for path in glob.iglob(os.path.join(data_dir, pattern)):
+                    match = ID_RE.search(path)
+
+                    if match:
+                        paths[int(match.group(1))] = path
+
+                index[object_type] = {}
+
+                for object_id, path in sorted(paths.items()):
+                    with open(path, 'r') as infile:
+                        data = json.load(infile)
+
+                    segments = record_segments(object_type, data)
+
+                    header = {}
+                    position = 0
+
+                    for name, body in segments:
+                        header[name] = [position, len(body)]
+                        position += len(body)
+
+                    header = json.dumps(header).encode()
+
+                    index[object_type][str(object_id)] = [outfile.tell(), len(header), data.get('session_id')]
+
+                    outfile.write(header)
+
+                    for name, body in segments:
+                        outfile.write(body)
+
+            index_offset = outfile.tell()
+
+            outfile.write(json.dumps(index).encode())
+            outfile.write(FOOTER.pack(index_offset, MAGIC))
+
+        replace_file(tmp, filepath)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    counts = ', '.join(f'{len(v):,} {k}' for k, v in index.items())
+
+    print(f'Packed {counts} into {filepath} ({os.path.getsize(filepath) / 1024 ** 2:,.1f} MB)')
+
+    return filepath
+
+
+class Record(object):
+    ''' One object in a pack file. Fields are read from the mapped file and decoded the first time they're used, as items or attributes '''
+
+    def __init__(self, archive, object_type, object_id, offset, header_length):
+        self.archive = archive
+        self.object_type = object_type
+        self.object_id = object_id
+        self.offset = offset
+        self.header_length = header_length
+
+        self._header = None
+        self._fields = {}
+
+    @property
+    def header(self):
+        if self._header is None:
+            self._header = json.loads(self.archive.read(self.offset, self.header_length))
+
+        return self._header
+
+    def segment(self, name):
+        ''' Decode one segment of this record '''
+
+        position, length = self.header[name]
+
+        return json.loads(self.archive.read(self.offset + self.header_length + position, length))
+
+    def fields(self):
+        ''' Names of the fields in this record '''
+
+        return [x for x in self.header if '/' not in x]
+
+    def get(self, field, default=None):
+        try:
+            return self[field]
+        except KeyError:
+            return default
+
+    def __getitem__(self, field):
+        if field not in self._fields:
+            if '/' in field or field not in self.header:
+                raise KeyError(field)
+
+            self._fields[field] = self.segment(field)
+
+        return self._fields[field]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(f'{type(self).__name__} has no field {name}')
+
+    def __contains__(self, field):
+        return '/' not in field and field in self.header
+
+    def to_dict(self):
+        ''' Every field, decoded, like the data file '''
+
+        return {x: self[x] for x in self.fields()}
+
+    def __repr__(self):
+        return f'<{type(self).__name__} {self.object_id}>'
+
+
+class Session(Record):
+    ''' A session of the S.D. Legislature, read from a pack file '''
+
+    def bill_records(self):
+        ''' This session's bills, lazily '''
+
+        return self.archive.bills(session_id=self.object_id)
+
+
+class BillVersion(object):
+    ''' One version of a bill; its text is only read if it's asked for '''
+
+    def __init__(self, bill, position, metadata):
+        self.bill = bill
+        self.position = position
+        self.metadata = metadata
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['metadata'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    @property
+    def text(self):
+        return self.bill.segment(text_field(self.position))
+
+    def __repr__(self):
+        return f'<BillVersion {self.metadata.get("bill_version_id")} of bill {self.bill.object_id}>'
+
+
+class Bill(Record):
+    ''' A bill, read from a pack file. bill_versions leaves out the text of each version; read that from versions() '''
+
+    def versions(self):
+        ''' Each version of this bill, with its text read lazily '''
+
+        return [BillVersion(self, i, x) for i, x in enumerate(self['bill_versions'])]
+
+    def version_text(self, bill_version_id):
+        ''' The text of one version of this bill '''
+
+        for version in self.versions():
+            if str(version.metadata.get('bill_version_id')) == str(bill_version_id):
+                return version.text
+
+        raise KeyError(f'No version {bill_version_id} of bill {self.object_id}')
+
+    def to_dict(self):
+        ''' Every field, decoded, with the full text of every version; this is the one way to read it all at once '''
+
+        data = super().to_dict()
+
+        data['bill_versions'] = [{**x.metadata, 'bill_text': x.text} for x in self.versions()]
+
+        return data
+
+
+class LegislatorProfile(Record):
+    ''' A legislator serving in a particular session, read from a pack file '''
+
+
+class Committee(Record):
+    ''' A committee that meets during a session, read from a pack file '''
+
+
+RECORD_CLASSES = {
+    'sessions': Session,
+    'bills': Bill,
+    'legislators': LegislatorProfile,
+    'committees': Committee
+}
+
+
+class Archive(object):
+    ''' Read-only access to a pack file through mmap: records are found through the index and decoded a field at a time '''
+
+    def __init__(self, filepath=PACK_FILE):
+        self.filepath = filepath
+
+        if not os.path.exists(filepath):
+            raise FileNotFoundError(f'No pack file at {filepath}; run crawler/archive.py first')
+
+        self.file = open(filepath, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        index_offset, magic = FOOTER.unpack(self.map[-FOOTER.size:])
+
+        if self.map[:len(MAGIC)] != MAGIC or magic != MAGIC:
+            self.close()
+            raise ValueError(f'{filepath} is not a pack file')
+
+        self.index = json.loads(self.map[index_offset:len(self.map) - FOOTER.size])
+
+    def read(self, offset, length):
+        return self.map[offset:offset + length]
+
+    def get(self, object_type, object_id):
+        ''' One record by type and ID; KeyError if it isn't packed '''
+
+        offset, header_length, session_id = self.index[object_type][str(object_id)]
+
+        return RECORD_CLASSES[object_type](self, object_type, int(object_id), offset, header_length)
+
+    def records(self, object_type, session_id=None):
+        ''' Every record of a type in ID order, or just one session's, made as they're needed '''
+
+        for object_id, (offset, header_length, record_session_id) in self.index[object_type].items():
+            if session_id is None or str(record_session_id) == str(session_id):
+                yield RECORD_CLASSES[object_type](self, object_type, int(object_id), offset, header_length)
+
+    def session(self, session_id):
+        return self.get('sessions', session_id)
+
+    def bill(self, bill_id):
+        return self.get('bills', bill_id)
+
+    def legislator(self, legislator_profile_id):
+        return self.get('legislators', legislator_profile_id)
+
+    def committee(self, committee_id):
+        return self.get('committees', committee_id)
+
+    def sessions(self):
+        return self.records('sessions')
+
+    def bills(self, session_id=None):
+        return self.records('bills', session_id=session_id)
+
+    def legislators(self, session_id=None):
+        return self.records('legislators', session_id=session_id)
+
+    def committees(self, session_id=None):
+        return self.records('committees', session_id=session_id)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __str__(self):
+        counts = ', '.join(f'{len(v):,} {k}' for k, v in self.index.items())
+
+        return f'Pack file - {self.filepath} ({counts})'
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Pack the data directory into one file for lazy, memory-mapped reads')
+
+    parser.add_argument(
+        '--data-dir',
+        default=DATA_DIR,
+        help='Directory of crawled data files'
+    )
+
+    parser.add_argument(
+        '--output',
+        default=PACK_FILE,
+        help='Path of the pack file'
+    )
+
+    args = parser.parse_args()
+
+    build_archive(data_dir=args.data_dir, filepath=args.output)
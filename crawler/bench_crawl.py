@@ -0,0 +1,465 @@
+# flake8: noqa
+
+import os
+import sys
+import glob
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import argparse
+import resource
+import tempfile
+import threading
+import multiprocessing
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import models
+from cache import CACHE_FILE
+from client import Client
+from main import gather_session_data, gather_session_data_async
+from metrics import METRICS
+from storage import write_atomic
+from models import BASE_URL, REQUEST_HEADERS
+from parsers import DEFAULT_BACKEND, PARSER_BACKENDS
+from pipeline import CRAWL_STAGES, Pipeline, stage_limit
+from ratelimit import RateLimiter
+from retry import RetryPolicy
+from xwalk import LegislatorResolver
+
+
+OBJECT_DIRS = [
+    'sessions',
+    'legislators',
+    'bills',
+    'committees'
+]
+
+# what a misbehaving server does: rate limit, fall over, or hang up
+ERROR_KINDS = ['429', '500', '503', 'reset']
+
+
+class FixtureServer(ThreadingHTTPServer):
+    ''' A local stand-in for the sdlegislature.gov API that answers from recorded responses '''
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        fixtures_file=CACHE_FILE,
+        sessions=None,
+        latency=0,
+        jitter=0.5,
+        error_rate=0
+    ):
+        super().__init__(address, FixtureHandler)
+
+        self.fixtures_file = fixtures_file
+        self.sessions = set(sessions) if sessions else None
+
+        # seconds per response, give or take jitter of it
+        self.latency = latency
+        self.jitter = jitter
+
+        # share of requests that get one of ERROR_KINDS instead
+        self.error_rate = error_rate
+
+        self.local = threading.local()
+
+    def lookup(self, path):
+        ''' The recorded body and headers for an API path, or None '''
+
+        if not hasattr(self.local, 'conn'):
+            self.local.conn = sqlite3.connect(f'file:{self.fixtures_file}?mode=ro', uri=True)
+
+        row = self.local.conn.execute(
+            '''
+            SELECT r.headers, b.body
+            FROM responses r JOIN blobs b ON r.sha256 = b.sha256
+            WHERE r.url = ?
+            ''',
+            (f'{BASE_URL}{path}',)
+        ).fetchone()
+
+        if not row:
+            return None
+
+        headers, body = row
+        body = bytes(body)
+
+        if path == '/api/Sessions' and self.sessions:
+            body = json.dumps([x for x in json.loads(body) if x.get('SessionId') in self.sessions]).encode()
+
+        return body, json.loads(headers)
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    ''' Serves one request from the fixtures, slowly or badly if the server's been told to '''
+
+    # keep-alive, so the client's connection pool gets used like it would be
+    protocol_version = 'HTTP/1.1'
+
+    # headers and body go out in separate writes; with Nagle's algorithm on,
+    # each reused connection waits out the client's delayed ACK (~40ms)
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+
+        if server.latency:
+            time.sleep(server.latency * random.uniform(1 - server.jitter, 1 + server.jitter))
+
+        if random.random() < server.error_rate:
+            kind = random.choice(ERROR_KINDS)
+
+            if kind == 'reset':
+                self.close_connection = True
+                return
+
+            self.respond(int(kind), b'', {'Retry-After': '1'} if kind == '429' else {})
+            return
+
+        found = server.lookup(self.path)
+
+        if found is None:
+            self.respond(404, b'{"Message": "No fixture for this route"}', {'Content-Type': 'application/json'})
+            return
+
+        body, headers = found
+
+        self.respond(200, body, headers)
+
+    def respond(self, status_code, body, headers):
+        self.send_response(status_code)
+
+        for k, v in headers.items():
+            self.send_header(k, v)
+
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_fixtures(port_queue, **kwargs):
+    ''' Run a FixtureServer on a free local port, and say which one '''
+
+    server = FixtureServer(('127.0.0.1', 0), **kwargs)
+
+    port_queue.put(server.server_address[1])
+
+    server.serve_forever()
+
+
+def start_fixture_server(**kwargs):
+    ''' Start a FixtureServer in a process of its own, so it doesn't count against the crawler's CPU or memory; returns the process and its address '''
+
+    port_queue = multiprocessing.Queue()
+
+    process = multiprocessing.Process(
+        target=serve_fixtures,
+        args=(port_queue,),
+        kwargs=kwargs,
+        daemon=True
+    )
+
+    process.start()
+
+    port = port_queue.get(timeout=30)
+
+    return process, f'http://127.0.0.1:{port}'
+
+
+def peak_memory_mb():
+    ''' Peak resident memory of this process so far; ru_maxrss is KB on Linux and bytes on macOS '''
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    if os.uname().sysname == 'Darwin':
+        peak /= 1024
+
+    return round(peak / 1024, 1)
+
+
+def run_benchmark(
+    origin,
+    concurrent=False,
+    requests_per_second=50,
+    max_in_flight=8,
+    max_attempts=5,
+    parser=DEFAULT_BACKEND,
+    pipeline=False,
+    stage_limits=None,
+    verbose=False
+):
+    ''' Crawl everything the server at origin offers into a throwaway data directory, and time it; with pipeline, through a crawl pipeline with these stage limits '''
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        # Session, Bill and the rest read this when they're created
+        previous_data_dir = models.DATA_DIR
+        models.DATA_DIR = data_dir
+
+        for obj in OBJECT_DIRS:
+            os.makedirs(os.path.join(data_dir, obj))
+
+        client = Client(
+            headers=REQUEST_HEADERS,
+            pool_size=max_in_flight,
+            rate_limiter=RateLimiter(
+                requests_per_second=requests_per_second,
+                max_in_flight=max_in_flight if pipeline else 1,
+                burst=max_in_flight if pipeline else 1
+            ),
+            retry=RetryPolicy(max_attempts=max_attempts),
+            origin=origin
+        )
+
+        METRICS.reset()
+
+        stages = Pipeline(limits=stage_limits) if pipeline else None
+
+        output = sys.stdout if verbose else open(os.devnull, 'w')
+
+        start = time.perf_counter()
+
+        try:
+            with redirect_stdout(output):
+                if concurrent:
+                    asyncio.run(
+                        gather_session_data_async(
+                            resolver=LegislatorResolver(),
+                            client=client,
+                            parser=parser,
+                            requests_per_second=requests_per_second,
+                            max_in_flight=max_in_flight,
+                            pipeline=stages
+                        )
+                    )
+                else:
+                    gather_session_data(
+                        resolver=LegislatorResolver(),
+                        client=client,
+                        parser=parser,
+                        pipeline=stages
+                    )
+
+                client.close()
+        finally:
+            models.DATA_DIR = previous_data_dir
+
+            if stages:
+                stages.close()
+
+        seconds = time.perf_counter() - start
+
+        objects = {
+            obj: len(glob.glob(os.path.join(data_dir, obj, '*.json')))
+            for obj in OBJECT_DIRS
+        }
+
+    report = METRICS.report()
+    total = sum(objects.values())
+
+    return {
+        'settings': {
+            'mode': 'concurrent' if concurrent else 'serial',
+            'pipeline': pipeline,
+            'requests_per_second': requests_per_second,
+            'max_in_flight': max_in_flight if concurrent or pipeline else 1,
+            'parser': parser
+        },
+        'seconds': round(seconds, 2),
+        'objects': objects,
+        'objects_per_second': round(total / seconds, 2) if seconds else None,
+        'requests': report['requests'],
+        'requests_per_second': round(report['requests'] / seconds, 2) if seconds else None,
+        'retries': report['retries'],
+        'statuses': {
+            route: stats['statuses'] for route, stats in report['routes'].items()
+            if set(stats['statuses']) != {'200'}
+        },
+        'peak_memory_mb': peak_memory_mb(),
+        'stages': stages.stats() if stages else None
+    }
+
+
+def compare_to_baseline(result, baseline, tolerance=0.2):
+    ''' Ways this run is more than tolerance worse than a saved one '''
+
+    problems = []
+
+    for key in ('objects_per_second', 'requests_per_second'):
+        if baseline.get(key) and result[key] < baseline[key] * (1 - tolerance):
+            problems.append(f'{key} fell from {baseline[key]:,} to {result[key]:,}')
+
+    if baseline.get('peak_memory_mb') and result['peak_memory_mb'] > baseline['peak_memory_mb'] * (1 + tolerance):
+        problems.append(f'peak_memory_mb rose from {baseline["peak_memory_mb"]:,} to {result["peak_memory_mb"]:,}')
+
+    return problems
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Time a full crawl against a local stand-in for the API, serving responses recorded in the response cache')
+
+    parser.add_argument(
+        '--fixtures',
+        default=CACHE_FILE,
+        help='Response cache to serve recorded responses from; record one with `main.py --cache`'
+    )
+
+    parser.add_argument(
+        '--sessions',
+        type=int,
+        nargs='+',
+        help='Only offer these session IDs, e.g. the ones the fixtures cover'
+    )
+
+    parser.add_argument(
+        '--latency',
+        type=float,
+        default=0,
+        help='Seconds the server takes to answer each request'
+    )
+
+    parser.add_argument(
+        '--jitter',
+        type=float,
+        default=0.5,
+        help='How much latency varies, as a share of it'
+    )
+
+    parser.add_argument(
+        '--error-rate',
+        type=float,
+        default=0,
+        help='Share of requests answered with a 429, a 500, a 503 or a dropped connection'
+    )
+
+    parser.add_argument(
+        '--concurrent',
+        action='store_true',
+        help='Benchmark gather_session_data_async instead of the serial crawl'
+    )
+
+    parser.add_argument(
+        '--pipeline',
+        action='store_true',
+        help='Crawl through a pipeline of stages with their own concurrency limits, as main.py --pipeline does'
+    )
+
+    parser.add_argument(
+        '--stage-limit',
+        type=stage_limit,
+        action='append',
+        default=[],
+        metavar='STAGE=N',
+        help=f'Concurrency limit for one --pipeline stage; can be repeated. Stages: {", ".join(CRAWL_STAGES)}'
+    )
+
+    parser.add_argument(
+        '--requests-per-second',
+        type=float,
+        default=50,
+        help='Rate limit ceiling for the crawl'
+    )
+
+    parser.add_argument(
+        '--max-in-flight',
+        type=int,
+        default=8,
+        help='Most requests out at once in concurrent or pipeline mode'
+    )
+
+    parser.add_argument(
+        '--max-attempts',
+        type=int,
+        default=5,
+        help='Most tries for any one request'
+    )
+
+    parser.add_argument(
+        '--parser',
+        choices=sorted(PARSER_BACKENDS),
+        default=DEFAULT_BACKEND,
+        help='Bill HTML parser backend'
+    )
+
+    parser.add_argument(
+        '--save',
+        help='Write the result to this JSON file, e.g. to use as a baseline later'
+    )
+
+    parser.add_argument(
+        '--baseline',
+        help='Fail if throughput or peak memory is worse than in this saved result'
+    )
+
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=0.2,
+        help='How much worse than the baseline is still OK, as a share of it'
+    )
+
+    parser.add_argument(
+        '--verbose',
+        action='store_true',
+        help='Show the crawler\'s output'
+    )
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.fixtures):
+        raise SystemExit(f'No fixtures at {args.fixtures}; crawl with --cache to record some')
+
+    process, origin = start_fixture_server(
+        fixtures_file=args.fixtures,
+        sessions=args.sessions,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate
+    )
+
+    print(f'Serving {args.fixtures} at {origin}')
+
+    try:
+        result = run_benchmark(
+            origin,
+            concurrent=args.concurrent,
+            requests_per_second=args.requests_per_second,
+            max_in_flight=args.max_in_flight,
+            max_attempts=args.max_attempts,
+            parser=args.parser,
+            pipeline=args.pipeline,
+            stage_limits=args.stage_limit,
+            verbose=args.verbose
+        )
+    finally:
+        process.terminate()
+
+    print(json.dumps(result, indent=2))
+
+    if args.save:
+        write_atomic(args.save, [json.dumps(result, indent=2)])
+
+    if args.baseline:
+        with open(args.baseline, 'r') as infile:
+            baseline = json.load(infile)
+
+        if baseline.get('settings') != result['settings']:
+            print('Baseline was run with different settings; comparing anyway')
+
+        problems = compare_to_baseline(result, baseline, tolerance=args.tolerance)
+
+        for problem in problems:
+            print(f'Regression: {problem}')
+
+        if problems:
+            raise SystemExit(f'Slower or bigger than {args.baseline}')
@@ -0,0 +1,181 @@
+# flake8: noqa
+
+import os
+import json
+import glob
+import time
+import sqlite3
+import argparse
+
+from cache import CACHE_FILE
+from parsers import DEFAULT_BACKEND, PARSER_BACKENDS, is_well_nested
+
+
+FIXTURES_DIR = os.path.abspath(
+    os.path.join(
+        os.path.dirname( __file__ ),
+        'fixtures',
+        'bill-html'
+    )
+)
+
+
+# markup where lxml and html.parser come out differently, which the fast
+# path has to hand to the reference backend; every backend is checked
+# against these on top of the fixtures
+EDGE_CASES = {
+    'textarea-markup': '<div><textarea><p>a</p> b</textarea></div><table><tr><td>x</td></tr></table>',
+    'textarea-in-p': '<html><body><div title="header">h</div><p>x<textarea><p>a</p> b</textarea> c</p></body></html>',
+    'title-in-body': '<html><body><div title="header">h</div><p>x<title>in p</title> y</p></body></html>',
+    'title-markup': '<html><head><title>t <b>u</b></title></head><body><div title="header">h</div><p>x</p></body></html>',
+    'script-markup': '<html><body><div title="header">h</div><p>x<script>var a = "<p>q</p>";</script> y</p></body></html>',
+    'style': '<html><body><div title="header">h</div><p>x<style>p { color: red; }</style> y</p></body></html>',
+    'xmp': '<html><body><div title="header">h</div><p>x<xmp><b>q</b></xmp> y</p></body></html>',
+    'nul': '<html><body><div title="header">h</div><p>x\x00y</p></body></html>',
+    'nul-reference': '<html><body><div title="header">h</div><p>a&#0;b</p></body></html>',
+    'surrogate-reference': '<html><body><div title="header">h</div><p>a&#xD800;b</p></body></html>',
+    'cdata': '<html><body><div title="header">h</div><p>a<![CDATA[x]]>b</p></body></html>',
+    'after-html': '<html><body><table><tr><td><div>x</div></td></tr></table></body></html> after html',
+    'plain-title': '<html><head><title>Bill text</title></head><body><div title="header">h</div><p>x</p></body></html>'
+}
+
+
+def edge_case_mismatches(backends):
+    ''' Edge cases each backend parses differently from the reference backend '''
+
+    reference = {name: PARSER_BACKENDS[DEFAULT_BACKEND](html) for name, html in EDGE_CASES.items()}
+
+    return {
+        backend: sorted(name for name, html in EDGE_CASES.items() if PARSER_BACKENDS[backend](html) != reference[name])
+        for backend in backends
+    }
+
+
+def dump_fixtures_from_cache(limit=500, fixtures_dir=FIXTURES_DIR, cache_file=CACHE_FILE):
+    ''' Save bill HTML documents from the response cache as fixtures, largest first '''
+
+    os.makedirs(fixtures_dir, exist_ok=True)
+
+    conn = sqlite3.connect(cache_file)
+
+    rows = conn.execute(
+        '''
+        SELECT r.url, b.body
+        FROM responses r JOIN blobs b ON r.sha256 = b.sha256
+        WHERE r.url LIKE '%/api/Bills/HTML/%'
+        ORDER BY b.size DESC
+        LIMIT ?
+        ''',
+        (limit,)
+    ).fetchall()
+
+    conn.close()
+
+    for url, body in rows:
+        html = json.loads(body).get('DocumentHtml')
+
+        if not html:
+            continue
+
+        version_id = url.rstrip('/').split('/')[-1]
+        filepath = os.path.join(fixtures_dir, f'bill-version-{version_id}.html')
+
+        with open(filepath, 'w') as outfile:
+            outfile.write(html)
+
+    print(f'Saved {len(rows):,} fixtures to {fixtures_dir}')
+
+
+def load_fixtures(fixtures_dir=FIXTURES_DIR):
+    ''' Read every saved bill HTML fixture into memory '''
+
+    fixtures = {}
+
+    for filepath in sorted(glob.glob(os.path.join(fixtures_dir, '*.html'))):
+        with open(filepath, 'r') as infile:
+            fixtures[os.path.basename(filepath)] = infile.read()
+
+    return fixtures
+
+
+def benchmark(fixtures, backends, repeat=3):
+    ''' Time each backend over the fixtures and check its output against the reference backend '''
+
+    reference = {name: PARSER_BACKENDS[DEFAULT_BACKEND](html) for name, html in fixtures.items()}
+    total_bytes = sum(len(x.encode()) for x in fixtures.values())
+
+    results = []
+
+    for backend in backends:
+        parser = PARSER_BACKENDS[backend]
+        timings = []
+
+        for _ in range(repeat):
+            start = time.perf_counter()
+
+            outputs = {name: parser(html) for name, html in fixtures.items()}
+
+            timings.append(time.perf_counter() - start)
+
+        best = min(timings)
+
+        results.append({
+            'backend': backend,
+            'documents': len(fixtures),
+            'seconds': round(best, 4),
+            'documents_per_second': round(len(fixtures) / best, 1) if best else None,
+            'mb_per_second': round(total_bytes / 1024 ** 2 / best, 2) if best else None,
+            'mismatches': sorted(name for name in fixtures if outputs[name] != reference[name])
+        })
+
+    return results
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compare bill HTML parser backends on saved fixtures')
+
+    parser.add_argument(
+        '--fixtures',
+        default=FIXTURES_DIR,
+        help='Directory of saved bill HTML documents'
+    )
+
+    parser.add_argument(
+        '--dump-from-cache',
+        type=int,
+        metavar='N',
+        help='First save the N largest bill HTML documents in the response cache as fixtures'
+    )
+
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=3,
+        help='Passes per backend; the fastest one is reported'
+    )
+
+    args = parser.parse_args()
+
+    if args.dump_from_cache:
+        dump_fixtures_from_cache(limit=args.dump_from_cache, fixtures_dir=args.fixtures)
+
+    fixtures = load_fixtures(args.fixtures)
+
+    if not fixtures:
+        raise SystemExit(f'No fixtures in {args.fixtures}; crawl with --cache, then pass --dump-from-cache')
+
+    fast_path = len([x for x in fixtures.values() if is_well_nested(x)])
+    print(f'{len(fixtures):,} fixtures, {fast_path:,} well-nested enough for the lxml fast path')
+
+    results = benchmark(fixtures, sorted(PARSER_BACKENDS), repeat=args.repeat)
+
+    for result in results:
+        print(json.dumps(result))
+
+    edge_cases = edge_case_mismatches(sorted(PARSER_BACKENDS))
+
+    print(json.dumps({'edge_case_mismatches': edge_cases}))
+
+    if any(x['mismatches'] for x in results) or any(edge_cases.values()):
+        raise SystemExit('Backends disagree with the reference parser')
@@ -0,0 +1,196 @@
+# flake8: noqa
+
+import os
+import json
+import glob
+import argparse
+import difflib
+
+from manifest import MANIFEST
+from storage import write_json_atomic
+
+
+BILLS_DIR = os.path.abspath(
+    os.path.join(
+        os.path.dirname( __file__ ),
+        '..',
+        'data',
+        'bills'
+    )
+)
+
+# Bill text is stored with its whitespace collapsed to single spaces, so
+# splitting on a space and joining the words back up is lossless. In
+# compact files, every version after the first swaps its bill_text for
+# bill_text_delta: a list of [start, end, replacement] edits to the words
+# of the version before it
+
+
+def text_to_words(text):
+    ''' The words of some bill text; no text has no words '''
+
+    return text.split(' ') if text else []
+
+
+def diff_text(old, new):
+    ''' Word-level edits that turn old bill text into new '''
+
+    old_words = text_to_words(old)
+    new_words = text_to_words(new)
+
+    matcher = difflib.SequenceMatcher(None, old_words, new_words)
+
+    return [
+        [i1, i2, ' '.join(new_words[j1:j2])]
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != 'equal'
+    ]
+
+
+def patch_text(old, delta):
+    ''' Apply diff_text() edits to old bill text '''
+
+    old_words = text_to_words(old)
+    words = []
+    position = 0
+
+    for start, end, replacement in delta:
+        words.extend(old_words[position:start])
+        words.extend(text_to_words(replacement))
+        position = end
+
+    words.extend(old_words[position:])
+
+    return ' '.join(words)
+
+
+def compact_bill_versions(bill_data):
+    ''' A copy of a bill's data with every version after the first stored as a delta from the one before it, where that's smaller '''
+
+    bill_data = expand_bill_versions(bill_data)
+
+    versions = []
+    previous_text = None
+
+    for version in bill_data.get('bill_versions') or []:
+        text = version.get('bill_text')
+
+        if isinstance(text, str) and isinstance(previous_text, str):
+            delta = diff_text(previous_text, text)
+
+            # keep the full text if it's shorter, or if it wasn't stored
+            # with collapsed whitespace and wouldn't survive the round trip
+            if len(json.dumps(delta)) < len(json.dumps(text)) and patch_text(previous_text, delta) == text:
+                version = {
+                    ('bill_text_delta' if k == 'bill_text' else k): (delta if k == 'bill_text' else v)
+                    for k, v in version.items()
+                }
+
+        versions.append(version)
+        previous_text = text
+
+    return {**bill_data, 'bill_versions': versions}
+
+
+def expand_bill_versions(bill_data):
+    ''' A copy of a bill's data with the full text of every version, whether or not it was stored compact '''
+
+    versions = bill_data.get('bill_versions') or []
+
+    if not any('bill_text_delta' in x for x in versions):
+        return bill_data
+
+    expanded = []
+    previous_text = None
+
+    for version in versions:
+        if 'bill_text_delta' in version:
+            text = patch_text(previous_text, version.get('bill_text_delta'))
+
+            version = {
+                ('bill_text' if k == 'bill_text_delta' else k): (text if k == 'bill_text_delta' else v)
+                for k, v in version.items()
+            }
+
+        expanded.append(version)
+        previous_text = version.get('bill_text')
+
+    return {**bill_data, 'bill_versions': expanded}
+
+
+def bill_version_text(bill_data, bill_version_id):
+    ''' The full text of one version of a bill, applying only the deltas that lead up to it '''
+
+    text = None
+
+    for version in bill_data.get('bill_versions') or []:
+        if 'bill_text_delta' in version:
+            text = patch_text(text, version.get('bill_text_delta'))
+        else:
+            text = version.get('bill_text')
+
+        if str(version.get('bill_version_id')) == str(bill_version_id):
+            return text
+
+    raise KeyError(f'No version {bill_version_id} of bill {bill_data.get("bill_id")}')
+
+
+def read_bill_file(filepath):
+    ''' Load a bill's data file, with the full text of every version '''
+
+    with open(filepath, 'r') as infile:
+        return expand_bill_versions(json.load(infile))
+
+
+def convert_bill_files(bills_dir=BILLS_DIR, compact=True):
+    ''' Rewrite every bill file in compact form, or back to full text '''
+
+    rewritten = 0
+    before = 0
+    after = 0
+
+    for filepath in sorted(glob.glob(os.path.join(bills_dir, 'sd-legislature-bill-*.json'))):
+        before += os.path.getsize(filepath)
+
+        bill_data = read_bill_file(filepath)
+
+        if compact:
+            bill_data = compact_bill_versions(bill_data)
+
+        if write_json_atomic(filepath, bill_data):
+            rewritten += 1
+
+        after += os.path.getsize(filepath)
+
+    MANIFEST.save()
+
+    print(f'Rewrote {rewritten:,} bill files; {before / 1024 ** 2:,.1f} MB -> {after / 1024 ** 2:,.1f} MB')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Convert bill files between full and compact (delta-encoded) version text')
+
+    mode = parser.add_mutually_exclusive_group(required=True)
+
+    mode.add_argument(
+        '--compact',
+        action='store_true',
+        help='Store every bill version after the first as a delta from the one before it'
+    )
+
+    mode.add_argument(
+        '--expand',
+        action='store_true',
+        help='Store the full text of every bill version'
+    )
+
+    parser.add_argument(
+        '--bills-dir',
+        default=BILLS_DIR,
+        help='Directory of bill files'
+    )
+
+    args = parser.parse_args()
+
+    convert_bill_files(bills_dir=args.bills_dir, compact=args.compact)
@@ -0,0 +1,232 @@
+# flake8: noqa
+
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+
+CACHE_FILE = os.path.abspath(
+    os.path.join(
+        os.path.dirname( __file__ ),
+        '.cache',
+        'http-cache.sqlite'
+    )
+)
+
+# seconds a cached response stays fresh, by route; None means it never
+# goes stale. Bill text and roll calls don't change once they're published
+TTL_POLICIES = [
+    (re.compile(r'/api/Bills/HTML/\d+$'), None),
+    (re.compile(r'/api/Votes/\d+$'), None),
+    (re.compile(r'/api/Sessions$'), 60 * 60),
+    (re.compile(r'/api/Sessions/\d+$'), 60 * 60),
+    (re.compile(r'/api/Historical/AllFlatMembers$'), 60 * 60 * 24),
+]
+
+DEFAULT_TTL = 60 * 60 * 6
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS responses (
+    url TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL REFERENCES blobs (sha256),
+    headers TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at);
+CREATE INDEX IF NOT EXISTS responses_sha256 ON responses (sha256);
+'''
+
+
+def ttl_for(url):
+    ''' How long a response from this URL stays fresh '''
+
+    for pattern, ttl in TTL_POLICIES:
+        if pattern.search(url):
+            return ttl
+
+    return DEFAULT_TTL
+
+
+class ResponseCache(object):
+    ''' A size-capped, content-addressed SQLite cache of successful API responses '''
+
+    def __init__(self, filepath=CACHE_FILE, max_bytes=2 * 1024 ** 3):
+        self.filepath = filepath
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+
+        self.conn = sqlite3.connect(
+            self.filepath,
+            check_same_thread=False,
+            isolation_level=None
+        )
+
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0
+
+    def get(self, url, ignore_ttl=False):
+        ''' Return a cached response for this URL, or None if there isn't a fresh one '''
+
+        with self.lock:
+            row = self.conn.execute(
+                '''
+                SELECT r.headers, r.fetched_at, b.body
+                FROM responses r JOIN blobs b ON r.sha256 = b.sha256
+                WHERE r.url = ?
+                ''',
+                (url,)
+            ).fetchone()
+
+            ttl = ttl_for(url)
+
+            if not row or (not ignore_ttl and ttl is not None and time.time() - row[1] > ttl):
+                self.misses += 1
+                return None
+
+            self.conn.execute(
+                'UPDATE responses SET accessed_at = ? WHERE url = ?',
+                (time.time(), url)
+            )
+
+            self.hits += 1
+
+        headers, fetched_at, body = row
+
+        response = requests.models.Response()
+        response.status_code = 200
+        response.url = url
+        response.headers = CaseInsensitiveDict(json.loads(headers))
+        response._content = bytes(body)
+        response.from_cache = True
+
+        return response
+
+    def put(self, url, response):
+        ''' Store a successful response; identical bodies are stored once '''
+
+        if response.status_code != 200:
+            return
+
+        body = response.content
+        digest = hashlib.sha256(body).hexdigest()
+        headers = {k: v for k, v in response.headers.items() if k.lower() in ('content-type', 'etag', 'last-modified')}
+        now = time.time()
+
+        with self.lock:
+            self.conn.execute('BEGIN')
+
+            previous = self.conn.execute(
+                'SELECT sha256 FROM responses WHERE url = ?',
+                (url,)
+            ).fetchone()
+
+            self.conn.execute(
+                'INSERT OR IGNORE INTO blobs (sha256, body, size) VALUES (?, ?, ?)',
+                (digest, body, len(body))
+            )
+            self.conn.execute(
+                'INSERT OR REPLACE INTO responses (url, sha256, headers, fetched_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+                (url, digest, json.dumps(headers), now, now)
+            )
+
+            # the URL's old body, if it changed and nothing else uses it
+            if previous and previous[0] != digest:
+                self.conn.execute(
+                    'DELETE FROM blobs WHERE sha256 = ? AND NOT EXISTS (SELECT 1 FROM responses WHERE sha256 = ?)',
+                    (previous[0], previous[0])
+                )
+
+            self.conn.execute('COMMIT')
+
+            self.puts += 1
+            check_size = self.puts % 500 == 0
+
+        if check_size:
+            self.evict()
+
+    def size(self):
+        ''' Total bytes of stored bodies '''
+
+        with self.lock:
+            return self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+
+    def evict(self):
+        ''' Drop least-recently-used responses until stored bodies fit under max_bytes '''
+
+        evicted = 0
+
+        with self.lock:
+            self.conn.execute('BEGIN')
+
+            # bodies no response points to any more, e.g. left behind by a
+            # cache written before put() cleaned up after itself
+            self.conn.execute('DELETE FROM blobs WHERE sha256 NOT IN (SELECT sha256 FROM responses)')
+
+            total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+
+            if total <= self.max_bytes:
+                self.conn.execute('COMMIT')
+                return evicted
+
+            rows = self.conn.execute(
+                'SELECT url, sha256 FROM responses ORDER BY accessed_at'
+            ).fetchall()
+
+            for url, digest in rows:
+                if total <= self.max_bytes:
+                    break
+
+                self.conn.execute('DELETE FROM responses WHERE url = ?', (url,))
+                evicted += 1
+
+                still_used = self.conn.execute(
+                    'SELECT 1 FROM responses WHERE sha256 = ? LIMIT 1',
+                    (digest,)
+                ).fetchone()
+
+                if not still_used:
+                    size = self.conn.execute(
+                        'SELECT size FROM blobs WHERE sha256 = ?',
+                        (digest,)
+                    ).fetchone()[0]
+
+                    self.conn.execute('DELETE FROM blobs WHERE sha256 = ?', (digest,))
+                    total -= size
+
+            self.conn.execute('COMMIT')
+
+        return evicted
+
+    def close(self):
+        ''' Trim the cache down to size and close the database '''
+
+        evicted = self.evict()
+
+        if evicted:
+            print(f'Evicted {evicted:,} cached responses')
+
+        self.conn.close()
+
+    def __str__(self):
+        return f'HTTP response cache - {self.filepath} ({self.hits:,} hits, {self.misses:,} misses)'
@@ -0,0 +1,97 @@
+# flake8: noqa
+
+import os
+import json
+import threading
+from datetime import datetime, timedelta
+
+from storage import write_atomic
+
+
+CHECKPOINT_FILE = os.path.abspath(
+    os.path.join(
+        os.path.dirname( __file__ ),
+        'state',
+        'checkpoint.jsonl'
+    )
+)
+
+
+class CheckpointJournal(object):
+    ''' An append-only log of the sessions, bills, legislators and committees a crawl has finished, so a restarted crawl picks up where the last one died '''
+
+    def __init__(self, filepath=CHECKPOINT_FILE, max_age_hours=36):
+        self.filepath = filepath
+        self.lock = threading.Lock()
+        self.completed = {}
+
+        entries = []
+
+        # units finished longer ago than this get crawled again. The nightly
+        # crawl runs every 24 hours, so this has to be longer than that for a
+        # killed run to pick up from where it stopped
+        cutoff = datetime.now() - timedelta(hours=max_age_hours)
+
+        try:
+            with open(self.filepath, 'r') as infile:
+                for line in infile:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # the last line of a journal killed mid-write
+                        continue
+
+                    if datetime.fromisoformat(entry.get('fetched_at')) >= cutoff:
+                        self.completed[(entry.get('object_type'), str(entry.get('object_id')))] = entry.get('fetched_at')
+                        entries.append(entry)
+        except FileNotFoundError:
+            pass
+
+        if self.completed:
+            print(f'Resuming crawl - {len(self.completed):,} units already done')
+
+        # start from just the entries still good, so stale ones and a line
+        # cut off by a kill don't pile up from one run to the next
+        write_atomic(self.filepath, (json.dumps(x) + '\n' for x in entries))
+
+        self.outfile = open(self.filepath, 'a')
+
+    def is_done(self, object_type, object_id):
+        ''' Did an earlier attempt at this crawl already finish this unit? '''
+
+        with self.lock:
+            return (object_type, str(object_id)) in self.completed
+
+    def mark_done(self, object_type, object_id):
+        ''' Record a finished unit, flushed to disk before returning '''
+
+        fetched_at = datetime.now().isoformat()
+
+        entry = {
+            'object_type': object_type,
+            'object_id': object_id,
+            'fetched_at': fetched_at
+        }
+
+        with self.lock:
+            self.outfile.write(json.dumps(entry) + '\n')
+            self.outfile.flush()
+            os.fsync(self.outfile.fileno())
+
+            self.completed[(object_type, str(object_id))] = fetched_at
+
+    def finish(self):
+        ''' The crawl made it all the way through, so the next one starts fresh '''
+
+        with self.lock:
+            self.outfile.close()
+            os.remove(self.filepath)
+
+    def close(self):
+        ''' Stop writing but keep the journal for the next run to resume from '''
+
+        with self.lock:
+            self.outfile.close()
+
+    def __str__(self):
+        return f'Crawl checkpoint journal - {self.filepath} ({len(self.completed):,} units done)'
@@ -0,0 +1,172 @@
+# flake8: noqa
+
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import METRICS
+from ratelimit import RateLimiter
+from retry import RETRY_STATUSES, RetryPolicy, parse_retry_after
+
+
+class Client(object):
+    ''' A keep-alive HTTP client whose connection pool is shared by every object in a crawl '''
+
+    def __init__(
+        self,
+        headers={},
+        pool_size=10,
+        timeout=(10, 60),
+        rate_limiter=None,
+        retry=None,
+        cache=None,
+        offline=False,
+        origin=None
+    ):
+        self.pool_size = pool_size
+
+        # scheme://host[:port] to send every request to in place of the one
+        # in its URL, e.g. a local stand-in for the API. Cache keys and
+        # metrics still use the real URL
+        self.origin = origin.rstrip('/') if origin else None
+
+        # a cache.ResponseCache; offline serves everything from it
+        self.cache = cache
+        self.offline = offline
+
+        # (connect, read) seconds, passed straight through to requests
+        self.timeout = timeout
+
+        # the defaults match the old half-second pause between calls
+        self.rate_limiter = rate_limiter or RateLimiter(
+            requests_per_second=2,
+            max_in_flight=1
+        )
+
+        self.retry = retry or RetryPolicy()
+
+        self.session = requests.Session()
+
+        # urllib3 decompresses gzip/deflate bodies for us
+        self.session.headers.update({
+            **headers,
+            'Accept-Encoding': 'gzip, deflate'
+        })
+
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size
+        )
+
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, url, headers=None):
+        ''' GET a URL over a pooled connection within the rate limit, or from the cache if there's a fresh copy. Rate limiting, server errors and dropped connections are retried with backoff '''
+
+        if self.cache:
+            cached = self.cache.get(url, ignore_ttl=self.offline)
+
+            METRICS.observe_cache(url, cached is not None)
+
+            if cached is not None:
+                return cached
+
+            if self.offline:
+                print(f'Not in cache, skipping {url}')
+                return self.cache_miss(url)
+
+        self.retry.record_request()
+
+        attempt = 0
+
+        while True:
+            try:
+                with self.rate_limiter.slot():
+                    # time the request itself, not the wait for a slot
+                    start = time.monotonic()
+
+                    r = self.session.get(
+                        self.target(url),
+                        headers=headers,
+                        timeout=self.timeout
+                    )
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self.rate_limiter.record(None, time.monotonic() - start)
+
+                if not self.retry.allow(attempt):
+                    METRICS.observe_request(url, time.monotonic() - start, None, retries=attempt)
+                    raise
+
+                time.sleep(self.retry.delay(attempt))
+                attempt += 1
+                continue
+
+            latency = time.monotonic() - start
+
+            self.rate_limiter.record(r.status_code, latency)
+
+            if r.status_code not in RETRY_STATUSES or not self.retry.allow(attempt):
+                break
+
+            retry_after = parse_retry_after(r.headers.get('Retry-After'))
+
+            # the server asked everyone to back off, not just this request
+            if retry_after:
+                self.rate_limiter.pause(retry_after)
+
+            print(f'Got {r.status_code} from {url}, retrying')
+
+            time.sleep(self.retry.delay(attempt, retry_after))
+            attempt += 1
+
+        # latency of the attempt that counted
+        METRICS.observe_request(url, latency, r.status_code, size=len(r.content), retries=attempt)
+
+        if self.cache:
+            self.cache.put(url, r)
+
+        return r
+
+    def target(self, url):
+        ''' The URL to actually request '''
+
+        if not self.origin:
+            return url
+
+        parts = urlsplit(url)
+
+        return f'{self.origin}{parts.path}' + (f'?{parts.query}' if parts.query else '')
+
+    def cache_miss(self, url):
+        ''' What an offline client answers for an uncached URL: 504, like a cache told "only-if-cached" '''
+
+        r = requests.models.Response()
+        r.status_code = 504
+        r.reason = 'Gateway Timeout'
+        r.url = url
+        r._content = b''
+
+        return r
+
+    def close(self):
+        ''' Close every pooled connection, and the cache if there is one '''
+
+        self.session.close()
+
+        print(self)
+
+        if self.cache:
+            print(self.cache)
+            self.cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __str__(self):
+        return f'HTTP client - {self.pool_size} pooled connections, {self.rate_limiter}, {self.retry}'
@@ -0,0 +1,712 @@
+# flake8: noqa
+
+import os
+import json
+import glob
+import hashlib
+import time
+import sqlite3
+import argparse
+import tempfile
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from bill_text import expand_bill_versions
+from storage import replace_file
+
+
+DATA_DIR = os.path.abspath(
+    os.path.join(
+        os.path.dirname( __file__ ),
+        '..',
+        'data'
+    )
+)
+
+EXPORT_FILE = os.path.abspath(
+    os.path.join(
+        os.path.dirname( __file__ ),
+        '..',
+        'exports',
+        'sd-legislature.sqlite'
+    )
+)
+
+# table name -> (column, SQLite type) pairs, in insert order
+TABLES = {
+    'sessions': (
+        ('session_id', 'INTEGER PRIMARY KEY'),
+        ('session_name', 'TEXT'),
+        ('session_number', 'INTEGER'),
+        ('is_current_session', 'INTEGER'),
+        ('is_special_session', 'INTEGER'),
+        ('start_date', 'TEXT'),
+        ('end_date', 'TEXT')
+    ),
+    'bills': (
+        ('bill_id', 'INTEGER PRIMARY KEY'),
+        ('session_id', 'INTEGER'),
+        ('bill_type', 'TEXT'),
+        ('bill_number', 'INTEGER'),
+        ('bill_title', 'TEXT'),
+        ('session_law', 'INTEGER'),
+        ('rss_feed', 'TEXT')
+    ),
+    'bill_keywords': (
+        ('bill_id', 'INTEGER'),
+        ('keyword', 'TEXT')
+    ),
+    'bill_versions': (
+        ('bill_version_id', 'INTEGER PRIMARY KEY'),
+        ('bill_id', 'INTEGER'),
+        ('bill_version', 'TEXT'),
+        ('bill_version_date', 'TEXT'),
+        ('bill_text', 'TEXT')
+    ),
+    'sponsors': (
+        ('bill_id', 'INTEGER'),
+        ('legislator_profile_id', 'INTEGER'),
+        ('is_prime', 'INTEGER')
+    ),
+    'actions': (
+        ('bill_id', 'INTEGER'),
+        ('action_number', 'INTEGER'),
+        ('action_date', 'TEXT'),
+        ('document_id', 'INTEGER'),
+        ('document_url', 'TEXT'),
+        ('status_text', 'TEXT'),
+        ('journal_page', 'INTEGER'),
+        ('committee_id_action', 'INTEGER'),
+        ('committee_id_assigned', 'INTEGER'),
+        ('result', 'TEXT'),
+        ('vote_id', 'INTEGER')
+    ),
+    'votes': (
+        ('vote_id', 'INTEGER PRIMARY KEY'),
+        ('president_vote', 'TEXT')
+    ),
+    'roll_calls': (
+        ('vote_id', 'INTEGER'),
+        ('legislator_profile_id', 'INTEGER'),
+        ('vote', 'TEXT')
+    ),
+    'legislators': (
+        ('legislator_profile_id', 'INTEGER PRIMARY KEY'),
+        ('legislator_canonical_id', 'INTEGER'),
+        ('session_id', 'INTEGER'),
+        ('year', 'TEXT'),
+        ('chamber', 'TEXT'),
+        ('name', 'TEXT'),
+        ('district', 'TEXT'),
+        ('party', 'TEXT'),
+        ('term', 'TEXT'),
+        ('occupation', 'TEXT'),
+        ('counties', 'TEXT'),
+        ('address1', 'TEXT'),
+        ('address2', 'TEXT'),
+        ('city', 'TEXT'),
+        ('state', 'TEXT'),
+        ('zipcode', 'TEXT'),
+        ('phone_home', 'TEXT'),
+        ('phone_capitol', 'TEXT'),
+        ('phone_biz', 'TEXT'),
+        ('phone_cell', 'TEXT'),
+        ('email', 'TEXT'),
+        ('picture', 'TEXT')
+    ),
+    'committees': (
+        ('committee_id', 'INTEGER PRIMARY KEY'),
+        ('committee_id_canon', 'INTEGER'),
+        ('session_id', 'INTEGER'),
+        ('committee_name', 'TEXT'),
+        ('chamber', 'TEXT'),
+        ('committee_room', 'TEXT'),
+        ('committee_days', 'TEXT'),
+        ('is_full_body', 'INTEGER'),
+        ('authority', 'TEXT')
+    ),
+    'committee_members': (
+        ('committee_id', 'INTEGER'),
+        ('legislator_profile_id', 'INTEGER'),
+        ('committee_member_type', 'TEXT')
+    )
+}
+
+# composite keys; roll calls are shared by every bill the vote was taken on
+TABLE_CONSTRAINTS = {
+    'actions': 'PRIMARY KEY (bill_id, action_number)',
+    'roll_calls': 'PRIMARY KEY (vote_id, legislator_profile_id)'
+}
+
+# built once the tables are loaded, which is faster than keeping them up
+# to date row by row
+INDEXES = (
+    'CREATE INDEX IF NOT EXISTS bills_session_id ON bills (session_id)',
+    'CREATE INDEX IF NOT EXISTS bill_keywords_bill_id ON bill_keywords (bill_id)',
+    'CREATE INDEX IF NOT EXISTS bill_keywords_keyword ON bill_keywords (keyword)',
+    'CREATE INDEX IF NOT EXISTS bill_versions_bill_id ON bill_versions (bill_id)',
+    'CREATE INDEX IF NOT EXISTS sponsors_bill_id ON sponsors (bill_id)',
+    'CREATE INDEX IF NOT EXISTS sponsors_legislator_profile_id ON sponsors (legislator_profile_id)',
+    'CREATE INDEX IF NOT EXISTS actions_vote_id ON actions (vote_id)',
+    'CREATE INDEX IF NOT EXISTS roll_calls_legislator_profile_id ON roll_calls (legislator_profile_id)',
+    'CREATE INDEX IF NOT EXISTS legislators_session_id ON legislators (session_id)',
+    'CREATE INDEX IF NOT EXISTS legislators_legislator_canonical_id ON legislators (legislator_canonical_id)',
+    'CREATE INDEX IF NOT EXISTS committees_session_id ON committees (session_id)',
+    'CREATE INDEX IF NOT EXISTS committee_members_committee_id ON committee_members (committee_id)',
+    'CREATE INDEX IF NOT EXISTS committee_members_legislator_profile_id ON committee_members (legislator_profile_id)'
+)
+
+
+def to_int(value):
+    ''' The API hands some IDs back as strings '''
+
+    if value in (None, ''):
+        return None
+
+    return int(value)
+
+
+def session_rows(data):
+    ''' Normalized rows from one session file '''
+
+    return {
+        'sessions': [(
+            to_int(data.get('session_id')),
+            data.get('session_name'),
+            to_int(data.get('session_number')),
+            data.get('is_current_session'),
+            data.get('is_special_session'),
+            data.get('start_date'),
+            data.get('end_date')
+        )]
+    }
+
+
+def bill_rows(data):
+    ''' Normalized rows from one bill file, roll calls included '''
+
+    data = expand_bill_versions(data)
+
+    bill_id = to_int(data.get('bill_id'))
+
+    rows = {
+        'bills': [(
+            bill_id,
+            to_int(data.get('session_id')),
+            data.get('bill_type'),
+            to_int(data.get('bill_number')),
+            data.get('bill_title'),
+            to_int(data.get('session_law')),
+            data.get('rss_feed')
+        )],
+        'bill_keywords': [(bill_id, x) for x in data.get('keywords') or []],
+        'bill_versions': [(
+            to_int(x.get('bill_version_id')),
+            bill_id,
+            x.get('bill_version'),
+            x.get('bill_version_date'),
+            x.get('bill_text')
+        ) for x in data.get('bill_versions') or []],
+        'sponsors': [(
+            bill_id,
+            to_int(x.get('legislator_profile_id')),
+            x.get('is_prime')
+        ) for x in data.get('sponsors') or []],
+        'actions': [],
+        'votes': [],
+        'roll_calls': []
+    }
+
+    for i, action in enumerate(data.get('action_log') or []):
+        vote = action.get('vote') or {}
+        vote_id = to_int(vote.get('vote_id'))
+
+        rows['actions'].append((
+            bill_id,
+            i,
+            action.get('action_date'),
+            to_int(action.get('document_id')),
+            action.get('document_url'),
+            action.get('status_text'),
+            to_int(action.get('journal_page')),
+            to_int(action.get('committee_id_action')),
+            to_int(action.get('committee_id_assigned')),
+            action.get('result'),
+            vote_id
+        ))
+
+        if vote_id is None:
+            continue
+
+        rows['votes'].append((vote_id, vote.get('president_vote')))
+
+        for key, legislator_ids in vote.items():
+            if key in ('vote_id', 'president_vote'):
+                continue
+
+            rows['roll_calls'].extend((vote_id, x, key) for x in legislator_ids)
+
+    return rows
+
+
+def legislator_rows(data):
+    ''' Normalized rows from one legislator profile file '''
+
+    columns = [x for x, _ in TABLES['legislators']]
+
+    return {
+        'legislators': [tuple(
+            to_int(data.get(x)) if x in ('legislator_profile_id', 'legislator_canonical_id', 'session_id') else data.get(x)
+            for x in columns
+        )]
+    }
+
+
+def committee_rows(data):
+    ''' Normalized rows from one committee file '''
+
+    committee_id = to_int(data.get('committee_id'))
+
+    return {
+        'committees': [(
+            committee_id,
+            to_int(data.get('committee_id_canon')),
+            to_int(data.get('session_id')),
+            data.get('committee_name'),
+            data.get('chamber'),
+            data.get('committee_room'),
+            data.get('committee_days'),
+            data.get('is_full_body'),
+            data.get('authority')
+        )],
+        'committee_members': [(
+            committee_id,
+            to_int(x.get('legislator_profile_id')),
+            x.get('committee_member_type')
+        ) for x in data.get('members') or []]
+    }
+
+
+# data files to export, by glob relative to the data directory: the kind
+# of object in each, and the function that turns one into rows
+SOURCES = (
+    ('sessions/sd-legislature-session-*.json', 'session', session_rows),
+    ('bills/sd-legislature-bill-*.json', 'bill', bill_rows),
+    ('legislators/sd-legislature-legislator-*.json', 'legislator', legislator_rows),
+    ('committees/sd-legislature-committee-*.json', 'committee', committee_rows)
+)
+
+# the ID column of each kind of object, and the tables holding its rows.
+# Votes and roll calls are shared between bills, so they're cleaned up
+# once nothing in the action log points at them anymore
+OWNED_TABLES = {
+    'session': ('session_id', ('sessions',)),
+    'bill': ('bill_id', ('bills', 'bill_keywords', 'bill_versions', 'sponsors', 'actions')),
+    'legislator': ('legislator_profile_id', ('legislators',)),
+    'committee': ('committee_id', ('committees', 'committee_members'))
+}
+
+# bump this when the tables change, so the next export rebuilds from scratch
+SCHEMA_VERSION = 2
+
+# what each data file looked like the last time it was exported
+MANIFEST_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS export_manifest (
+    path TEXT PRIMARY KEY,
+    object_type TEXT NOT NULL,
+    object_id INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+'''
+
+
+# full-text search over every bill version, along with its bill's title
+# and keywords. The index reads its text from the view instead of keeping
+# a second copy of every version; rows have to be taken out of the index
+# before the rows behind the view change, so the same text gets removed
+SEARCH_SCHEMA = '''
+CREATE VIEW IF NOT EXISTS bill_search_content AS
+SELECT
+    v.bill_version_id,
+    v.bill_id,
+    b.session_id,
+    v.bill_version,
+    v.bill_version_date,
+    b.bill_title,
+    (
+        SELECT group_concat(keyword, '; ')
+        FROM (SELECT keyword FROM bill_keywords k WHERE k.bill_id = v.bill_id ORDER BY k.rowid)
+    ) AS keywords,
+    v.bill_text
+FROM bill_versions v JOIN bills b ON b.bill_id = v.bill_id;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS bill_search USING fts5 (
+    bill_title,
+    keywords,
+    bill_text,
+    content='bill_search_content',
+    content_rowid='bill_version_id',
+    tokenize='porter unicode61'
+);
+'''
+
+
+def create_tables(conn):
+    ''' Create any missing export tables '''
+
+    for table, columns in TABLES.items():
+        column_defs = [f'{name} {kind}' for name, kind in columns]
+
+        if table in TABLE_CONSTRAINTS:
+            column_defs.append(TABLE_CONSTRAINTS[table])
+
+        column_defs = ', '.join(column_defs)
+        conn.execute(f'CREATE TABLE IF NOT EXISTS {table} ({column_defs})')
+
+    conn.executescript(MANIFEST_SCHEMA)
+    conn.executescript(SEARCH_SCHEMA)
+
+
+def insert_rows(conn, rows):
+    ''' Insert a dict of table name -> row tuples '''
+
+    for table, table_rows in rows.items():
+        if not table_rows:
+            continue
+
+        placeholders = ', '.join('?' for _ in TABLES[table])
+
+        # the same roll call shows up in the action log of every bill it
+        # was taken on
+        verb = 'INSERT OR IGNORE' if table in ('votes', 'roll_calls') else 'INSERT'
+
+        conn.executemany(
+            f'{verb} INTO {table} VALUES ({placeholders})',
+            table_rows
+        )
+
+
+def index_bill(conn, bill_id):
+    ''' Add a bill's versions to the search index '''
+
+    conn.execute(
+        '''
+        INSERT INTO bill_search (rowid, bill_title, keywords, bill_text)
+        SELECT bill_version_id, bill_title, keywords, bill_text
+        FROM bill_search_content WHERE bill_id = ?
+        ''',
+        (bill_id,)
+    )
+
+
+def unindex_bill(conn, bill_id):
+    ''' Take a bill's versions out of the search index, before its rows change '''
+
+    conn.execute(
+        '''
+        INSERT INTO bill_search (bill_search, rowid, bill_title, keywords, bill_text)
+        SELECT 'delete', bill_version_id, bill_title, keywords, bill_text
+        FROM bill_search_content WHERE bill_id = ?
+        ''',
+        (bill_id,)
+    )
+
+
+def delete_object(conn, object_type, object_id):
+    ''' Drop every row exported from one object's file '''
+
+    id_column, tables = OWNED_TABLES[object_type]
+
+    if object_type == 'bill':
+        unindex_bill(conn, object_id)
+
+    for table in tables:
+        conn.execute(f'DELETE FROM {table} WHERE {id_column} = ?', (object_id,))
+
+
+def delete_orphaned_votes(conn):
+    ''' Drop votes and roll calls no bill's action log refers to anymore '''
+
+    for table in ('roll_calls', 'votes'):
+        conn.execute(
+            f'''
+            DELETE FROM {table}
+            WHERE vote_id NOT IN (SELECT vote_id FROM actions WHERE vote_id IS NOT NULL)
+            '''
+        )
+
+
+def scan_data_files(data_dir):
+    ''' Every data file to export, as (path relative to data_dir, object type, row function, os.stat result) '''
+
+    for pattern, object_type, to_rows in SOURCES:
+        for path in glob.iglob(os.path.join(data_dir, pattern)):
+            yield os.path.relpath(path, data_dir), object_type, to_rows, os.stat(path)
+
+
+def read_data_file(path):
+    ''' A data file's parsed JSON and the sha256 of its bytes '''
+
+    with open(path, 'rb') as infile:
+        raw = infile.read()
+
+    return json.loads(raw), hashlib.sha256(raw).hexdigest()
+
+
+def object_id_of(object_type, rows):
+    ''' The ID of the object some rows came from '''
+
+    return rows[OWNED_TABLES[object_type][1][0]][0][0]
+
+
+def load_object(conn, object_type, to_rows, data):
+    ''' Replace one object's rows with those in its file; returns its ID '''
+
+    rows = to_rows(data)
+    object_id = object_id_of(object_type, rows)
+
+    delete_object(conn, object_type, object_id)
+
+    # a bill's roll calls are rewritten along with it; votes it no
+    # longer mentions are swept up by delete_orphaned_votes()
+    for vote_id, _ in rows.get('votes', []):
+        conn.execute('DELETE FROM roll_calls WHERE vote_id = ?', (vote_id,))
+        conn.execute('DELETE FROM votes WHERE vote_id = ?', (vote_id,))
+
+    insert_rows(conn, rows)
+
+    if object_type == 'bill':
+        index_bill(conn, object_id)
+
+    return object_id
+
+
+def record_file(conn, path, object_type, object_id, stat, digest):
+    ''' Note what a data file looked like when it was exported '''
+
+    conn.execute(
+        '''
+        INSERT OR REPLACE INTO export_manifest (path, object_type, object_id, mtime, size, sha256)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''',
+        (path, object_type, object_id, stat.st_mtime, stat.st_size, digest)
+    )
+
+
+def build_sqlite(data_dir=DATA_DIR, filepath=EXPORT_FILE):
+    ''' Load every session, bill, legislator and committee file into a new indexed SQLite database '''
+
+    start = time.perf_counter()
+
+    filepath = os.path.abspath(filepath)
+
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+    # build next to the old database and swap it in at the end, so anyone
+    # querying the export never sees it half-loaded
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(filepath),
+        prefix=f'.{os.path.basename(filepath)}.',
+        suffix='.tmp'
+    )
+    os.close(fd)
+
+    counts = {}
+
+    try:
+        conn = sqlite3.connect(tmp, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=OFF')
+        conn.execute('PRAGMA synchronous=OFF')
+
+        create_tables(conn)
+
+        conn.execute('BEGIN')
+
+        for path, object_type, to_rows, stat in scan_data_files(data_dir):
+            data, digest = read_data_file(os.path.join(data_dir, path))
+            rows = to_rows(data)
+
+            insert_rows(conn, rows)
+
+            record_file(conn, path, object_type, object_id_of(object_type, rows), stat, digest)
+
+        for statement in INDEXES:
+            conn.execute(statement)
+
+        conn.execute("INSERT INTO bill_search (bill_search) VALUES ('rebuild')")
+
+        conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        conn.execute('COMMIT')
+
+        for table in TABLES:
+            counts[table] = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+        conn.execute('ANALYZE')
+        conn.close()
+
+        replace_file(tmp, filepath)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    print(f'Exported {data_dir} to {filepath} in {time.perf_counter() - start:.1f}s')
+    print(', '.join(f'{table}: {count:,}' for table, count in counts.items()))
+
+    return counts
+
+
+def update_sqlite(data_dir=DATA_DIR, filepath=EXPORT_FILE):
+    ''' Bring an existing export up to date, re-reading only the data files that changed since it was built '''
+
+    start = time.perf_counter()
+
+    conn = sqlite3.connect(filepath, isolation_level=None)
+
+    manifest = {
+        x[0]: x[1:] for x in conn.execute(
+            'SELECT path, object_type, object_id, mtime, size, sha256 FROM export_manifest'
+        )
+    }
+
+    changes = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+
+    # one transaction, so queries see the old export or the new one
+    conn.execute('BEGIN')
+
+    try:
+        for path, object_type, to_rows, stat in scan_data_files(data_dir):
+            previous = manifest.pop(path, None)
+
+            # same size and mtime: trust that it's the file we exported
+            if previous and previous[2:4] == (stat.st_mtime, stat.st_size):
+                changes['unchanged'] += 1
+                continue
+
+            data, digest = read_data_file(os.path.join(data_dir, path))
+
+            if previous and previous[4] == digest:
+                # touched but not changed, like a fresh git checkout
+                record_file(conn, path, object_type, previous[1], stat, digest)
+                changes['unchanged'] += 1
+                continue
+
+            object_id = load_object(conn, object_type, to_rows, data)
+            record_file(conn, path, object_type, object_id, stat, digest)
+
+            changes['updated' if previous else 'added'] += 1
+
+        # files that are gone
+        for path, (object_type, object_id, *_) in manifest.items():
+            delete_object(conn, object_type, object_id)
+            conn.execute('DELETE FROM export_manifest WHERE path = ?', (path,))
+            changes['removed'] += 1
+
+        if changes['updated'] or changes['removed']:
+            delete_orphaned_votes(conn)
+
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+    print(f'Updated {filepath} in {time.perf_counter() - start:.1f}s')
+    print(', '.join(f'{k}: {v:,}' for k, v in changes.items()))
+
+    return changes
+
+
+def export_sqlite(data_dir=DATA_DIR, filepath=EXPORT_FILE, rebuild=False):
+    ''' Update the SQLite export in place, or build it from scratch if there isn't a current one '''
+
+    if not rebuild and os.path.exists(filepath):
+        conn = sqlite3.connect(filepath)
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        conn.close()
+
+        if version == SCHEMA_VERSION:
+            return update_sqlite(data_dir=data_dir, filepath=filepath)
+
+    return build_sqlite(data_dir=data_dir, filepath=filepath)
+
+
+def export_parquet(filepath=EXPORT_FILE, parquet_dir=None, batch_size=50000):
+    ''' Write each table of the SQLite export out as a Parquet file; needs pyarrow '''
+
+    if not pyarrow:
+        raise RuntimeError('Parquet export needs pyarrow installed')
+
+    parquet_dir = parquet_dir or os.path.join(os.path.dirname(filepath), 'parquet')
+
+    os.makedirs(parquet_dir, exist_ok=True)
+
+    conn = sqlite3.connect(filepath)
+
+    for table, columns in TABLES.items():
+        names = [x for x, _ in columns]
+
+        schema = pyarrow.schema([
+            (name, pyarrow.int64() if kind.startswith('INTEGER') else pyarrow.string())
+            for name, kind in columns
+        ])
+
+        cursor = conn.execute(f'SELECT {", ".join(names)} FROM {table}')
+
+        with pyarrow.parquet.ParquetWriter(os.path.join(parquet_dir, f'{table}.parquet'), schema) as writer:
+            # a batch at a time, so bill text never has to fit in memory at once
+            for rows in iter(lambda: cursor.fetchmany(batch_size), []):
+                writer.write_table(pyarrow.Table.from_pylist(
+                    [dict(zip(names, x)) for x in rows],
+                    schema=schema
+                ))
+
+    conn.close()
+
+    print(f'Wrote {len(TABLES)} Parquet tables to {parquet_dir}')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Export the data archive to a single SQLite database, or update an existing export')
+
+    parser.add_argument(
+        '--data-dir',
+        default=DATA_DIR,
+        help='Directory of crawled JSON files'
+    )
+
+    parser.add_argument(
+        '--output',
+        default=EXPORT_FILE,
+        help='Path of the SQLite database to build or update'
+    )
+
+    parser.add_argument(
+        '--rebuild',
+        action='store_true',
+        help='Build the database from scratch instead of updating only what changed'
+    )
+
+    parser.add_argument(
+        '--parquet',
+        action='store_true',
+        help='Also write each table as a Parquet file next to the database (needs pyarrow)'
+    )
+
+    args = parser.parse_args()
+
+    if args.parquet and not pyarrow:
+        raise SystemExit('--parquet needs pyarrow installed')
+
+    export_sqlite(data_dir=args.data_dir, filepath=args.output, rebuild=args.rebuild)
+
+    if args.parquet:
+        export_parquet(filepath=args.output)
@@ -0,0 +1,96 @@
+# flake8: noqa
+
+import os
+import gzip
+import json
+import hashlib
+import threading
+
+from storage import write_atomic
+
+
+FINGERPRINTS_DIR = os.path.abspath(
+    os.path.join(
+        os.path.dirname( __file__ ),
+        'state',
+        'payloads'
+    )
+)
+
+
+def fingerprint(body):
+    ''' sha256 of a payload's bytes '''
+
+    return hashlib.sha256(body).hexdigest()
+
+
+def changed_items(previous, current, id_field):
+    ''' Items of a list payload that are new since the previous copy or differ from it, matched on id_field '''
+
+    before = {x.get(id_field): x for x in previous or []}
+
+    return [x for x in current if before.get(x.get(id_field)) != x]
+
+
+class FingerprintStore(object):
+    ''' Remembers a fingerprint of each bulk API payload between runs, plus a gzipped copy of the ones worth diffing, so an unchanged payload can skip normalizing and rewriting its file '''
+
+    def __init__(self, directory=FINGERPRINTS_DIR):
+        self.directory = directory
+        self.filepath = os.path.join(directory, 'fingerprints.json')
+        self.lock = threading.Lock()
+
+        try:
+            with open(self.filepath, 'r') as infile:
+                self.fingerprints = json.load(infile)
+        except FileNotFoundError:
+            self.fingerprints = {}
+
+        self.unchanged = 0
+
+    def copy_path(self, key):
+        return os.path.join(self.directory, f'{key}.json.gz')
+
+    def changed(self, key, body):
+        ''' Is this payload different from the last one remembered under key? '''
+
+        with self.lock:
+            changed = self.fingerprints.get(key) != fingerprint(body)
+
+            if not changed:
+                self.unchanged += 1
+
+        return changed
+
+    def previous(self, key):
+        ''' The last copy kept under key, decoded, or None '''
+
+        try:
+            with gzip.open(self.copy_path(key), 'rt') as infile:
+                return json.load(infile)
+        except FileNotFoundError:
+            return None
+
+    def remember(self, key, body, keep_copy=False):
+        ''' Record a payload's fingerprint, and keep a copy of it to diff the next one against '''
+
+        if keep_copy:
+            # mtime=0 so the same payload always makes the same bytes
+            write_atomic(self.copy_path(key), [gzip.compress(body, mtime=0)])
+
+        with self.lock:
+            self.fingerprints[key] = fingerprint(body)
+
+    def save(self):
+        ''' Write fingerprints to file, via a temp file so a crash can't truncate it '''
+
+        with self.lock:
+            payload = json.dumps(self.fingerprints, indent=2, sort_keys=True)
+
+        write_atomic(self.filepath, [payload])
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def __str__(self):
+        return f'{len(self)} payload fingerprints, {self.unchanged} payloads unchanged this run - {self.directory}'
@@ -3,98 +3,144 @@
 import os
 import csv
 import json
+import argparse
+import asyncio
+import atexit
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import time
-
-import requests
-
+from functools import partial
+
+from cache import ResponseCache
+from checkpoint import CHECKPOINT_FILE, CheckpointJournal
+from client import Client
+from export import export_sqlite
+from fingerprints import FingerprintStore, changed_items
+from manifest import MANIFEST, MANIFEST_FILE
+from metrics import METRICS, REPORT_FILE
+from parsers import DEFAULT_BACKEND, PARSER_BACKENDS, ParsePool
+from pipeline import BILL_FIELDS, CRAWL_STAGES, Pipeline, stage_limit
+from retry import RetryPolicy
+from scheduler import BillScheduler
+from state import ValidatorStore
+from storage import write_json_atomic
+from xwalk import LegislatorResolver
 from models import (
     BASE_URL,
+    DATA_DIR,
+    DEFAULT_CLIENT,
     REQUEST_HEADERS,
     Session,
     Bill,
     LegislatorProfile,
-    Committee
+    Committee,
+    VoteStore
 )
 
 TODAY = datetime.now().date().today().isoformat()
 
+# fingerprint keys for bulk payloads
+HISTORICAL_MEMBERS_KEY = 'historical-members'
+
+
+def normalize_historical_member(leg):
+    ''' One member from /api/Historical/AllFlatMembers, the way we store it '''
+
+    birthday = leg.get('Birthdate')
+    deathday = leg.get('Deathdate')
+
+    member_id = leg.get('MemberId')
+    name_first = leg.get('FirstName')
+
+    # fix typos
+    if member_id == 3999:
+        name_first = 'Mellissa'
+
+    if member_id == 4018:
+        name_first = 'John'
+
+    if birthday:
+        try:
+            birthday = datetime.strptime(birthday, '%m-%d-%Y').date().isoformat()
+        except ValueError:
+            pass
+    if deathday:
+        try:
+            deathday = datetime.strptime(deathday, '%m-%d-%Y').date().isoformat()
+        except ValueError:
+            pass
+
+    notes = leg.get('Remarks')
+
+    if notes:
+        notes = ' '.join(notes.split())
+
+    return {
+        'legislator_id_canon': leg.get('MemberId'),
+        'name_first': name_first,
+        'name_last': leg.get('LastName'),
+        'name_middle': leg.get('MiddleName'),
+        'gender': leg.get('Gender'),
+        'birthday': birthday,
+        'deathday': deathday,
+        'member_type': leg.get('MemberType'),
+        'counties': leg.get('County'),
+        'cities': leg.get('City'),
+        'year_start': leg.get('StartYear'),
+        'year_end': leg.get('EndYear'),
+        'notes': notes,
+        'offices': leg.get('Office'),
+        'parties': leg.get('Party'),
+        'chambers': leg.get('Body')
+    }
+
+
+def gather_historical_legislator_data(client=DEFAULT_CLIENT, fingerprints=None):
+    ''' Download and normalize the list of every legislator ever. With fingerprints, an unchanged list is read back from file instead, and only members who are new or changed get normalized '''
+
+    filepath = os.path.join(
+        DATA_DIR,
+        'legislators',
+        'sd-legislature-legislators-historical.json'
+    )
 
-def gather_historical_legislator_data():
+    r = client.get(f'{BASE_URL}/api/Historical/AllFlatMembers')
 
-    filepath = os.path.abspath(
-        os.path.join(
-            os.path.dirname( __file__ ),
-            '..',
-            'data',
-            'legislators',
-            'sd-legislature-legislators-historical.json'
-        )
-    )
+    existing = None
 
-    r = requests.get(
-        f'{BASE_URL}/api/Historical/AllFlatMembers',
-        headers=REQUEST_HEADERS
-    )
+    if fingerprints is not None and os.path.exists(filepath):
+        with open(filepath, 'r') as infile:
+            existing = json.load(infile)
+
+    if existing is not None and not fingerprints.changed(HISTORICAL_MEMBERS_KEY, r.content):
+        print(f'No changes to {filepath}')
+        return existing
 
     data = r.json()
-    data_out = []
-
-    for leg in data:
-        birthday = leg.get('Birthdate')
-        deathday = leg.get('Deathdate')
-
-        member_id = leg.get('MemberId')
-        name_first = leg.get('FirstName')
-
-        # fix typos
-        if member_id == 3999:
-            name_first = 'Mellissa'
-
-        if member_id == 4018:
-            name_first = 'John'
-
-        if birthday:
-            try:
-                birthday = datetime.strptime(birthday, '%m-%d-%Y').date().isoformat()
-            except ValueError:
-                pass
-        if deathday:
-            try:
-                deathday = datetime.strptime(deathday, '%m-%d-%Y').date().isoformat()
-            except ValueError:
-                pass
-
-        notes = leg.get('Remarks')
-
-        if notes:
-            notes = ' '.join(notes.split())
-
-        d = {
-            'legislator_id_canon': leg.get('MemberId'),
-            'name_first': name_first,
-            'name_last': leg.get('LastName'),
-            'name_middle': leg.get('MiddleName'),
-            'gender': leg.get('Gender'),
-            'birthday': birthday,
-            'deathday': deathday,
-            'member_type': leg.get('MemberType'),
-            'counties': leg.get('County'),
-            'cities': leg.get('City'),
-            'year_start': leg.get('StartYear'),
-            'year_end': leg.get('EndYear'),
-            'notes': notes,
-            'offices': leg.get('Office'),
-            'parties': leg.get('Party'),
-            'chambers': leg.get('Body')
-        }
-
-        data_out.append(d)
-
-    with open(filepath, 'w') as outfile:
-        outfile.write(json.dumps(data_out))
-
-    print(f'Downloaded {filepath}')
+
+    # members who haven't changed since the last copy keep their normalized records
+    if existing is not None:
+        changed = {x.get('MemberId') for x in changed_items(fingerprints.previous(HISTORICAL_MEMBERS_KEY), data, 'MemberId')}
+        normalized = {x.get('legislator_id_canon'): x for x in existing}
+
+        print(f'{len(changed):,} new or changed members in the historical list')
+    else:
+        changed = None
+        normalized = {}
+
+    data_out = [
+        normalized[leg.get('MemberId')]
+        if changed is not None and leg.get('MemberId') not in changed and leg.get('MemberId') in normalized
+        else normalize_historical_member(leg)
+        for leg in data
+    ]
+
+    if write_json_atomic(filepath, data_out):
+        print(f'Downloaded {filepath}')
+    else:
+        print(f'No changes to {filepath}')
+
+    if fingerprints is not None:
+        fingerprints.remember(HISTORICAL_MEMBERS_KEY, r.content, keep_copy=True)
 
     return data_out
 
@@ -128,115 +174,588 @@ def get_session_dates_lookup():
     return data
 
 
-def gather_session_data(historical_legislator_data=None):
+def crawl_session(sesh_id, session_dates, client=DEFAULT_CLIENT):
+    ''' Fetch a session's metadata and lists of bills, legislators and committees '''
+
+    session = Session(
+        session_id=sesh_id,
+        lookup_table=session_dates,
+        client=client
+    )
+
+    print(session)
+
+    session.get_session_docs()
+    session.get_bills()
+    session.get_legislators()
+    session.get_committees()
+    session.get_session_laws()
+    session.get_conference_committees()
+
+    if not session.file_exists or session.is_current_session:
+        session.write_local_file()
+
+    return session
+
+
+def crawl_legislator(
+    session,
+    leg_id,
+    leg_xwalk,
+    resolver=None,
+    journal=None
+):
+    ''' Fetch and write one legislator profile, if we don't have it already '''
+
+    profile = LegislatorProfile(
+        session_id=session.session_id,
+        legislator_profile_id=leg_id,
+        lookup_table=leg_xwalk,
+        resolver=resolver,
+        client=session.client
+    )
+
+    print(profile)
+
+    if journal and journal.is_done('legislator', leg_id):
+        return profile
+
+    if not profile.file_exists:
+        profile.get_profile_data()
+        profile.get_canonical_id()
+        profile.write_local_file()
+
+    if journal:
+        journal.mark_done('legislator', leg_id)
+
+    return profile
+
+
+def crawl_bill(
+    session,
+    bill_id,
+    validators=None,
+    votes=None,
+    parser=DEFAULT_BACKEND,
+    parse_pool=None,
+    journal=None,
+    compact_text=False,
+    scheduler=None,
+    pipeline=None
+):
+    ''' Fetch and write one bill if it's new or in the current session; with validators, current-session bills are only refreshed if something upstream changed. Once the scheduler's time budget is spent, bills are left for the next run. With a pipeline, the bill's requests run as its stages, side by side '''
+
+    bill = Bill(
+        session_id=session.session_id,
+        bill_id=bill_id,
+        client=session.client
+    )
+    print(bill)
+
+    if journal and journal.is_done('bill', bill_id):
+        return bill
+
+    if not bill.file_exists or session.is_current_session:
+        if scheduler and scheduler.expired():
+            scheduler.defer()
+            return bill
+
+        session_laws = session.session_data.get('session_laws')
+
+        if validators is not None:
+            bill.check_for_changes(validators)
+
+            # the session law number comes from the session, not the bill's routes
+            key = f'session-law:{bill_id}'
+            law_changed, record = validators.check_value(key, session_laws.get(bill_id))
+
+            if law_changed:
+                bill.has_changes = True
+                bill.pending_validators[key] = record
+
+            if bill.file_exists and not bill.has_changes:
+                print(f'No changes upstream, skipping {bill}')
+
+                if journal:
+                    journal.mark_done('bill', bill_id)
+
+                return bill
+
+        if pipeline is not None:
+            pipeline.run({
+                'bill_data': bill.get_bill_data,
+                'audio': bill.get_audio_data,
+                'bill_versions': partial(bill.get_bill_versions, parser=parser, parse_pool=parse_pool),
+                'amendments': bill.get_amendments,
+                'fiscal_notes': bill.get_fiscal_notes,
+                'action_log': partial(bill.get_action_log, votes=votes)
+            })
+
+            for key in BILL_FIELDS:
+                if key in bill.bill_data:
+                    bill.bill_data[key] = bill.bill_data.pop(key)
+        else:
+            bill.get_bill_data()
+            bill.get_audio_data()
+            bill.get_bill_versions(parser=parser, parse_pool=parse_pool)
+            bill.get_amendments()
+            bill.get_fiscal_notes()
+            bill.get_action_log(votes=votes)
+
+        if session_laws.get(bill_id):
+            bill.bill_data['session_law'] = session_laws.get(bill_id)
+
+        bill.write_local_file(compact_text=compact_text)
+
+        if validators is not None:
+            validators.update(bill.pending_validators)
+
+    if journal:
+        journal.mark_done('bill', bill_id)
+
+    return bill
+
+
+def write_run_report(report_file=REPORT_FILE, prometheus_file=None):
+    ''' Save what the crawl's metrics recorded, as JSON and optionally as a Prometheus textfile '''
+
+    print(METRICS)
+
+    METRICS.write_report(report_file)
+
+    if prometheus_file:
+        METRICS.write_prometheus(prometheus_file)
+
+
+def report_bill_refresh(bills):
+    ''' Print how many bills were rewritten vs. skipped as unchanged '''
+
+    refreshed = len([x for x in bills if x.refreshed])
+    skipped = len([x for x in bills if x.has_changes is False and not x.refreshed])
+
+    print(f'Bills: {refreshed:,} refreshed, {skipped:,} skipped as unchanged')
+
+    METRICS.increment('bills_refreshed', refreshed)
+    METRICS.increment('bills_skipped_unchanged', skipped)
+
+    return refreshed, skipped
+
+
+def crawl_committee(session, committee_id, journal=None):
+    ''' Fetch and write one committee if it's new or in the current session '''
+
+    committee = Committee(
+        session_id=session.session_id,
+        committee_id=committee_id,
+        client=session.client
+    )
+
+    print(committee)
+
+    if journal and journal.is_done('committee', committee_id):
+        return committee
+
+    if not committee.file_exists or session.is_current_session:
+        committee.get_committee_data()
+        committee.write_local_file()
+
+    if journal:
+        journal.mark_done('committee', committee_id)
+
+    return committee
+
+
+def gather_session_data(
+    resolver=None,
+    client=DEFAULT_CLIENT,
+    validators=None,
+    parser=DEFAULT_BACKEND,
+    parse_pool=None,
+    journal=None,
+    compact_text=False,
+    scheduler=None,
+    pipeline=None
+):
+    ''' Crawl every session: its metadata, then its legislators, bills and committees, one at a time, or with a pipeline, side by side through the pipeline's stages '''
 
     leg_xwalk = get_legislator_xwalk()
     session_dates = get_session_dates_lookup()
 
-    sessions = requests.get(
-        f'{BASE_URL}/api/Sessions',
-        headers=REQUEST_HEADERS
-    ).json()
+    sessions = client.get(f'{BASE_URL}/api/Sessions').json()
+
+    votes = VoteStore(client=client, max_workers=pipeline.limit('action_log') if pipeline else 1)
 
     for sesh in sessions:
         sesh_id = sesh.get('SessionId')
-        session = Session(
-            session_id=sesh_id,
-            lookup_table=session_dates
-        )
 
-        print(session)
+        if journal and journal.is_done('session', sesh_id):
+            print(f'Already crawled session {sesh_id}, skipping')
+            continue
+
+        if scheduler and scheduler.expired():
+            print('Out of time, leaving the rest of the sessions for the next run')
+            break
+
+        session = crawl_session(sesh_id, session_dates, client=client)
+
+        bill_ids = session.session_data.get('bills')
+
+        if scheduler and session.is_current_session:
+            bill_ids = scheduler.prioritize(bill_ids, session.bill_listing)
+
+        if pipeline is not None:
+            # legislators, committees and bills each have a stage of their
+            # own, so the three run side by side
+            object_tasks = [
+                pipeline.submit(
+                    'legislators',
+                    crawl_legislator,
+                    session,
+                    leg_id,
+                    leg_xwalk,
+                    resolver=resolver,
+                    journal=journal
+                ) for leg_id in session.session_data.get('legislators')
+            ]
+
+            object_tasks.extend(
+                pipeline.submit('committees', crawl_committee, session, committee_id, journal=journal) for committee_id in session.session_data.get('committees')
+            )
 
-        session.get_session_docs()
-        time.sleep(0.5)
+            # each stage works through its queue in order, so bills go in
+            # most recently active first
+            bill_tasks = [
+                pipeline.submit(
+                    'bills',
+                    crawl_bill,
+                    session,
+                    bill_id,
+                    validators=validators,
+                    votes=votes,
+                    parser=parser,
+                    parse_pool=parse_pool,
+                    journal=journal,
+                    compact_text=compact_text,
+                    scheduler=scheduler,
+                    pipeline=pipeline
+                )
+                for bill_id in bill_ids
+            ]
+
+            bills = pipeline.results(bill_tasks)
+            pipeline.results(object_tasks)
+        else:
+            # get Legislator data
+            for leg_id in session.session_data.get('legislators'):
+                crawl_legislator(
+                    session,
+                    leg_id,
+                    leg_xwalk,
+                    resolver=resolver,
+                    journal=journal
+                )
+
+            # get bill data
+            bills = [
+                crawl_bill(
+                    session,
+                    bill_id,
+                    validators=validators,
+                    votes=votes,
+                    parser=parser,
+                    parse_pool=parse_pool,
+                    journal=journal,
+                    compact_text=compact_text,
+                    scheduler=scheduler
+                )
+                for bill_id in bill_ids
+            ]
+
+        # vote IDs don't repeat across sessions
+        votes.clear()
+
+        if validators is not None:
+            report_bill_refresh(bills)
+            validators.save()
+
+        MANIFEST.save()
 
-        session.get_bills()
-        time.sleep(0.5)
+        # get committee data
+        if pipeline is None:
+            for committee_id in session.session_data.get('committees'):
+                crawl_committee(session, committee_id, journal=journal)
+
+        # a session with bills left over gets picked up again next run
+        if journal and not (scheduler and scheduler.expired()):
+            journal.mark_done('session', sesh_id)
+
+    votes.close()
+
+
+async def gather_session_data_async(
+    resolver=None,
+    client=DEFAULT_CLIENT,
+    validators=None,
+    parser=DEFAULT_BACKEND,
+    parse_pool=None,
+    journal=None,
+    compact_text=False,
+    scheduler=None,
+    requests_per_second=8,
+    max_in_flight=8,
+    pipeline=None
+):
+    ''' Same crawl as gather_session_data, but legislators, bills and committees in each session are fetched concurrently. With a pipeline, each bill's requests run through its stages, too '''
+
+    client.rate_limiter.configure(
+        requests_per_second=requests_per_second,
+        max_in_flight=max_in_flight,
+        burst=max_in_flight
+    )
 
-        session.get_legislators()
-        time.sleep(0.5)
+    print(client)
 
-        session.get_committees()
-        time.sleep(0.5)
+    leg_xwalk = get_legislator_xwalk()
+    session_dates = get_session_dates_lookup()
 
-        session.get_session_laws()
-        time.sleep(0.5)
+    loop = asyncio.get_running_loop()
 
-        session.get_conference_committees()
-        time.sleep(0.5)
+    votes = VoteStore(client=client, max_workers=max_in_flight)
 
-        if not session.file_exists or session.is_current_session:
-            session.write_local_file()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
 
-        session_laws = session.session_data.get('session_laws')
+        def run(func, *args, **kwargs):
+            return loop.run_in_executor(
+                executor,
+                partial(func, *args, **kwargs)
+            )
+
+        r = await loop.run_in_executor(executor, client.get, f'{BASE_URL}/api/Sessions')
+        sessions = r.json()
+
+        for sesh in sessions:
+            sesh_id = sesh.get('SessionId')
+
+            if journal and journal.is_done('session', sesh_id):
+                print(f'Already crawled session {sesh_id}, skipping')
+                continue
 
-        # get Legislator data
-        for leg_id in session.session_data.get('legislators'):
-            profile = LegislatorProfile(
-                session_id=sesh_id,
-                legislator_profile_id=leg_id,
-                lookup_table=leg_xwalk,
-                historical_legislator_data=historical_legislator_data
+            if scheduler and scheduler.expired():
+                print('Out of time, leaving the rest of the sessions for the next run')
+                break
+
+            session = await run(
+                crawl_session,
+                sesh_id,
+                session_dates,
+                client=client
+            )
+
+            bill_ids = session.session_data.get('bills')
+
+            if scheduler and session.is_current_session:
+                bill_ids = await run(scheduler.prioritize, bill_ids, session.bill_listing)
+
+            # the executor works through its queue in order, so bills go
+            # in first, most recently active at the front
+            bill_tasks = [
+                run(
+                    crawl_bill,
+                    session,
+                    bill_id,
+                    validators=validators,
+                    votes=votes,
+                    parser=parser,
+                    parse_pool=parse_pool,
+                    journal=journal,
+                    compact_text=compact_text,
+                    scheduler=scheduler,
+                    pipeline=pipeline
+                )
+                for bill_id in bill_ids
+            ]
+
+            tasks = [
+                run(
+                    crawl_legislator,
+                    session,
+                    leg_id,
+                    leg_xwalk,
+                    resolver=resolver,
+                    journal=journal
+                ) for leg_id in session.session_data.get('legislators')
+            ]
+
+            tasks.extend(
+                run(crawl_committee, session, committee_id, journal=journal) for committee_id in session.session_data.get('committees')
             )
 
-            print(profile)
+            await asyncio.gather(*tasks)
+            bills = await asyncio.gather(*bill_tasks)
+
+            votes.clear()
 
-            if not profile.file_exists:
-                profile.get_profile_data()
-                time.sleep(0.5)
+            if validators is not None:
+                report_bill_refresh(bills)
+                validators.save()
 
-                profile.get_canonical_id()
-                profile.write_local_file()
+            MANIFEST.save()
 
-                time.sleep(0.5)
+            if journal and not (scheduler and scheduler.expired()):
+                journal.mark_done('session', sesh_id)
 
-        # get bill data
-        for bill_id in session.session_data.get('bills'):
-            bill = Bill(session_id=sesh_id, bill_id=bill_id)
-            print(bill)
+    votes.close()
 
-            if not bill.file_exists or session.is_current_session:
-                bill.get_bill_data()
-                time.sleep(0.5)
 
-                bill.get_audio_data()
-                time.sleep(0.5)
+if __name__ == '__main__':
 
-                bill.get_bill_versions()
-                time.sleep(0.5)
+    parser = argparse.ArgumentParser(description='Crawl the S.D. Legislature API')
 
-                bill.get_amendments()
-                time.sleep(0.5)
+    parser.add_argument(
+        '--concurrent',
+        action='store_true',
+        help='Fetch legislators, bills and committees concurrently'
+    )
 
-                bill.get_fiscal_notes()
-                time.sleep(0.5)
+    parser.add_argument(
+        '--pipeline',
+        action='store_true',
+        help='Crawl legislators, bills and committees side by side, and each bill\'s requests as stages with their own concurrency limits; see crawler/pipeline.py'
+    )
 
-                bill.get_action_log()
-                time.sleep(0.5)
+    parser.add_argument(
+        '--stage-limit',
+        type=stage_limit,
+        action='append',
+        default=[],
+        metavar='STAGE=N',
+        help=f'Concurrency limit for one --pipeline stage, e.g. bill_versions=6; can be repeated. Stages: {", ".join(CRAWL_STAGES)}'
+    )
 
-                if session_laws.get(bill_id):
-                    bill.bill_data['session_law'] = session_laws.get(bill_id)
+    parser.add_argument(
+        '--requests-per-second',
+        type=float,
+        default=8,
+        help='Top request rate for --concurrent and --pipeline crawls; the rate adapts below it to how the server is responding'
+    )
 
-                bill.write_local_file()
+    parser.add_argument(
+        '--max-in-flight',
+        type=int,
+        default=8,
+        help='Most requests allowed in flight at once for --concurrent and --pipeline crawls'
+    )
 
-        # get committee data
-        for committee_id in session.session_data.get('committees'):
-            committee = Committee(
-                session_id=sesh_id,
-                committee_id=committee_id
-            )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Only rewrite current-session bills that changed upstream since the last run, and skip bulk payloads that haven\'t changed'
+    )
 
-            print(committee)
+    parser.add_argument(
+        '--cache',
+        action='store_true',
+        help='Keep responses in an on-disk cache under crawler/.cache and reuse them while fresh'
+    )
 
-            if not committee.file_exists or session.is_current_session:
-                committee.get_committee_data()
-                committee.write_local_file()
+    parser.add_argument(
+        '--cache-size',
+        type=int,
+        default=2048,
+        help='Megabytes the response cache may hold before least-recently-used entries are evicted'
+    )
 
-        time.sleep(0.5)
+    parser.add_argument(
+        '--offline',
+        action='store_true',
+        help='Replay a crawl entirely from the response cache, without touching the network'
+    )
 
+    parser.add_argument(
+        '--parser',
+        choices=sorted(PARSER_BACKENDS),
+        default=DEFAULT_BACKEND,
+        help='Backend for pulling bill text out of HTML; see crawler/bench_parsers.py'
+    )
 
+    parser.add_argument(
+        '--parse-workers',
+        type=int,
+        default=0,
+        help='Processes that parse bill text while fetchers keep downloading; 0 parses in the crawl threads'
+    )
 
-if __name__ == '__main__':
+    parser.add_argument(
+        '--parse-queue',
+        type=int,
+        help='Bill documents allowed to wait for a parse worker before fetchers pause (default: 4 per worker)'
+    )
+
+    parser.add_argument(
+        '--compact-text',
+        action='store_true',
+        help='Store each bill version after the first as a delta from the one before it; see crawler/bill_text.py'
+    )
+
+    parser.add_argument(
+        '--time-budget',
+        type=float,
+        help='Minutes to spend crawling bills, most recently active first; whatever is left waits for the next run'
+    )
+
+    parser.add_argument(
+        '--no-resume',
+        action='store_true',
+        help="Start from the first session even if the last crawl didn't finish"
+    )
+
+    parser.add_argument(
+        '--resume-within',
+        type=float,
+        default=36,
+        help='Hours a checkpoint stays good; older finished units are crawled again. Keep it longer than the time between scheduled runs'
+    )
+
+    parser.add_argument(
+        '--export',
+        action='store_true',
+        help='After the crawl, update the SQLite export of the archive; see crawler/export.py'
+    )
+
+    parser.add_argument(
+        '--report',
+        default=REPORT_FILE,
+        help='Where to save the JSON run report of request latencies, bytes, retries, cache hits and parse/write timings'
+    )
+
+    parser.add_argument(
+        '--prometheus',
+        metavar='PATH',
+        help='Also save the run\'s metrics as a Prometheus textfile, e.g. for node_exporter\'s textfile collector'
+    )
+
+    parser.add_argument(
+        '--pool-size',
+        type=int,
+        default=10,
+        help='Keep-alive connections held open to sdlegislature.gov'
+    )
+
+    parser.add_argument(
+        '--max-attempts',
+        type=int,
+        default=5,
+        help='Tries per request on 429s, 5xx errors and dropped connections, backing off between them'
+    )
+
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        default=60,
+        help='Seconds to wait on a response before giving up'
+    )
+
+    args = parser.parse_args()
 
     objects = [
         'sessions',
@@ -248,18 +767,121 @@ if __name__ == '__main__':
 
     for obj in objects:
 
-        data_path = os.path.abspath(
-            os.path.join(
-                os.path.dirname( __file__ ),
-                '..',
-                'data',
-                obj
-            )
-        )
+        data_path = os.path.join(DATA_DIR, obj)
 
         if not os.path.exists(data_path):
             os.makedirs(data_path)
 
-    historical_legislator_data = gather_historical_legislator_data()
-    
-    gather_session_data(historical_legislator_data=historical_legislator_data)
+    # written however the run ends
+    atexit.register(write_run_report, args.report, args.prometheus)
+
+    # counts and sizes of the data files, for the README; listed once from
+    # a scan, then kept up to date as files are written
+    if not os.path.exists(MANIFEST_FILE):
+        MANIFEST.rebuild()
+
+    atexit.register(MANIFEST.save)
+
+    cache = None
+
+    if args.cache or args.offline:
+        cache = ResponseCache(max_bytes=args.cache_size * 1024 ** 2)
+
+    with Client(
+        headers=REQUEST_HEADERS,
+        pool_size=max(args.pool_size, args.max_in_flight),
+        timeout=(10, args.timeout),
+        retry=RetryPolicy(max_attempts=args.max_attempts),
+        cache=cache,
+        offline=args.offline
+    ) as client:
+
+        validators = ValidatorStore() if args.incremental else None
+        fingerprints = FingerprintStore() if args.incremental else None
+
+        # built once, so unmapped profiles are matched by index lookups
+        resolver = LegislatorResolver(gather_historical_legislator_data(client=client, fingerprints=fingerprints))
+
+        if fingerprints is not None:
+            print(fingerprints)
+            fingerprints.save()
+
+        if args.no_resume and os.path.exists(CHECKPOINT_FILE):
+            os.remove(CHECKPOINT_FILE)
+
+        journal = CheckpointJournal(max_age_hours=args.resume_within)
+
+        scheduler = BillScheduler(time_budget=args.time_budget * 60 if args.time_budget else None)
+        print(scheduler)
+
+        parse_pool = None
+
+        if args.parse_workers:
+            parse_pool = ParsePool(workers=args.parse_workers, max_pending=args.parse_queue)
+            print(parse_pool)
+
+        pipeline = None
+
+        if args.pipeline:
+            pipeline = Pipeline(limits=args.stage_limit)
+
+            # the concurrent crawl sets its own
+            if not args.concurrent:
+                client.rate_limiter.configure(
+                    requests_per_second=args.requests_per_second,
+                    max_in_flight=args.max_in_flight,
+                    burst=args.max_in_flight
+                )
+
+        with METRICS.timer('crawl'):
+            if args.concurrent:
+                asyncio.run(
+                    gather_session_data_async(
+                        resolver=resolver,
+                        client=client,
+                        validators=validators,
+                        parser=args.parser,
+                        parse_pool=parse_pool,
+                        journal=journal,
+                        compact_text=args.compact_text,
+                        scheduler=scheduler,
+                        requests_per_second=args.requests_per_second,
+                        max_in_flight=args.max_in_flight,
+                        pipeline=pipeline
+                    )
+                )
+            else:
+                gather_session_data(
+                    resolver=resolver,
+                    client=client,
+                    validators=validators,
+                    parser=args.parser,
+                    parse_pool=parse_pool,
+                    journal=journal,
+                    compact_text=args.compact_text,
+                    scheduler=scheduler,
+                    pipeline=pipeline
+                )
+
+        if scheduler.expired():
+            # keep the journal so the next run starts with what's left
+            print(scheduler)
+            journal.close()
+        else:
+            journal.finish()
+
+        if parse_pool:
+            parse_pool.close()
+
+        if pipeline:
+            print(pipeline)
+            pipeline.close()
+
+        print(resolver)
+
+        if resolver.proposals:
+            print('Run crawler/xwalk.py to write proposed crosswalk rows for review')
+
+    if args.export:
+        with METRICS.timer('export'):
+            export_sqlite()
@@ -0,0 +1,219 @@
+# flake8: noqa
+
+import os
+import re
+import json
+import glob
+import argparse
+import threading
+from datetime import datetime, timezone
+
+from storage import write_atomic
+
+
+DATA_DIR = os.path.abspath(
+    os.path.join(
+        os.path.dirname( __file__ ),
+        '..',
+        'data'
+    )
+)
+
+MANIFEST_FILE = os.path.join(DATA_DIR, 'manifest.json')
+
+# data files the manifest tracks, by path relative to the data directory;
+# anything else (the historical legislators list, seating charts) isn't
+# one of the archive's objects
+DATA_FILE_RE = re.compile(r'^(sessions|bills|legislators|committees)/sd-legislature-(?:session|bill|legislator|committee)-(\d+)\.json$')
+
+OBJECT_TYPES = ['sessions', 'bills', 'legislators', 'committees']
+
+
+def utc_now():
+    return datetime.now(timezone.utc).replace(microsecond=0).isoformat()
+
+
+def empty_stats():
+    return {
+        'types': {x: {'count': 0, 'bytes': 0, 'last_updated': None} for x in OBJECT_TYPES},
+        'sessions': {}
+    }
+
+
+def empty_session_stats(name=None):
+    return {
+        'name': name,
+        **{x: 0 for x in OBJECT_TYPES if x != 'sessions'},
+        'bytes': 0,
+        'last_updated': None
+    }
+
+
+class Manifest(object):
+    ''' Counts, bytes and last-updated times of the data files by object type and by session, kept up to date as the crawler writes them, for the README '''
+
+    def __init__(self, filepath=MANIFEST_FILE, data_dir=DATA_DIR):
+        self.filepath = filepath
+        self.data_dir = data_dir
+        self.lock = threading.Lock()
+
+        # read from file the first time something needs it
+        self.totals = None
+        self.dirty = False
+
+    def load(self):
+        ''' Read the saved manifest, if there is one and it hasn't been read yet '''
+
+        with self.lock:
+            if self.totals is not None:
+                return
+
+            try:
+                with open(self.filepath, 'r') as infile:
+                    saved = json.load(infile)['stats']
+            except FileNotFoundError:
+                saved = empty_stats()
+
+            self.totals = {
+                'types': saved['types'],
+                'sessions': saved['sessions']
+            }
+
+    def relative_path(self, filepath):
+        ''' A data file's path relative to the data directory, or None if it isn't an archive object '''
+
+        path = os.path.relpath(os.path.abspath(filepath), self.data_dir).replace(os.sep, '/')
+
+        return path if DATA_FILE_RE.match(path) else None
+
+    def record(self, filepath, data, size, previous_size=None, changed=True):
+        ''' Note a data file that was just written, given the size it had before (None for a new file). Unchanged files need nothing '''
+
+        path = self.relative_path(filepath)
+
+        if not path or not changed:
+            return
+
+        self.load()
+
+        object_type = path.split('/')[0]
+        session_id = str(data.get('session_id')) if isinstance(data, dict) and data.get('session_id') is not None else None
+        updated = utc_now()
+
+        with self.lock:
+            totals = [self.totals['types'][object_type]]
+
+            if session_id:
+                totals.append(self.totals['sessions'].setdefault(session_id, empty_session_stats()))
+
+            for stats in totals:
+                stats['bytes'] += size - (previous_size or 0)
+                stats['last_updated'] = updated
+
+                if previous_size is None:
+                    if stats is totals[0]:
+                        stats['count'] += 1
+                    elif object_type != 'sessions':
+                        stats[object_type] += 1
+
+            if object_type == 'sessions' and data.get('session_name'):
+                self.totals['sessions'][session_id]['name'] = data.get('session_name')
+
+            self.dirty = True
+
+    def files(self):
+        ''' Relative path, session ID, bytes and last-modified time of every data file, from a scan of the data directory '''
+
+        for object_type in OBJECT_TYPES:
+            for filepath in sorted(glob.iglob(os.path.join(self.data_dir, object_type, '*.json'))):
+                path = self.relative_path(filepath)
+
+                if not path:
+                    continue
+
+                with open(filepath, 'r') as infile:
+                    data = json.load(infile)
+
+                session_id = str(data.get('session_id')) if data.get('session_id') is not None else None
+                modified = datetime.fromtimestamp(os.path.getmtime(filepath), timezone.utc).replace(microsecond=0).isoformat()
+
+                yield path, session_id, os.path.getsize(filepath), modified, data
+
+    def rebuild(self):
+        ''' Start over from a scan of the data directory, e.g. the first time or after files were removed by hand '''
+
+        totals = empty_stats()
+
+        for path, session_id, size, modified, data in self.files():
+            object_type = path.split('/')[0]
+
+            stats = [totals['types'][object_type]]
+
+            if session_id:
+                stats.append(totals['sessions'].setdefault(session_id, empty_session_stats()))
+
+            for x in stats:
+                x['bytes'] += size
+                x['last_updated'] = max(x['last_updated'] or modified, modified)
+
+                if x is stats[0]:
+                    x['count'] += 1
+                elif object_type != 'sessions':
+                    x[object_type] += 1
+
+            if object_type == 'sessions' and data.get('session_name'):
+                totals['sessions'][session_id]['name'] = data.get('session_name')
+
+        with self.lock:
+            self.totals = totals
+            self.dirty = True
+
+    def stats(self):
+        ''' Counts, bytes and last-updated times by object type and by session '''
+
+        self.load()
+
+        with self.lock:
+            types = {x: dict(y) for x, y in self.totals['types'].items()}
+            sessions = {x: dict(y) for x, y in self.totals['sessions'].items()}
+
+        return {
+            'updated_at': max((x['last_updated'] for x in types.values() if x['last_updated']), default=None),
+            'total_bytes': sum(x['bytes'] for x in types.values()),
+            'types': types,
+            'sessions': dict(sorted(sessions.items(), key=lambda x: int(x[0])))
+        }
+
+    def save(self, force=False):
+        ''' Write the manifest if anything changed '''
+
+        if self.totals is None or not (self.dirty or force):
+            return
+
+        stats = self.stats()
+
+        with self.lock:
+            self.dirty = False
+
+        write_atomic(self.filepath, [json.dumps({'stats': stats}, indent=2) + '\n'])
+
+    def __str__(self):
+        stats = self.stats()
+
+        return f'Archive manifest - {sum(x["count"] for x in stats["types"].values()):,} files - {self.filepath}'
+
+
+# shared by every writer in a crawl, like metrics.METRICS
+MANIFEST = Manifest()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Rebuild the archive manifest from a scan of the data directory')
+
+    parser.parse_args()
+
+    MANIFEST.rebuild()
+    MANIFEST.save()
+
+    print(MANIFEST)
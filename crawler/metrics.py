@@ -0,0 +1,255 @@
+# flake8: noqa
+
+import os
+import re
+import json
+import time
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import urlparse
+
+from storage import write_atomic
+
+
+REPORT_FILE = os.path.abspath(
+    os.path.join(
+        os.path.dirname( __file__ ),
+        'state',
+        'run-report.json'
+    )
+)
+
+# upper bounds, in seconds, of the latency histogram buckets in the
+# Prometheus export
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+ID_RE = re.compile(r'/\d+(?=/|$)')
+
+
+def route_for(url):
+    ''' The API route a URL belongs to, with IDs and query strings left out: /api/Bills/HTML/{id} '''
+
+    return ID_RE.sub('/{id}', urlparse(url).path)
+
+
+def percentile(values, pct):
+    ''' Nearest-rank percentile of a sorted list '''
+
+    if not values:
+        return None
+
+    rank = max(int(round(pct / 100 * len(values))) - 1, 0)
+
+    return round(values[min(rank, len(values) - 1)], 4)
+
+
+def summarize(values):
+    ''' Count, total and spread of a list of timings, in seconds '''
+
+    values = sorted(values)
+
+    return {
+        'count': len(values),
+        'total_seconds': round(sum(values), 4),
+        'mean_seconds': round(sum(values) / len(values), 4) if values else None,
+        'p50_seconds': percentile(values, 50),
+        'p90_seconds': percentile(values, 90),
+        'p99_seconds': percentile(values, 99),
+        'max_seconds': round(values[-1], 4) if values else None
+    }
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics(object):
+    ''' Thread-safe counters and timings for a crawl: requests by API route, cache hits, and how long parsing, writing and the other stages took '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        ''' Start counting from zero '''
+
+        with self.lock:
+            self.started_at = datetime.now()
+            self.start = time.monotonic()
+
+            self.latencies = defaultdict(list)
+            self.statuses = defaultdict(lambda: defaultdict(int))
+            self.response_bytes = defaultdict(int)
+            self.retries = defaultdict(int)
+            self.cache_hits = defaultdict(int)
+            self.cache_misses = defaultdict(int)
+
+            # stage name -> seconds each time it ran
+            self.timings = defaultdict(list)
+            self.counters = defaultdict(int)
+
+    def observe_request(self, url, seconds, status_code, size=0, retries=0):
+        ''' Record one request that went over the network; status_code is None if it never got a response '''
+
+        route = route_for(url)
+
+        with self.lock:
+            self.latencies[route].append(seconds)
+            self.statuses[route][status_code or 'error'] += 1
+            self.response_bytes[route] += size
+            self.retries[route] += retries
+
+    def observe_cache(self, url, hit):
+        ''' Record a response cache lookup '''
+
+        route = route_for(url)
+
+        with self.lock:
+            if hit:
+                self.cache_hits[route] += 1
+            else:
+                self.cache_misses[route] += 1
+
+    def observe(self, stage, seconds):
+        ''' Record how long one run of a stage took '''
+
+        with self.lock:
+            self.timings[stage].append(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        ''' Time the enclosed block as one run of a stage '''
+
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def increment(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def report(self):
+        ''' Everything recorded so far, as a dict ready for JSON '''
+
+        with self.lock:
+            routes = sorted(set(self.latencies) | set(self.cache_hits) | set(self.cache_misses))
+
+            return {
+                'started_at': self.started_at.isoformat(),
+                'finished_at': datetime.now().isoformat(),
+                'duration_seconds': round(time.monotonic() - self.start, 2),
+                'requests': sum(len(x) for x in self.latencies.values()),
+                'response_bytes': sum(self.response_bytes.values()),
+                'retries': sum(self.retries.values()),
+                'cache_hits': sum(self.cache_hits.values()),
+                'cache_misses': sum(self.cache_misses.values()),
+                'routes': {
+                    route: {
+                        **summarize(self.latencies[route]),
+                        'statuses': {str(k): v for k, v in sorted(self.statuses[route].items(), key=str)},
+                        'response_bytes': self.response_bytes[route],
+                        'retries': self.retries[route],
+                        'cache_hits': self.cache_hits[route],
+                        'cache_misses': self.cache_misses[route]
+                    } for route in routes
+                },
+                'stages': {
+                    stage: summarize(values) for stage, values in sorted(self.timings.items())
+                },
+                'counters': dict(sorted(self.counters.items()))
+            }
+
+    def write_report(self, filepath=REPORT_FILE):
+        ''' Save the run report as JSON '''
+
+        write_atomic(filepath, [json.dumps(self.report(), indent=2)])
+
+        print(f'Wrote run report to {filepath}')
+
+    def prometheus_lines(self):
+        ''' The run's metrics in the Prometheus text exposition format '''
+
+        report = self.report()
+
+        lines = [
+            '# HELP sd_legislature_crawl_duration_seconds How long the crawl ran',
+            '# TYPE sd_legislature_crawl_duration_seconds gauge',
+            f'sd_legislature_crawl_duration_seconds {report["duration_seconds"]}',
+            '# HELP sd_legislature_crawl_requests_total API requests sent, by route and status',
+            '# TYPE sd_legislature_crawl_requests_total counter'
+        ]
+
+        for route, stats in report['routes'].items():
+            for status, count in stats['statuses'].items():
+                lines.append(f'sd_legislature_crawl_requests_total{{route="{escape_label(route)}",status="{status}"}} {count}')
+
+        lines.extend([
+            '# HELP sd_legislature_crawl_request_duration_seconds API request latency, by route',
+            '# TYPE sd_legislature_crawl_request_duration_seconds histogram'
+        ])
+
+        with self.lock:
+            latencies = {k: list(v) for k, v in self.latencies.items()}
+
+        for route, values in sorted(latencies.items()):
+            label = escape_label(route)
+
+            for bound in LATENCY_BUCKETS:
+                count = len([x for x in values if x <= bound])
+                lines.append(f'sd_legislature_crawl_request_duration_seconds_bucket{{route="{label}",le="{bound}"}} {count}')
+
+            lines.append(f'sd_legislature_crawl_request_duration_seconds_bucket{{route="{label}",le="+Inf"}} {len(values)}')
+            lines.append(f'sd_legislature_crawl_request_duration_seconds_sum{{route="{label}"}} {sum(values)}')
+            lines.append(f'sd_legislature_crawl_request_duration_seconds_count{{route="{label}"}} {len(values)}')
+
+        for name, key, help_text in (
+            ('response_bytes_total', 'response_bytes', 'Response body bytes received, by route'),
+            ('retries_total', 'retries', 'Requests retried, by route'),
+            ('cache_hits_total', 'cache_hits', 'Responses served from the cache, by route'),
+            ('cache_misses_total', 'cache_misses', 'Cache lookups that went to the network, by route')
+        ):
+            lines.append(f'# HELP sd_legislature_crawl_{name} {help_text}')
+            lines.append(f'# TYPE sd_legislature_crawl_{name} counter')
+
+            for route, stats in report['routes'].items():
+                lines.append(f'sd_legislature_crawl_{name}{{route="{escape_label(route)}"}} {stats[key]}')
+
+        lines.extend([
+            '# HELP sd_legislature_crawl_stage_seconds Time spent in each stage of the crawl',
+            '# TYPE sd_legislature_crawl_stage_seconds summary'
+        ])
+
+        for stage, stats in report['stages'].items():
+            lines.append(f'sd_legislature_crawl_stage_seconds_sum{{stage="{escape_label(stage)}"}} {stats["total_seconds"]}')
+            lines.append(f'sd_legislature_crawl_stage_seconds_count{{stage="{escape_label(stage)}"}} {stats["count"]}')
+
+        lines.extend([
+            '# HELP sd_legislature_crawl_events_total Other things counted during the crawl',
+            '# TYPE sd_legislature_crawl_events_total counter'
+        ])
+
+        for name, count in report['counters'].items():
+            lines.append(f'sd_legislature_crawl_events_total{{event="{escape_label(name)}"}} {count}')
+
+        return lines
+
+    def write_prometheus(self, filepath):
+        ''' Save the run's metrics as a Prometheus textfile, swapped into place so a node_exporter scrape never sees half a file '''
+
+        write_atomic(filepath, ['\n'.join(self.prometheus_lines()) + '\n'])
+
+        print(f'Wrote Prometheus metrics to {filepath}')
+
+    def __str__(self):
+        report = self.report()
+
+        return f'Crawl metrics - {report["requests"]:,} requests, {report["response_bytes"] / 1024 ** 2:,.1f} MB, {report["retries"]:,} retries, {report["cache_hits"]:,} cache hits'
+
+
+# shared by everything in a crawl, like models.DEFAULT_CLIENT
+METRICS = Metrics()
@@ -2,19 +2,38 @@
 
 import os
 import json
-import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
-from bs4 import BeautifulSoup
+
+from bill_text import compact_bill_versions
+from client import Client
+from metrics import METRICS
+from parsers import DEFAULT_BACKEND, parse_bill_html
+from storage import write_json_atomic
 
 
 BASE_URL = 'https://sdlegislature.gov'
+
+# where every object's data file is written
+DATA_DIR = os.path.abspath(
+    os.path.join(
+        os.path.dirname( __file__ ),
+        '..',
+        'data'
+    )
+)
+
 USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36'
 
 REQUEST_HEADERS = {
     'User-Agent': USER_AGENT
 }
 
+# used by any object that isn't handed a client of its own
+DEFAULT_CLIENT = Client(headers=REQUEST_HEADERS)
+
 
 class Session(object):
     ''' A session of the S.D. Legislature '''
@@ -23,23 +42,17 @@ class Session(object):
         self,
         session_id,
         lookup_table={},
-        historical_legislator_data=None
+        historical_legislator_data=None,
+        client=None
     ):
         self.session_id = session_id
         self.lookup_table = lookup_table
         self.historical_legislator_data = historical_legislator_data
+        self.client = client or DEFAULT_CLIENT
 
         self.api_route = f'{BASE_URL}/api/Sessions/{self.session_id}'
 
-        self.local_file = os.path.abspath(
-            os.path.join(
-                os.path.dirname( __file__ ),
-                '..',
-                'data',
-                'sessions',
-                f'sd-legislature-session-{self.session_id}.json'
-            )
-        )
+        self.local_file = os.path.join(DATA_DIR, 'sessions', f'sd-legislature-session-{self.session_id}.json')
 
         self.file_exists = os.path.exists(self.local_file)
 
@@ -52,10 +65,7 @@ class Session(object):
     def get_session_data(self):
         ''' Get basic data on this session '''
 
-        r = requests.get(
-            self.api_route,
-            headers=REQUEST_HEADERS
-        )
+        r = self.client.get(self.api_route)
 
         r.raise_for_status()
 
@@ -89,10 +99,7 @@ class Session(object):
         doctypes = [24, 68, 60, 71, 72, 73, 74]
         querystring = f'SessionIds={self.session_id}&{"&".join([f"Type={x}" for x in doctypes])}'
 
-        r = requests.get(
-            f'{docs_url}{querystring}',
-            headers=REQUEST_HEADERS
-        )
+        r = self.client.get(f'{docs_url}{querystring}')
         r.raise_for_status()
 
         data = r.json()
@@ -122,24 +129,21 @@ class Session(object):
     def get_bills(self):
         ''' Get a list of IDs of bills in this session '''
 
-        r = requests.get(
-            f'{BASE_URL}/api/Bills/Session/Light/{self.session_id}',
-            headers=REQUEST_HEADERS
-        )
+        r = self.client.get(f'{BASE_URL}/api/Bills/Session/Light/{self.session_id}')
 
         r.raise_for_status()
 
-        self.session_data['bills'] = [x.get('BillId') for x in r.json()]
+        # kept for the scheduler, which looks for dates in it
+        self.bill_listing = r.json()
+
+        self.session_data['bills'] = [x.get('BillId') for x in self.bill_listing]
 
         return self
 
     def get_legislators(self):
         ''' Get IDs of legislator profiles for this session '''
 
-        r = requests.get(
-            f'{BASE_URL}/api/SessionMembers/Session/{self.session_id}',
-            headers=REQUEST_HEADERS
-        )
+        r = self.client.get(f'{BASE_URL}/api/SessionMembers/Session/{self.session_id}')
 
         r.raise_for_status()
 
@@ -150,10 +154,7 @@ class Session(object):
     def get_committees(self):
         ''' Get IDs of committees for this session '''
 
-        r = requests.get(
-            f'{BASE_URL}/api/SessionCommittees/Session/{self.session_id}',
-            headers=REQUEST_HEADERS
-        )
+        r = self.client.get(f'{BASE_URL}/api/SessionCommittees/Session/{self.session_id}')
 
         r.raise_for_status()
 
@@ -164,10 +165,7 @@ class Session(object):
     def get_conference_committees(self):
         ''' Get details on conference committees for this session '''
 
-        r = requests.get(
-            f'{BASE_URL}/api/ConferenceCommittees/Session/{self.session_id}',
-            headers=REQUEST_HEADERS
-        )
+        r = self.client.get(f'{BASE_URL}/api/ConferenceCommittees/Session/{self.session_id}')
 
         r.raise_for_status()
 
@@ -206,10 +204,7 @@ class Session(object):
     def get_session_laws(self):
         ''' Map bill IDs to session laws passed during this session '''
 
-        r = requests.get(
-            f'{BASE_URL}/api/SessionLaws/{self.session_id}',
-            headers=REQUEST_HEADERS
-        )
+        r = self.client.get(f'{BASE_URL}/api/SessionLaws/{self.session_id}')
 
         r.raise_for_status()
         data = r.json()
@@ -223,47 +218,198 @@ class Session(object):
         return self
 
     def write_local_file(self):
-        ''' Write session data to file '''
+        ''' Write session data to file, unless it's unchanged '''
 
-        with open(self.local_file, 'w') as outfile:
-            json.dump(self.session_data, outfile)
-
-        print(f'Downloaded {self.local_file}')
+        if write_json_atomic(self.local_file, self.session_data):
+            print(f'Downloaded {self.local_file}')
+        else:
+            print(f'No changes to {self.local_file}')
 
     def __str__(self):
         return f'{self.name} session - South Dakota Legislature ({self.session_id})'
 
 
+class VoteStore(object):
+    ''' Roll calls keyed by vote ID, shared by every Bill in a crawl so each vote is fetched once '''
+
+    def __init__(self, client=None, max_workers=4):
+        self.client = client or DEFAULT_CLIENT
+        self.roll_calls = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+
+        # requests still go through the client's rate limiter
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def load_bill_file(self, filepath):
+        ''' Seed the store with roll calls already saved in a bill's file; votes don't change once taken '''
+
+        try:
+            with open(filepath, 'r') as infile:
+                bill_data = json.load(infile)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return self
+
+        with self.lock:
+            for action in bill_data.get('action_log', []):
+                vote = action.get('vote')
+
+                if not vote or vote.get('vote_id') is None:
+                    continue
+
+                self.roll_calls[vote.get('vote_id')] = {
+                    k: v for k, v in vote.items() if k not in ('vote_id', 'president_vote')
+                }
+
+        return self
+
+    def fetch_roll_call(self, vote_id):
+        ''' Get the roll call for one vote, as lists of legislator profile IDs keyed by how they voted '''
+
+        r = self.client.get(f'{BASE_URL}/api/Votes/{vote_id}')
+
+        r.raise_for_status()
+
+        roll_call = {}
+
+        for rc in r.json().get('RollCalls'):
+            key = rc.get('Vote1')
+
+            if not roll_call.get(key):
+                roll_call[key] = []
+
+            roll_call[key].append(rc.get('SessionMemberId'))
+
+        return roll_call
+
+    def get_many(self, vote_ids):
+        ''' Return roll calls for these votes, fetching any we don't have concurrently '''
+
+        results = {}
+        futures = {}
+
+        with self.lock:
+            for vote_id in dict.fromkeys(vote_ids):
+                if vote_id in self.roll_calls:
+                    results[vote_id] = self.roll_calls[vote_id]
+                    continue
+
+                # another bill may already be fetching this one
+                if vote_id not in self.pending:
+                    self.pending[vote_id] = self.executor.submit(self.fetch_roll_call, vote_id)
+
+                futures[vote_id] = self.pending[vote_id]
+
+        for vote_id, future in futures.items():
+            try:
+                roll_call = future.result()
+            except BaseException:
+                # let the next caller try again
+                with self.lock:
+                    if self.pending.get(vote_id) is future:
+                        del self.pending[vote_id]
+                raise
+
+            # stored and taken off pending together, so no other caller
+            # finds it in neither and fetches it again
+            with self.lock:
+                self.roll_calls[vote_id] = roll_call
+
+                if self.pending.get(vote_id) is future:
+                    del self.pending[vote_id]
+
+            results[vote_id] = roll_call
+
+        return {x: results[x] for x in vote_ids}
+
+    def clear(self):
+        ''' Forget stored roll calls, e.g. between sessions. Calls to get_many() still running keep the roll calls they asked for '''
+
+        with self.lock:
+            self.roll_calls = {}
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __len__(self):
+        return len(self.roll_calls)
+
+    def __str__(self):
+        return f'{len(self):,} stored roll calls'
+
+
 class Bill(object):
     ''' A bill introduced during a particular Session '''
 
-    def __init__(self, session_id=None, bill_id=None):
+    def __init__(self, session_id=None, bill_id=None, client=None):
         self.bill_id = bill_id
         self.session_id = session_id
+        self.client = client or DEFAULT_CLIENT
         self.api_route = f'{BASE_URL}/api/Bills/{self.bill_id}'
 
-        self.local_file = os.path.abspath(
-            os.path.join(
-                os.path.dirname( __file__ ),
-                '..',
-                'data',
-                'bills',
-                f'sd-legislature-bill-{self.bill_id}.json'
-            )
-        )
+        self.local_file = os.path.join(DATA_DIR, 'bills', f'sd-legislature-bill-{self.bill_id}.json')
 
         self.rss_feed = f'https://sdlegislature.gov/api/Bills/RSS/{bill_id}'
 
         self.file_exists = os.path.exists(self.local_file)
 
+        # these routes change whenever anything about the bill does; version
+        # text and roll calls hang off them by ID and never change once published
+        self.index_routes = [
+            self.api_route,
+            f'{BASE_URL}/api/Bills/Audio/{self.bill_id}',
+            f'{BASE_URL}/api/Bills/Versions/{self.bill_id}',
+            f'{BASE_URL}/api/Bills/Amendments/{self.bill_id}',
+            f'{BASE_URL}/api/Bills/FiscalNotes/{self.bill_id}',
+            f'{BASE_URL}/api/Bills/ActionLog/{self.bill_id}'
+        ]
+
+        # responses from check_for_changes(), reused by the get_* methods
+        self.prefetched = {}
+        self.pending_validators = {}
+
+        self.has_changes = None
+        self.refreshed = False
+
+    def fetch(self, url):
+        ''' GET a URL, reusing a response from check_for_changes() if there is one '''
+
+        response = self.prefetched.pop(url, None)
+
+        if response is not None:
+            return response
+
+        return self.client.get(url)
+
+    def check_for_changes(self, validators):
+        ''' Conditionally request this bill's index routes and see if any changed since the last refresh '''
+
+        self.has_changes = False
+
+        for url in self.index_routes:
+            r = self.client.get(
+                url,
+                headers=validators.conditional_headers(url)
+            )
+
+            changed, record = validators.check(url, r)
+
+            if not changed:
+                continue
+
+            self.has_changes = True
+
+            if r.ok:
+                self.prefetched[url] = r
+                self.pending_validators[url] = record
+
+        return self.has_changes
+
 
     def get_bill_data(self):
         ''' Get basic details on this bill '''
 
-        r = requests.get(
-            self.api_route,
-            headers=REQUEST_HEADERS
-        )
+        r = self.fetch(self.api_route)
 
         try:
             r.raise_for_status()
@@ -307,10 +453,7 @@ class Bill(object):
 
         url = f'{BASE_URL}/api/Bills/Audio/{self.bill_id}'
 
-        r = requests.get(
-            url,
-            headers=REQUEST_HEADERS
-        )
+        r = self.fetch(url)
 
         try:
             r.raise_for_status()
@@ -333,45 +476,10 @@ class Bill(object):
 
         return self
 
-    def get_bill_versions(self):
-
-        ''' Gather details on each version of the bill considered '''
-        def parse_bill_html(html):
-
-            soup = BeautifulSoup(html, 'html.parser')
-
-            # new style
-            div = soup.find('div', {'title': 'header'})
+    def get_bill_versions(self, parser=DEFAULT_BACKEND, parse_pool=None):
+        ''' Gather details on each version of the bill considered; parser names a backend in parsers.PARSER_BACKENDS, and a parsers.ParsePool parses text in other processes while the next version downloads '''
 
-            if div:
-                # nuke the header and footer and "unsupported" divs
-                div.extract()
-                footer = soup.find('div', {'title': 'footer'})
-
-                if footer:
-                    footer.extract()
-                unsupported = soup.find('div', {'id': 'unsupported'})
-
-                if unsupported:
-                    unsupported.extract()
-                grafs = [x.text.strip() for x in soup.find_all('p')]
-                bill_text_raw = ' '.join(grafs)
-            else:
-                # old style
-                try:
-                    div = soup.find_all('table')[0].parent
-                    for table in div.find_all('table'):
-                        table.extract()
-                    bill_text_raw = ' '.join([x.text.strip() for x in div.find_all('div')])
-                except IndexError:
-                    return ''
-
-            return ' '.join(bill_text_raw.split())
-
-        r = requests.get(
-            f'{BASE_URL}/api/Bills/Versions/{self.bill_id}',
-            headers=REQUEST_HEADERS
-        )
+        r = self.fetch(f'{BASE_URL}/api/Bills/Versions/{self.bill_id}')
 
         try:
             r.raise_for_status()
@@ -381,6 +489,7 @@ class Bill(object):
 
         data = r.json()
         data_out = []
+        parsing = []
 
         for version in data:
             bill_version_id = version.get('DocumentId')
@@ -392,22 +501,29 @@ class Bill(object):
                 'bill_version_date': version.get('DocumentDate')
             }
 
-            r = requests.get(
-                f'{BASE_URL}/api/Bills/HTML/{bill_version_id}',
-                headers=REQUEST_HEADERS
-            )
+            r = self.client.get(f'{BASE_URL}/api/Bills/HTML/{bill_version_id}')
 
-            data = r.json()
+            html = r.json().get('DocumentHtml')
+
+            if parse_pool:
+                parsing.append((d, parse_pool.submit(html, backend=parser), html))
+            else:
+                parsing.append((d, None, html))
 
+            data_out.append(d)
+
+        for d, future, html in parsing:
             try:
-                parsed_text = parse_bill_html(data.get('DocumentHtml'))
+                if future:
+                    parsed_text = future.result()
+                else:
+                    with METRICS.timer('parse'):
+                        parsed_text = parse_bill_html(html, backend=parser)
             except TypeError:
                 parsed_text = ''
 
             d['bill_text'] = parsed_text
 
-            data_out.append(d)
-
 
         self.bill_data['bill_versions'] = data_out
 
@@ -417,10 +533,7 @@ class Bill(object):
     def get_amendments(self):
         ''' Get details on amendments offered to this bill '''
 
-        r = requests.get(
-            f'{BASE_URL}/api/Bills/Amendments/{self.bill_id}',
-            headers=REQUEST_HEADERS
-        )
+        r = self.fetch(f'{BASE_URL}/api/Bills/Amendments/{self.bill_id}')
 
         try:
             r.raise_for_status()
@@ -454,10 +567,7 @@ class Bill(object):
     def get_fiscal_notes(self):
         ''' Get document IDs of fiscal notes for this bill '''
 
-        r = requests.get(
-            f'{BASE_URL}/api/Bills/FiscalNotes/{self.bill_id}',
-            headers=REQUEST_HEADERS
-        )
+        r = self.fetch(f'{BASE_URL}/api/Bills/FiscalNotes/{self.bill_id}')
 
         try:
             r.raise_for_status()
@@ -472,13 +582,10 @@ class Bill(object):
         return self
 
 
-    def get_action_log(self):
-        ''' Get details, including votes, on actions taken on this bill '''
+    def get_action_log(self, votes=None):
+        ''' Get details, including votes, on actions taken on this bill; pass a VoteStore to share roll calls across bills '''
 
-        r = requests.get(
-            f'{BASE_URL}/api/Bills/ActionLog/{self.bill_id}',
-            headers=REQUEST_HEADERS
-        )
+        r = self.fetch(f'{BASE_URL}/api/Bills/ActionLog/{self.bill_id}')
 
         try:
             r.raise_for_status()
@@ -486,9 +593,25 @@ class Bill(object):
             self.bill_data['action_log'] = []
             return self
 
+        own_votes = votes is None
+
+        if own_votes:
+            votes = VoteStore(client=self.client, max_workers=1)
+
+        if self.file_exists:
+            votes.load_bill_file(self.local_file)
+
         data = r.json()
         data_out = []
 
+        try:
+            roll_calls = votes.get_many(
+                [x.get('Vote').get('VoteId') for x in data if x.get('Vote')]
+            )
+        finally:
+            if own_votes:
+                votes.close()
+
         for item in data:
             vote = item.get('Vote')
             vote_data = {}
@@ -498,24 +621,8 @@ class Bill(object):
                 vote_data['vote_id'] = vote_id
                 vote_data['president_vote'] = vote.get('PresidentVote')
 
-                r = requests.get(
-                    f'{BASE_URL}/api/Votes/{vote_id}',
-                    headers=REQUEST_HEADERS
-                )
-
-                r.raise_for_status()
-
-                data = r.json()
-
-                for rc in data.get('RollCalls'):
-                    key = rc.get('Vote1')
-
-                    if not vote_data.get(key):
-                        vote_data[key] = []
-
-                    vote_data[key].append(rc.get('SessionMemberId'))
-
-                time.sleep(0.5)
+                for key, members in roll_calls.get(vote_id).items():
+                    vote_data[key] = list(members)
 
             committee_id_assigned = item.get('AssignedCommittee')
 
@@ -549,13 +656,17 @@ class Bill(object):
         return self
 
 
-    def write_local_file(self):
-        ''' Write data to file '''
+    def write_local_file(self, compact_text=False):
+        ''' Write data to file, unless it's unchanged; with compact_text, later versions are stored as deltas '''
 
-        with open(self.local_file, 'w') as outfile:
-            json.dump(self.bill_data, outfile)
+        self.refreshed = True
 
-        print(f'Downloaded {self.local_file}')
+        bill_data = compact_bill_versions(self.bill_data) if compact_text else self.bill_data
+
+        if write_json_atomic(self.local_file, bill_data):
+            print(f'Downloaded {self.local_file}')
+        else:
+            print(f'No changes to {self.local_file}')
 
 
     def __str__(self):
@@ -570,25 +681,22 @@ class LegislatorProfile(object):
         session_id=None,
         legislator_profile_id=None,
         lookup_table={},
-        historical_legislator_data=None
+        resolver=None,
+        client=None
     ):
         self.session_id = session_id
-        self.historical_legislator_data = historical_legislator_data
+        self.client = client or DEFAULT_CLIENT
 
         # lookup table to map session profile IDs to canonical historical IDs
         self.lookup_table = lookup_table
+
+        # an xwalk.LegislatorResolver to propose IDs for profiles not in it
+        self.resolver = resolver
+
         self.legislator_profile_id = legislator_profile_id
         self.api_route = f'{BASE_URL}/api/SessionMembers/Detail/{self.legislator_profile_id}'
 
-        self.local_file = os.path.abspath(
-            os.path.join(
-                os.path.dirname( __file__ ),
-                '..',
-                'data',
-                'legislators',
-                f'sd-legislature-legislator-{self.legislator_profile_id}.json'
-            )
-        )
+        self.local_file = os.path.join(DATA_DIR, 'legislators', f'sd-legislature-legislator-{self.legislator_profile_id}.json')
 
         self.file_exists = os.path.exists(self.local_file)
 
@@ -596,10 +704,7 @@ class LegislatorProfile(object):
     def get_profile_data(self):
         ''' Get basic details about this legislator during this session '''
 
-        r = requests.get(
-            self.api_route,
-            headers=REQUEST_HEADERS
-        )
+        r = self.client.get(self.api_route)
 
         try:
             r.raise_for_status()
@@ -654,25 +759,14 @@ class LegislatorProfile(object):
 
             print(profile_bits)
 
-            matches = [x for x in self.historical_legislator_data if x.get('name_last', '').upper() in self.name.upper() and x.get('name_first', '').upper() in self.name.upper()]
-
-            if matches:
-                print('\nPossible matches:')
-                for match in matches:
-                    canon_bits = '\n'.join([
-                        f'    - {match.get("name_first", "")} {match.get("name_last", "")} ({match.get("year_start", "")}-{match.get("year_end", "")}) - {match.get("legislator_id_canon", "")}',
-                        f'    - {match.get("chambers", "")}',
-                        f'    - {match.get("parties", "")}',
-                        f'    - {match.get("cities", "")}',
-                        f'    - {match.get("counties", "")}'
-                    ])
+            proposal = self.resolver.propose(self.profile_data) if self.resolver else None
 
-                    print(canon_bits)
-                    print()
+            if proposal:
+                print(f'    Proposed: {proposal["matched_name"]} - {proposal["legislator_id_canon"]} (confidence {proposal["confidence"]}, {proposal["candidates"]} candidates)')
 
         try:
             canon_id = int(canon_id)
-        except ValueError:
+        except (TypeError, ValueError):
             print(canon_id)
             pass
 
@@ -682,12 +776,12 @@ class LegislatorProfile(object):
 
 
     def write_local_file(self):
-        ''' Write data to file '''
-
-        with open(self.local_file, 'w') as outfile:
-            json.dump(self.profile_data, outfile)
+        ''' Write data to file, unless it's unchanged '''
 
-        print(f'Downloaded {self.local_file}')
+        if write_json_atomic(self.local_file, self.profile_data):
+            print(f'Downloaded {self.local_file}')
+        else:
+            print(f'No changes to {self.local_file}')
 
     def __str__(self):
         return f'South Dakota Legislator ID #{self.legislator_profile_id}, session ID #{self.session_id}'
@@ -696,20 +790,13 @@ class LegislatorProfile(object):
 class Committee(object):
     ''' A Committee that meets during a Session '''
 
-    def __init__(self, session_id=None, committee_id=None):
+    def __init__(self, session_id=None, committee_id=None, client=None):
         self.session_id = session_id
         self.committee_id = committee_id
+        self.client = client or DEFAULT_CLIENT
         self.api_route = f'{BASE_URL}/api/SessionCommittees/Detail/{self.committee_id}'
 
-        self.local_file = os.path.abspath(
-            os.path.join(
-                os.path.dirname( __file__ ),
-                '..',
-                'data',
-                'committees',
-                f'sd-legislature-committee-{self.committee_id}.json'
-            )
-        )
+        self.local_file = os.path.join(DATA_DIR, 'committees', f'sd-legislature-committee-{self.committee_id}.json')
 
         self.file_exists = os.path.exists(self.local_file)
 
@@ -717,10 +804,7 @@ class Committee(object):
     def get_committee_data(self):
         ''' Get basic details on this committee '''
 
-        r = requests.get(
-            self.api_route,
-            headers=REQUEST_HEADERS
-        )
+        r = self.client.get(self.api_route)
 
         try:
             r.raise_for_status()
@@ -755,12 +839,12 @@ class Committee(object):
 
 
     def write_local_file(self):
-        ''' Write data to file '''
-
-        with open(self.local_file, 'w') as outfile:
-            json.dump(self.committee_data, outfile)
+        ''' Write data to file, unless it's unchanged '''
 
-        print(f'Downloaded {self.local_file}')
+        if write_json_atomic(self.local_file, self.committee_data):
+            print(f'Downloaded {self.local_file}')
+        else:
+            print(f'No changes to {self.local_file}')
 
     def __str__(self):
         return f'South Dakota Committee ID #{self.committee_id}, session ID #{self.session_id}'
@@ -0,0 +1,393 @@
+# flake8: noqa
+
+import re
+import time
+import threading
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import Future, ProcessPoolExecutor
+from html.entities import html5 as HTML5_ENTITIES
+
+from bs4 import BeautifulSoup
+
+from metrics import METRICS
+
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:
+    lxml = None
+
+
+# BeautifulSoup leaves text inside these tags out of .text
+SKIPPED_TEXT_TAGS = ('script', 'style', 'template', 'rt', 'rp')
+
+DEFAULT_BACKEND = 'html.parser'
+
+# html.parser builds the tree exactly as the tags are written, while lxml
+# repairs markup the way a browser would (closing an open <p> at a <div>,
+# for one). The fast path only runs on documents where the two can't differ
+TAG_RE = re.compile(
+    r'<!--.*?-->|<!.*?>|<(script|style)\b.*?</\1\s*>|<(/?)([a-zA-Z][a-zA-Z0-9]*)\b[^>]*?(/?)>',
+    re.S | re.I
+)
+
+# html.parser reads markup inside these as tags, but to lxml it's raw text
+# (or text with entities), so the two come out with different text. The
+# one exception the fast path allows is a <title> of plain text in <head>,
+# which every bill document has
+RAW_TEXT_TAGS = {'script', 'style', 'textarea', 'title', 'xmp', 'plaintext', 'iframe', 'noembed', 'noframes', 'noscript'}
+
+PLAIN_TITLE_RE = re.compile(r'[^<&]*</title\s*>', re.I)
+
+ENTITY_RE = re.compile(r'&(#[0-9]+|#[xX][0-9a-fA-F]+|[a-zA-Z][a-zA-Z0-9]*)(;?)')
+
+VOID_TAGS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+    'link', 'meta', 'param', 'source', 'track', 'wbr'
+}
+
+HEADING_TAGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+
+# block-level tags that make lxml close a <p> or heading that's still open
+P_CLOSING_TAGS = {
+    'address', 'article', 'aside', 'blockquote', 'center', 'dd', 'dir',
+    'div', 'dl', 'dt', 'fieldset', 'figure', 'footer', 'form', 'h1', 'h2',
+    'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li', 'listing', 'menu', 'nav',
+    'ol', 'p', 'pre', 'section', 'table', 'ul', 'xmp'
+}
+
+# table parts lxml drops or moves unless they sit where they belong
+TABLE_PARENTS = {
+    'tr': {'table', 'tbody', 'thead', 'tfoot'},
+    'td': {'tr'},
+    'th': {'tr'},
+    'tbody': {'table'},
+    'thead': {'table'},
+    'tfoot': {'table'},
+    'caption': {'table'},
+    'colgroup': {'table'}
+}
+
+LOOSE_TEXT_PARENTS = {'table', 'tbody', 'thead', 'tfoot', 'tr'}
+
+# tags lxml closes when another of the same kind opens inside them
+NON_NESTING_TAGS = {'a', 'button', 'dd', 'dt', 'form', 'li', 'nobr', 'option'}
+
+FONT_STYLE_TAGS = {'tt', 'i', 'b', 'u', 's', 'strike', 'big', 'small'}
+
+# after libxml2's htmlStartClose table: opening the key tag closes any of
+# these if it's the innermost open tag
+CLOSED_BY = {
+    'form': {'form', 'p', 'hr', 'dl', 'ul', 'ol', 'menu', 'dir', 'address', 'pre', 'listing', 'xmp', 'head'} | HEADING_TAGS,
+    'head': {'p'},
+    'title': {'p'},
+    'body': {'head', 'style', 'script', 'title'},
+    'li': {'p', 'dl', 'address', 'pre', 'listing', 'xmp', 'head', 'li'} | HEADING_TAGS,
+    'hr': {'p', 'head'},
+    'dir': {'p', 'head'},
+    'address': {'p', 'head', 'ul'},
+    'pre': {'p', 'head', 'ul'},
+    'listing': {'p', 'head'},
+    'xmp': {'p'},
+    'blockquote': {'p', 'head'},
+    'dl': {'p', 'dt', 'menu', 'dir', 'address', 'pre', 'listing', 'xmp', 'head'},
+    'dt': {'p', 'menu', 'dir', 'address', 'pre', 'listing', 'xmp', 'head', 'dd'},
+    'dd': {'p', 'menu', 'dir', 'address', 'pre', 'listing', 'xmp', 'head', 'dt'},
+    'ul': {'p', 'head', 'ol', 'menu', 'dir', 'address', 'pre', 'listing', 'xmp'},
+    'ol': {'p', 'head', 'ul'},
+    'menu': {'p', 'head', 'ul'},
+    'p': {'p', 'head'} | HEADING_TAGS | FONT_STYLE_TAGS,
+    'div': {'p', 'head'},
+    'noscript': {'script'},
+    'center': {'font', 'b', 'i', 'p', 'head'},
+    'a': {'a', 'head'},
+    'caption': {'p'},
+    'colgroup': {'caption', 'colgroup', 'col', 'p'},
+    'col': {'caption', 'col', 'p'},
+    'table': {'p', 'head', 'pre', 'listing', 'xmp', 'a'} | HEADING_TAGS,
+    'th': {'th', 'td', 'p'},
+    'td': {'th', 'td', 'p'},
+    'tr': {'th', 'td', 'tr', 'caption', 'col', 'colgroup', 'p'},
+    'thead': {'caption', 'col', 'colgroup'},
+    'tfoot': {'th', 'td', 'tr', 'caption', 'col', 'colgroup', 'thead', 'tbody', 'p'},
+    'tbody': {'th', 'td', 'tr', 'caption', 'col', 'colgroup', 'thead', 'tfoot', 'tbody', 'p'},
+    'optgroup': {'option'},
+    'option': {'option'},
+    'fieldset': {'legend', 'p', 'head', 'pre', 'listing', 'xmp', 'a'} | HEADING_TAGS
+}
+
+for heading in HEADING_TAGS:
+    CLOSED_BY[heading] = {'p', 'head'} | HEADING_TAGS
+
+
+def parse_bill_html_bs4(html):
+    ''' Pull the text of a bill out of its HTML document with BeautifulSoup and html.parser; the reference backend '''
+
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # new style
+    div = soup.find('div', {'title': 'header'})
+
+    if div:
+        # nuke the header and footer and "unsupported" divs
+        div.extract()
+        footer = soup.find('div', {'title': 'footer'})
+
+        if footer:
+            footer.extract()
+        unsupported = soup.find('div', {'id': 'unsupported'})
+
+        if unsupported:
+            unsupported.extract()
+        grafs = [x.text.strip() for x in soup.find_all('p')]
+        bill_text_raw = ' '.join(grafs)
+    else:
+        # old style
+        try:
+            div = soup.find_all('table')[0].parent
+            for table in div.find_all('table'):
+                table.extract()
+            bill_text_raw = ' '.join([x.text.strip() for x in div.find_all('div')])
+        except IndexError:
+            return ''
+
+    return ' '.join(bill_text_raw.split())
+
+
+def is_well_nested(html):
+    ''' True if every tag in the document is explicitly closed in order, with no entity, <p>, raw text element, CDATA section, NUL byte or trailing content that a browser-style parser would treat differently '''
+
+    # lxml swaps NUL for U+FFFD; html.parser keeps it
+    if '\x00' in html:
+        return False
+
+    for name, semicolon in set(ENTITY_RE.findall(html)):
+        if not semicolon:
+            return False
+
+        if not name.startswith('#'):
+            if f'{name};' not in HTML5_ENTITIES:
+                return False
+
+            continue
+
+        codepoint = int(name[2:], 16) if name[1] in 'xX' else int(name[1:])
+
+        # lxml swaps these for U+FFFD too; html.parser keeps them as is
+        if codepoint == 0 or 0xD800 <= codepoint <= 0xDFFF:
+            return False
+
+    stack = []
+
+    # how many of each tag are open, so checks don't walk the stack
+    open_tags = defaultdict(int)
+
+    text_start = 0
+
+    for m in TAG_RE.finditer(html):
+        closing, tag, self_closing = m.group(2, 3, 4)
+
+        top = stack[-1] if stack else None
+
+        # lxml moves text that sits loose in a table out in front of it
+        if top in LOOSE_TEXT_PARENTS and html[text_start:m.start()].strip():
+            return False
+
+        text_start = m.end()
+
+        # a whole <script> or <style> element, or a CDATA section, which
+        # html.parser reads as text and lxml drops
+        if m.group(1) or html.startswith('<![', m.start()):
+            return False
+
+        if not tag:
+            continue
+
+        tag = tag.lower()
+
+        if not closing and tag in RAW_TEXT_TAGS and not (tag == 'title' and top == 'head' and PLAIN_TITLE_RE.match(html, m.end())):
+            return False
+
+        if tag in VOID_TAGS:
+            continue
+
+        if self_closing:
+            return False
+
+        if closing:
+            if top != tag:
+                return False
+
+            stack.pop()
+            open_tags[tag] -= 1
+
+            # lxml leaves out whatever comes after </html>
+            if tag == 'html' and html[m.end():].strip():
+                return False
+
+            continue
+
+        if tag in P_CLOSING_TAGS and (open_tags['p'] or any(open_tags[x] for x in HEADING_TAGS)):
+            return False
+
+        if tag in TABLE_PARENTS and top not in TABLE_PARENTS[tag]:
+            return False
+
+        if tag in NON_NESTING_TAGS and open_tags[tag]:
+            return False
+
+        if top in CLOSED_BY.get(tag, ()):
+            return False
+
+        stack.append(tag)
+        open_tags[tag] += 1
+
+    return not stack
+
+
+def strip_skipped_text(doc):
+    ''' Remove what BeautifulSoup's .text would leave out, keeping the text that follows it; an element emptied this way only adds whitespace, which gets collapsed anyway '''
+
+    etree.strip_elements(
+        doc,
+        etree.Comment,
+        etree.ProcessingInstruction,
+        *SKIPPED_TEXT_TAGS,
+        with_tail=False
+    )
+
+
+def parse_bill_html_lxml(html):
+    ''' Same as parse_bill_html_bs4, on lxml's C parser without building a BeautifulSoup tree; falls back to the reference backend for markup lxml would repair '''
+
+    if html is None:
+        raise TypeError('No bill HTML to parse')
+
+    if not is_well_nested(html):
+        return parse_bill_html_bs4(html)
+
+    try:
+        doc = lxml.html.document_fromstring(html)
+    except (etree.ParserError, ValueError):
+        return ''
+
+    # new style
+    div = next(iter(doc.xpath('//div[@title="header"]')), None)
+
+    if div is not None:
+        # nuke the header and footer and "unsupported" divs
+        div.drop_tree()
+        footer = next(iter(doc.xpath('//div[@title="footer"]')), None)
+
+        if footer is not None:
+            footer.drop_tree()
+        unsupported = next(iter(doc.xpath('//div[@id="unsupported"]')), None)
+
+        if unsupported is not None:
+            unsupported.drop_tree()
+        strip_skipped_text(doc)
+        grafs = [x.text_content().strip() for x in doc.iter('p')]
+        bill_text_raw = ' '.join(grafs)
+    else:
+        # old style
+        tables = list(doc.iter('table'))
+
+        if not tables:
+            return ''
+
+        div = tables[0].getparent()
+        for table in list(div.iterdescendants('table')):
+            table.drop_tree()
+        strip_skipped_text(doc)
+        bill_text_raw = ' '.join([x.text_content().strip() for x in div.iterdescendants('div')])
+
+    return ' '.join(bill_text_raw.split())
+
+
+PARSER_BACKENDS = {
+    'html.parser': parse_bill_html_bs4
+}
+
+if lxml:
+    PARSER_BACKENDS['lxml'] = parse_bill_html_lxml
+
+
+def parse_bill_html(html, backend=DEFAULT_BACKEND):
+    ''' Pull the text of a bill out of its HTML document with the named backend '''
+
+    try:
+        parser = PARSER_BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f'Unknown bill HTML parser "{backend}"; choose from {", ".join(PARSER_BACKENDS)}')
+
+    return parser(html)
+
+
+def timed_parse_bill_html(html, backend=DEFAULT_BACKEND):
+    ''' parse_bill_html, plus how many seconds it took; what pool workers run, so the crawl process can record parse times '''
+
+    start = time.perf_counter()
+    text = parse_bill_html(html, backend)
+
+    return text, time.perf_counter() - start
+
+
+class ParsePool(object):
+    ''' Parses bill HTML in worker processes so CPU-bound parsing doesn't hold up the threads doing network I/O '''
+
+    def __init__(self, workers=None, max_pending=None):
+        self.workers = workers or multiprocessing.cpu_count()
+
+        # documents submitted but not yet parsed; once it's full, submit()
+        # blocks and the fetchers wait for the parsers to catch up
+        self.max_pending = max_pending or self.workers * 4
+        self.pending = threading.BoundedSemaphore(self.max_pending)
+
+        # spawn, not fork: the crawl has live threads and sockets by the
+        # time the first worker starts
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+
+    def submit(self, html, backend=DEFAULT_BACKEND):
+        ''' Queue a document for parsing, blocking while the queue is full; returns a Future of its text '''
+
+        self.pending.acquire()
+
+        try:
+            future = self.executor.submit(timed_parse_bill_html, html, backend)
+        except Exception:
+            self.pending.release()
+            raise
+
+        text = Future()
+
+        def done(future):
+            self.pending.release()
+
+            try:
+                parsed_text, seconds = future.result()
+            except BaseException as e:
+                text.set_exception(e)
+                return
+
+            METRICS.observe('parse', seconds)
+            text.set_result(parsed_text)
+
+        future.add_done_callback(done)
+
+        return text
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __str__(self):
+        return f'Bill text parse pool - {self.workers} processes, up to {self.max_pending} documents queued'
@@ -0,0 +1,250 @@
+# flake8: noqa
+
+import time
+import argparse
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from metrics import METRICS
+
+
+# stage name -> (default concurrency limit, stages that have to finish
+# first). The first three take whole objects; the rest are the requests
+# that make up one bill. get_bill_data() starts the bill's data over, so
+# everything else waits for it, then runs side by side
+CRAWL_STAGES = {
+    'legislators': (2, ()),
+    'committees': (2, ()),
+    'bills': (4, ()),
+    'bill_data': (4, ()),
+    'audio': (2, ('bill_data',)),
+    'bill_versions': (4, ('bill_data',)),
+    'amendments': (2, ('bill_data',)),
+    'fiscal_notes': (2, ('bill_data',)),
+    'action_log': (2, ('bill_data',))
+}
+
+# where a serial crawl puts the fields the bill stages fill in; they finish
+# in any order, and the file should come out the same either way
+BILL_FIELDS = [
+    'audio',
+    'bill_versions',
+    'amendments',
+    'fiscal_notes',
+    'action_log'
+]
+
+
+def stage_limit(value):
+    ''' Parse a NAME=N command-line argument '''
+
+    name, _, limit = value.partition('=')
+
+    if name not in CRAWL_STAGES:
+        raise argparse.ArgumentTypeError(f'No stage named {name}; choose from {", ".join(CRAWL_STAGES)}')
+
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Expected NAME=N, got {value}')
+
+    if limit < 1:
+        raise argparse.ArgumentTypeError(f'{name} needs a limit of at least 1')
+
+    return name, limit
+
+
+def chain(future, result):
+    ''' Pass what future ends with on to result '''
+
+    def done(future):
+        if future.cancelled():
+            result.cancel()
+        elif future.exception() is not None:
+            result.set_exception(future.exception())
+        else:
+            result.set_result(future.result())
+
+    future.add_done_callback(done)
+
+
+class Stage(object):
+    ''' One kind of task in a crawl, run on a thread pool of its own so its concurrency limit is the pool's size. Keeps count of how busy it was and how long tasks waited for a thread '''
+
+    def __init__(self, name, limit=1, after=()):
+        self.name = name
+        self.limit = limit
+        self.after = tuple(after)
+
+        self.executor = ThreadPoolExecutor(max_workers=limit, thread_name_prefix=f'stage-{name}')
+        self.lock = threading.Lock()
+
+        self.runs = 0
+        self.failures = 0
+        self.busy_seconds = 0
+        self.queued_seconds = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.first_start = None
+        self.last_finish = None
+
+    def submit(self, func, *args, **kwargs):
+        return self.executor.submit(self.run, time.perf_counter(), func, *args, **kwargs)
+
+    def run(self, queued_at, func, *args, **kwargs):
+        start = time.perf_counter()
+
+        with self.lock:
+            self.queued_seconds += start - queued_at
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+            if self.first_start is None:
+                self.first_start = start
+
+        try:
+            return func(*args, **kwargs)
+        except BaseException:
+            with self.lock:
+                self.failures += 1
+            raise
+        finally:
+            finish = time.perf_counter()
+
+            with self.lock:
+                self.runs += 1
+                self.busy_seconds += finish - start
+                self.in_flight -= 1
+                self.last_finish = finish
+
+            METRICS.observe(f'pipeline:{self.name}', finish - start)
+            METRICS.observe(f'pipeline:{self.name}:queued', start - queued_at)
+
+    def stats(self):
+        ''' Runs, throughput and how much of its limit the stage used while it was active '''
+
+        with self.lock:
+            active = (self.last_finish - self.first_start) if self.runs else 0
+
+            return {
+                'limit': self.limit,
+                'runs': self.runs,
+                'failures': self.failures,
+                'per_second': round(self.runs / active, 2) if active else None,
+                'busy_seconds': round(self.busy_seconds, 2),
+                'queued_seconds': round(self.queued_seconds, 2),
+                # near 1 with a lot of time queued: raise the limit
+                'utilization': round(self.busy_seconds / (active * self.limit), 2) if active else None,
+                'peak_in_flight': self.peak_in_flight
+            }
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __str__(self):
+        stats = self.stats()
+
+        if not stats['runs']:
+            return f'{self.name}: limit {self.limit}, no runs'
+
+        return f'{self.name}: limit {self.limit}, {stats["runs"]:,} runs ({stats["failures"]:,} failed), {stats["per_second"] or 0:,}/s, {stats["utilization"] or 0:.0%} busy, {stats["queued_seconds"]:,}s queued'
+
+
+class Pipeline(object):
+    ''' Stages of a crawl, each with its own concurrency limit, and the order some of them have to run in. Legislators, bills and committees go through stages of their own, and so does each request that makes up a bill '''
+
+    def __init__(self, stages=CRAWL_STAGES, limits=None):
+        limits = dict(limits or {})
+
+        unknown = set(limits) - set(stages)
+
+        if unknown:
+            raise ValueError(f'No stages named {", ".join(sorted(unknown))}')
+
+        self.stages = {}
+
+        for name, (limit, after) in stages.items():
+            for dependency in after:
+                if dependency not in self.stages:
+                    raise ValueError(f'Stage {name} runs after {dependency}, which has to be listed before it')
+
+            self.stages[name] = Stage(name, limit=limits.get(name, limit), after=after)
+
+    def limit(self, stage):
+        return self.stages[stage].limit
+
+    def submit(self, stage, func, *args, **kwargs):
+        ''' Queue one task on a stage; returns a Future of its result '''
+
+        return self.stages[stage].submit(func, *args, **kwargs)
+
+    def after(self, dependencies, stage, func):
+        ''' A Future of func's result, queued on its stage once every dependency has finished, or failed with the first dependency that failed '''
+
+        if not dependencies:
+            return self.submit(stage, func)
+
+        result = Future()
+        remaining = [len(dependencies)]
+        lock = threading.Lock()
+
+        def ready(future):
+            with lock:
+                remaining[0] -= 1
+
+                if remaining[0]:
+                    return
+
+            for dependency in dependencies:
+                if dependency.cancelled() or dependency.exception() is not None:
+                    chain(dependency, result)
+                    return
+
+            chain(self.submit(stage, func), result)
+
+        for dependency in dependencies:
+            dependency.add_done_callback(ready)
+
+        return result
+
+    def run(self, tasks):
+        ''' Run one task per stage, e.g. each request for one bill, every one as soon as the stages it comes after are done. Waits for all of them and returns their results by stage, or raises the first error '''
+
+        futures = {}
+
+        # stages are listed after the ones they wait for
+        for name, stage in self.stages.items():
+            if name in tasks:
+                futures[name] = self.after(
+                    [futures[x] for x in stage.after if x in futures],
+                    name,
+                    tasks[name]
+                )
+
+        return dict(zip(futures, self.results(futures.values())))
+
+    def results(self, futures):
+        ''' Wait for every future, then return their results in order, or raise the first error '''
+
+        futures = list(futures)
+
+        wait(futures)
+
+        return [x.result() for x in futures]
+
+    def stats(self):
+        return {name: stage.stats() for name, stage in self.stages.items()}
+
+    def close(self):
+        # the object stages first, since they wait on the bill stages
+        for stage in self.stages.values():
+            stage.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __str__(self):
+        return '\n'.join(['Crawl pipeline stages:'] + [f'    {x}' for x in self.stages.values()])
@@ -0,0 +1,133 @@
+# flake8: noqa
+
+import threading
+import time
+from contextlib import contextmanager
+
+
+class TokenBucket(object):
+    ''' A thread-safe token bucket that hands out requests at a steady rate '''
+
+    def __init__(self, rate=2, capacity=1):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate):
+        ''' Change the refill rate, keeping whatever tokens have built up '''
+
+        with self.lock:
+            self._refill()
+            self.rate = float(rate)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity,
+            self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def acquire(self):
+        ''' Block until a token is available, then take it '''
+
+        while True:
+            with self.lock:
+                self._refill()
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+class RateLimiter(object):
+    ''' Caps the request rate and the number of requests in flight across every thread of a crawl. The rate adapts to how the server is holding up: it creeps toward requests_per_second while responses come back quickly and cleanly, and halves on errors or slow responses '''
+
+    def __init__(
+        self,
+        requests_per_second=2,
+        max_in_flight=1,
+        burst=1,
+        min_requests_per_second=0.25,
+        latency_target=2.0
+    ):
+        self.lock = threading.Lock()
+
+        self.configure(
+            requests_per_second=requests_per_second,
+            max_in_flight=max_in_flight,
+            burst=burst,
+            min_requests_per_second=min_requests_per_second,
+            latency_target=latency_target
+        )
+
+    def configure(
+        self,
+        requests_per_second=2,
+        max_in_flight=1,
+        burst=1,
+        min_requests_per_second=0.25,
+        latency_target=2.0
+    ):
+        ''' Swap in a new politeness budget; call before any requests are in flight '''
+
+        # the ceiling; the crawl starts at a quarter of it and works up
+        self.requests_per_second = requests_per_second
+        self.min_requests_per_second = min(min_requests_per_second, requests_per_second)
+        self.rate = max(requests_per_second / 4, self.min_requests_per_second)
+
+        # seconds; a smoothed response time above this counts as strain
+        self.latency_target = latency_target
+        self.latency = None
+
+        self.max_in_flight = max_in_flight
+        self.bucket = TokenBucket(rate=self.rate, capacity=burst)
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+
+        # nothing goes out before this, after a Retry-After
+        self.paused_until = 0
+
+        return self
+
+    def record(self, status_code, latency):
+        ''' Adjust the rate after a response: a little faster if it was quick and clean, half as fast on a 429, 5xx or connection error (status_code None) '''
+
+        with self.lock:
+            self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+
+            if status_code is None or status_code == 429 or status_code >= 500:
+                self.rate = max(self.rate / 2, self.min_requests_per_second)
+            elif self.latency > self.latency_target:
+                self.rate = max(self.rate * 0.9, self.min_requests_per_second)
+            else:
+                self.rate = min(self.rate + self.requests_per_second / 20, self.requests_per_second)
+
+            self.bucket.set_rate(self.rate)
+
+    def pause(self, seconds):
+        ''' Hold every request back for a while, as a Retry-After header asks '''
+
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    @contextmanager
+    def slot(self):
+        ''' Hold an in-flight slot and a rate token for the duration of one request '''
+
+        with self.in_flight:
+            wait = self.paused_until - time.monotonic()
+
+            if wait > 0:
+                time.sleep(wait)
+
+            self.bucket.acquire()
+            yield
+
+    def __str__(self):
+        return f'Rate limiter - up to {self.requests_per_second} requests/sec (now {self.rate:.2f}), {self.max_in_flight} in flight'
@@ -0,0 +1,85 @@
+# flake8: noqa
+
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+
+
+# worth another try: rate limited, or the server (or something in front of
+# it) is having a bad moment
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def parse_retry_after(value):
+    ''' Seconds to wait from a Retry-After header, which is either a number of seconds or an HTTP date; None if there isn't a usable one '''
+
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy(object):
+    ''' Exponential backoff with full jitter for failed GETs, under a retry budget shared by the whole crawl so a struggling server doesn't get hit with a storm of retries '''
+
+    def __init__(
+        self,
+        max_attempts=5,
+        base_delay=1.0,
+        max_delay=60.0,
+        budget_ratio=0.1,
+        budget_cap=20
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+
+        # every request earns budget_ratio of a retry, so retries can't
+        # outrun the real traffic. The crawl starts with a full budget, and
+        # can't bank more than budget_cap however long it runs, so a server
+        # that goes down late in a big crawl doesn't get a burst of them
+        self.budget_ratio = budget_ratio
+        self.budget_cap = budget_cap
+        self.budget = float(budget_cap)
+
+        self.retries = 0
+        self.denied = 0
+
+    def record_request(self):
+        ''' Earn a little retry budget for a request sent '''
+
+        with self.lock:
+            self.budget = min(self.budget + self.budget_ratio, self.budget_cap)
+
+    def allow(self, attempt):
+        ''' May the request that just failed on this attempt (0 for the first) go again? Spends budget if so '''
+
+        with self.lock:
+            if attempt + 1 >= self.max_attempts or self.budget < 1:
+                self.denied += 1
+                return False
+
+            self.budget -= 1
+            self.retries += 1
+
+            return True
+
+    def delay(self, attempt, retry_after=None):
+        ''' Seconds to wait before the next attempt: a random slice of an exponentially growing window, but never less than the server asked for '''
+
+        window = min(self.max_delay, self.base_delay * 2 ** attempt)
+
+        return max(random.uniform(0, window), retry_after or 0)
+
+    def __str__(self):
+        return f'Retry policy - up to {self.max_attempts} attempts, {self.retries:,} retries, {self.denied:,} given up on'
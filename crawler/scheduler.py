@@ -0,0 +1,90 @@
+# flake8: noqa
+
+import os
+import json
+import time
+import threading
+from datetime import datetime
+
+from bill_text import BILLS_DIR
+from metrics import METRICS
+
+
+def parse_timestamp(value):
+    ''' Seconds since the epoch for an ISO date string, or None if it isn't one '''
+
+    if not isinstance(value, str):
+        return None
+
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return None
+
+
+class BillScheduler(object):
+    ''' Hands out a session's bills most recently active first, and stops handing them out once the crawl's time budget is spent '''
+
+    def __init__(self, time_budget=None, bills_dir=BILLS_DIR):
+        self.bills_dir = bills_dir
+        self.lock = threading.Lock()
+
+        # seconds from now; None means no limit
+        self.deadline = time.monotonic() + time_budget if time_budget else None
+
+        self.deferred = 0
+
+    def last_activity(self, bill_id, listing_entry=None):
+        ''' When this bill last moved, going by its saved action log and any dates in the session's bill list; None if it's never been crawled '''
+
+        timestamps = []
+
+        if listing_entry:
+            timestamps.extend(parse_timestamp(v) for k, v in listing_entry.items() if 'Date' in k)
+
+        filepath = os.path.join(self.bills_dir, f'sd-legislature-bill-{bill_id}.json')
+
+        try:
+            with open(filepath, 'r') as infile:
+                action_log = json.load(infile).get('action_log') or []
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        timestamps.extend(parse_timestamp(x.get('action_date')) for x in action_log)
+        timestamps = [x for x in timestamps if x is not None]
+
+        return max(timestamps) if timestamps else 0
+
+    def prioritize(self, bill_ids, listing=None):
+        ''' Bill IDs in the order to crawl them: bills we've never saved, then the rest by most recent activity '''
+
+        listing = {x.get('BillId'): x for x in listing or []}
+
+        activity = {x: self.last_activity(x, listing.get(x)) for x in bill_ids}
+
+        # sorted() is stable, so ties keep the API's order
+        return sorted(
+            bill_ids,
+            key=lambda x: (activity[x] is not None, -(activity[x] or 0))
+        )
+
+    def expired(self):
+        ''' Has the time budget run out? '''
+
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def defer(self):
+        ''' Note a bill left for the next run '''
+
+        with self.lock:
+            self.deferred += 1
+
+        METRICS.increment('bills_deferred')
+
+    def __str__(self):
+        if self.deadline is None:
+            return 'Bill scheduler - most recently active first, no time budget'
+
+        remaining = max(self.deadline - time.monotonic(), 0)
+
+        return f'Bill scheduler - most recently active first, {remaining / 60:,.1f} minutes left ({self.deferred:,} bills deferred)'
@@ -0,0 +1,100 @@
+# flake8: noqa
+
+import os
+import json
+import sqlite3
+import argparse
+
+from export import EXPORT_FILE
+
+
+def search_bills(query, filepath=EXPORT_FILE, session_id=None, limit=20):
+    ''' Bill versions matching an FTS5 query against bill text, titles and keywords, best match first '''
+
+    if not os.path.exists(filepath):
+        raise FileNotFoundError(f'No export at {filepath}; run crawler/export.py first')
+
+    conn = sqlite3.connect(f'file:{filepath}?mode=ro', uri=True)
+
+    sql = '''
+        SELECT
+            c.bill_id,
+            c.session_id,
+            c.bill_version_id,
+            c.bill_version,
+            c.bill_version_date,
+            c.bill_title,
+            snippet(bill_search, -1, '[', ']', '...', 16) AS snippet
+        FROM bill_search s
+        JOIN bill_search_content c ON c.bill_version_id = s.rowid
+        WHERE bill_search MATCH ?
+    '''
+
+    params = [query]
+
+    if session_id is not None:
+        sql += ' AND c.session_id = ?'
+        params.append(session_id)
+
+    sql += ' ORDER BY s.rank LIMIT ?'
+    params.append(limit)
+
+    try:
+        cursor = conn.execute(sql, params)
+        columns = [x[0] for x in cursor.description]
+        results = [dict(zip(columns, x)) for x in cursor]
+    except sqlite3.OperationalError as e:
+        raise ValueError(f'Bad search query "{query}": {e}')
+    finally:
+        conn.close()
+
+    return results
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Search the text, titles and keywords of every bill version in the SQLite export')
+
+    parser.add_argument(
+        'query',
+        help='FTS5 query, e.g. \'"sales tax" NOT exemption\' or \'keywords:education\''
+    )
+
+    parser.add_argument(
+        '--session-id',
+        type=int,
+        help='Only search bills from this session'
+    )
+
+    parser.add_argument(
+        '--limit',
+        type=int,
+        default=20,
+        help='Most results to return'
+    )
+
+    parser.add_argument(
+        '--db',
+        default=EXPORT_FILE,
+        help='Path of the SQLite export'
+    )
+
+    parser.add_argument(
+        '--json',
+        action='store_true',
+        help='Print one JSON object per result'
+    )
+
+    args = parser.parse_args()
+
+    try:
+        results = search_bills(args.query, filepath=args.db, session_id=args.session_id, limit=args.limit)
+    except (FileNotFoundError, ValueError) as e:
+        raise SystemExit(str(e))
+
+    for result in results:
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(f'Bill {result["bill_id"]} (session {result["session_id"]}) - {result["bill_version"]} version {result["bill_version_id"]}: {result["bill_title"]}')
+            print(f'    {result["snippet"]}')
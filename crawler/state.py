@@ -0,0 +1,96 @@
+# flake8: noqa
+
+import os
+import json
+import hashlib
+import threading
+
+from storage import write_atomic
+
+
+VALIDATORS_FILE = os.path.abspath(
+    os.path.join(
+        os.path.dirname( __file__ ),
+        'state',
+        'http-validators.json'
+    )
+)
+
+
+class ValidatorStore(object):
+    ''' Remembers the ETag, Last-Modified and body hash of API responses between runs '''
+
+    def __init__(self, filepath=VALIDATORS_FILE):
+        self.filepath = filepath
+        self.lock = threading.Lock()
+
+        try:
+            with open(self.filepath, 'r') as infile:
+                self.validators = json.load(infile)
+        except FileNotFoundError:
+            self.validators = {}
+
+    def conditional_headers(self, url):
+        ''' Headers that let the server answer 304 if this URL hasn't changed '''
+
+        with self.lock:
+            record = self.validators.get(url, {})
+
+        headers = {}
+
+        if record.get('etag'):
+            headers['If-None-Match'] = record.get('etag')
+
+        if record.get('last_modified'):
+            headers['If-Modified-Since'] = record.get('last_modified')
+
+        return headers
+
+    def check(self, url, response):
+        ''' Return (changed, record) for a response; the record isn't stored until you call update() '''
+
+        if response.status_code == 304:
+            return False, None
+
+        record = {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'sha256': hashlib.sha256(response.content).hexdigest()
+        }
+
+        with self.lock:
+            previous = self.validators.get(url, {})
+
+        return previous.get('sha256') != record['sha256'], record
+
+    def check_value(self, key, value):
+        ''' Like check(), for data that doesn't come from a single response '''
+
+        record = {
+            'sha256': hashlib.sha256(json.dumps(value).encode()).hexdigest()
+        }
+
+        with self.lock:
+            previous = self.validators.get(key, {})
+
+        return previous.get('sha256') != record['sha256'], record
+
+    def update(self, records):
+        ''' Store validators for a batch of URLs, e.g. once a bill has been written '''
+
+        with self.lock:
+            self.validators.update(records)
+
+    def save(self):
+        ''' Write validators to file, via a temp file so a crash can't truncate it '''
+
+        with self.lock:
+            payload = json.dumps(self.validators, sort_keys=True)
+
+        write_atomic(self.filepath, [payload])
+
+    def __len__(self):
+        return len(self.validators)
+
+    def __str__(self):
+        return f'{len(self)} stored HTTP validators - {self.filepath}'
@@ -0,0 +1,117 @@
+# flake8: noqa
+
+import os
+import json
+import stat
+import hashlib
+import tempfile
+
+
+# mkstemp() makes files only their owner can read; a rewritten file keeps
+# the mode it had, and a new one gets what open() would have given it
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def file_digest(filepath, chunk_size=1024 * 1024):
+    ''' sha256 of a file's bytes, read a chunk at a time '''
+
+    digest = hashlib.sha256()
+
+    with open(filepath, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(chunk_size), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def write_json_atomic(filepath, data):
+    ''' Stream data as JSON to a temp file next to filepath, fsync it and swap it into place, so a killed crawl never leaves a half-written file. Returns False, and leaves the file alone, if the new bytes match what's already there '''
+
+    # these import storage themselves
+    from manifest import MANIFEST
+    from metrics import METRICS
+
+    try:
+        previous_size = os.path.getsize(filepath)
+    except FileNotFoundError:
+        previous_size = None
+
+    with METRICS.timer('write'):
+        changed, size = write_atomic(filepath, json.JSONEncoder().iterencode(data), skip_unchanged=True)
+
+    METRICS.increment('files_written' if changed else 'files_unchanged')
+
+    MANIFEST.record(filepath, data, size, previous_size=previous_size, changed=changed)
+
+    return changed
+
+
+def replace_file(tmp, filepath):
+    ''' Swap a finished temp file into place at filepath, with filepath's permissions '''
+
+    try:
+        mode = stat.S_IMODE(os.stat(filepath).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~UMASK
+
+    os.chmod(tmp, mode)
+    os.replace(tmp, filepath)
+
+
+def write_atomic(filepath, chunks, skip_unchanged=False, fsync=True):
+    ''' Write chunks of text or bytes to a temp file next to filepath and swap it into place, so readers only ever see the old file or the whole new one. With skip_unchanged, a file whose bytes wouldn't change is left alone. Returns whether the file changed, and its size '''
+
+    directory = os.path.dirname(os.path.abspath(filepath))
+
+    os.makedirs(directory, exist_ok=True)
+
+    fd, tmp = tempfile.mkstemp(
+        dir=directory,
+        prefix=f'.{os.path.basename(filepath)}.',
+        suffix='.tmp'
+    )
+
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        with os.fdopen(fd, 'wb') as outfile:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+
+                outfile.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+
+            outfile.flush()
+
+            try:
+                unchanged = skip_unchanged and os.path.getsize(filepath) == size and file_digest(filepath) == digest.hexdigest()
+            except FileNotFoundError:
+                unchanged = False
+
+            if fsync and not unchanged:
+                os.fsync(outfile.fileno())
+
+        if unchanged:
+            os.remove(tmp)
+            return False, size
+
+        replace_file(tmp, filepath)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    if fsync:
+        # make the rename itself durable
+        dir_fd = os.open(directory, os.O_RDONLY)
+
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    return True, size
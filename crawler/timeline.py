@@ -0,0 +1,242 @@
+# flake8: noqa
+
+import os
+import json
+import glob
+import argparse
+from collections import defaultdict
+
+from xwalk import read_xwalk, XWALK_FILE
+from storage import write_atomic
+
+
+DATA_DIR = os.path.abspath(
+    os.path.join(
+        os.path.dirname( __file__ ),
+        '..',
+        'data'
+    )
+)
+
+TIMELINES_DIR = os.path.abspath(
+    os.path.join(
+        os.path.dirname( __file__ ),
+        '..',
+        'exports',
+        'legislators'
+    )
+)
+
+# profile fields carried into a timeline; the rest (addresses, phone
+# numbers) are a read of the profile file away
+PROFILE_FIELDS = [
+    'legislator_profile_id',
+    'session_id',
+    'year',
+    'name',
+    'chamber',
+    'district',
+    'party',
+    'counties',
+    'occupation',
+    'term'
+]
+
+
+def timeline_path(canonical_id, timelines_dir=TIMELINES_DIR):
+    return os.path.join(timelines_dir, f'sd-legislator-{canonical_id}.json')
+
+
+def data_files(data_dir, object_type, name):
+    ''' Parsed data files of one type, in no particular order '''
+
+    for filepath in glob.iglob(os.path.join(data_dir, object_type, f'sd-legislature-{name}-*.json')):
+        with open(filepath, 'r') as infile:
+            yield json.load(infile)
+
+
+def build_timelines(data_dir=DATA_DIR, timelines_dir=TIMELINES_DIR, xwalk_file=XWALK_FILE):
+    ''' Gather each legislator's profiles, sponsored bills, committee seats and roll-call votes across every session into one file per canonical ID, plus an index.json to find them by name or profile ID '''
+
+    xwalk = read_xwalk(xwalk_file)
+
+    # profile ID -> canonical ID, from the crosswalk first and then from the
+    # profile itself, for profiles saved before the crosswalk caught up
+    canonical_ids = {int(k): int(v) for k, v in xwalk.items() if v}
+
+    timelines = defaultdict(lambda: {
+        'profiles': [],
+        'sponsored_bills': [],
+        'committees': [],
+        'votes': defaultdict(lambda: defaultdict(set))
+    })
+
+    unmapped = set()
+
+    for profile_data in data_files(data_dir, 'legislators', 'legislator'):
+        profile_id = profile_data.get('legislator_profile_id')
+
+        if profile_id is None:
+            continue
+
+        canonical_id = canonical_ids.get(profile_id) or profile_data.get('legislator_canonical_id')
+
+        if not canonical_id:
+            unmapped.add(profile_id)
+            continue
+
+        canonical_ids[profile_id] = int(canonical_id)
+
+        timelines[int(canonical_id)]['profiles'].append({x: profile_data.get(x) for x in PROFILE_FIELDS})
+
+    def canonical_id_of(profile_id):
+        if profile_id is not None and profile_id not in canonical_ids:
+            unmapped.add(profile_id)
+
+        return canonical_ids.get(profile_id)
+
+    for bill_data in data_files(data_dir, 'bills', 'bill'):
+        bill = {
+            'session_id': bill_data.get('session_id'),
+            'bill_id': bill_data.get('bill_id'),
+            'bill_type': bill_data.get('bill_type'),
+            'bill_number': bill_data.get('bill_number'),
+            'bill_title': bill_data.get('bill_title')
+        }
+
+        for sponsor in bill_data.get('sponsors') or []:
+            canonical_id = canonical_id_of(sponsor.get('legislator_profile_id'))
+
+            if canonical_id:
+                timelines[canonical_id]['sponsored_bills'].append({
+                    **bill,
+                    'legislator_profile_id': sponsor.get('legislator_profile_id'),
+                    'is_prime': sponsor.get('is_prime')
+                })
+
+        for action in bill_data.get('action_log') or []:
+            vote = action.get('vote')
+
+            if not vote or vote.get('vote_id') is None:
+                continue
+
+            for category, member_ids in vote.items():
+                if not isinstance(member_ids, list):
+                    continue
+
+                for member_id in member_ids:
+                    canonical_id = canonical_id_of(member_id)
+
+                    # a set, since the same roll call can be on more than one bill
+                    if canonical_id:
+                        timelines[canonical_id]['votes'][str(bill['session_id'])][category].add(vote['vote_id'])
+
+    for committee_data in data_files(data_dir, 'committees', 'committee'):
+        for member in committee_data.get('members') or []:
+            canonical_id = canonical_id_of(member.get('legislator_profile_id'))
+
+            if canonical_id:
+                timelines[canonical_id]['committees'].append({
+                    'session_id': committee_data.get('session_id'),
+                    'committee_id': committee_data.get('committee_id'),
+                    'committee_id_canon': committee_data.get('committee_id_canon'),
+                    'committee_name': committee_data.get('committee_name'),
+                    'chamber': committee_data.get('chamber'),
+                    'legislator_profile_id': member.get('legislator_profile_id'),
+                    'committee_member_type': member.get('committee_member_type')
+                })
+
+    # session IDs aren't in date order, so order everything by the year of
+    # the member's profile in that session
+    index = {}
+    written = 0
+
+    os.makedirs(timelines_dir, exist_ok=True)
+
+    for canonical_id, timeline in sorted(timelines.items()):
+        profiles = sorted(timeline['profiles'], key=lambda x: (str(x['year']), x['session_id']))
+        order = {str(x['session_id']): i for i, x in enumerate(profiles)}
+
+        def session_order(session_id):
+            return (order.get(str(session_id), len(order)), str(session_id))
+
+        votes = {
+            session_id: {category: sorted(vote_ids) for category, vote_ids in sorted(categories.items())}
+            for session_id, categories in sorted(timeline['votes'].items(), key=lambda x: session_order(x[0]))
+        }
+
+        data = {
+            'legislator_canonical_id': canonical_id,
+            'name': profiles[-1]['name'] if profiles else None,
+            'first_year': profiles[0]['year'] if profiles else None,
+            'last_year': profiles[-1]['year'] if profiles else None,
+            'profiles': profiles,
+            'sponsored_bills': sorted(timeline['sponsored_bills'], key=lambda x: (session_order(x['session_id']), x['bill_id'])),
+            'committees': sorted(timeline['committees'], key=lambda x: (session_order(x['session_id']), x['committee_id'])),
+            'vote_counts': {
+                session_id: {category: len(vote_ids) for category, vote_ids in categories.items()}
+                for session_id, categories in votes.items()
+            },
+            'votes': votes
+        }
+
+        changed, size = write_atomic(timeline_path(canonical_id, timelines_dir), json.JSONEncoder().iterencode(data), skip_unchanged=True)
+
+        written += changed
+
+        index[str(canonical_id)] = {
+            'name': data['name'],
+            'first_year': data['first_year'],
+            'last_year': data['last_year'],
+            'legislator_profile_ids': [x['legislator_profile_id'] for x in profiles]
+        }
+
+    write_atomic(os.path.join(timelines_dir, 'index.json'), json.JSONEncoder().iterencode(index), skip_unchanged=True)
+
+    print(f'{len(index):,} legislator timelines in {timelines_dir} ({written:,} written, {len(index) - written:,} unchanged)')
+
+    if unmapped:
+        print(f'{len(unmapped):,} legislator profile IDs have no canonical ID and were left out; see crawler/xwalk.py')
+
+    return index
+
+
+def read_timeline(canonical_id, timelines_dir=TIMELINES_DIR):
+    ''' Everything about one legislator, by canonical ID '''
+
+    with open(timeline_path(canonical_id, timelines_dir), 'r') as infile:
+        return json.load(infile)
+
+
+def find_timelines(name=None, legislator_profile_id=None, timelines_dir=TIMELINES_DIR):
+    ''' Canonical IDs of legislators whose name contains name, or who had this profile ID '''
+
+    with open(os.path.join(timelines_dir, 'index.json'), 'r') as infile:
+        index = json.load(infile)
+
+    return [
+        int(canonical_id) for canonical_id, x in index.items()
+        if (name is None or name.lower() in (x['name'] or '').lower())
+        and (legislator_profile_id is None or int(legislator_profile_id) in x['legislator_profile_ids'])
+    ]
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Build a timeline of profiles, bills, committees and votes for each legislator across sessions')
+
+    parser.add_argument(
+        '--data-dir',
+        default=DATA_DIR,
+        help='Directory of crawled data files'
+    )
+
+    parser.add_argument(
+        '--output',
+        default=TIMELINES_DIR,
+        help='Directory to write one file per legislator into'
+    )
+
+    args = parser.parse_args()
+
+    build_timelines(data_dir=args.data_dir, timelines_dir=args.output)
@@ -0,0 +1,505 @@
+# flake8: noqa
+
+import os
+import re
+import sys
+import json
+import glob
+import time
+import argparse
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from bill_text import expand_bill_versions
+
+
+DATA_DIR = os.path.abspath(
+    os.path.join(
+        os.path.dirname( __file__ ),
+        '..',
+        'data'
+    )
+)
+
+# object type -> (data file glob relative to the data directory, ID field)
+SOURCES = {
+    'sessions': ('sessions/sd-legislature-session-*.json', 'session_id'),
+    'bills': ('bills/sd-legislature-bill-*.json', 'bill_id'),
+    'legislators': ('legislators/sd-legislature-legislator-*.json', 'legislator_profile_id'),
+    'committees': ('committees/sd-legislature-committee-*.json', 'committee_id')
+}
+
+ID_RE = re.compile(r'-(\d+)\.json$')
+
+NULLABLE = (type(None),)
+
+# object type -> field -> types it may have, as written by models.py.
+# Session IDs in session files are strings, because that's how the API
+# lists them; everywhere else they're ints
+SCHEMAS = {
+    'sessions': {
+        'session_id': (str,),
+        'session_name': (str,),
+        'session_number': (int,),
+        'is_current_session': (bool,),
+        'is_special_session': (bool,),
+        'start_date': (str,),
+        'end_date': (str,),
+        'docs': (list,),
+        'bills': (list,),
+        'legislators': (list,),
+        'committees': (list,),
+        'session_laws': (dict,),
+        'conference_committees': (list,)
+    },
+    'bills': {
+        'session_id': (int,),
+        'bill_id': (int,),
+        'bill_type': (str,),
+        'bill_number': (int,),
+        'bill_title': (str,),
+        'sponsors': (list,),
+        'keywords': (list,),
+        'audio': (list,),
+        'bill_versions': (list,),
+        'amendments': (list,),
+        'fiscal_notes': (list,),
+        'action_log': (list,),
+        'rss_feed': (str,)
+    },
+    'legislators': {
+        'session_id': (int,),
+        'year': (str,),
+        'legislator_profile_id': (int,),
+        'chamber': (str,),
+        'name': (str,),
+        'district': (str,),
+        'address1': (str,) + NULLABLE,
+        'address2': (str,) + NULLABLE,
+        'city': (str,) + NULLABLE,
+        'state': (str,),
+        'zipcode': (str,) + NULLABLE,
+        'phone_home': (str,) + NULLABLE,
+        'phone_capitol': (str,) + NULLABLE,
+        'phone_biz': (str,) + NULLABLE,
+        'phone_cell': (str,) + NULLABLE,
+        'email': (str,) + NULLABLE,
+        'picture': (str,),
+        'party': (str,),
+        'term': (str,),
+        'occupation': (str,) + NULLABLE,
+        'counties': (str,),
+        'legislator_canonical_id': (int, str) + NULLABLE
+    },
+    'committees': {
+        'session_id': (int,),
+        'committee_id': (int,),
+        'committee_name': (str,),
+        'committee_room': (str,) + NULLABLE,
+        'committee_days': (str,) + NULLABLE,
+        'is_full_body': (bool,),
+        'committee_id_canon': (int,),
+        'chamber': (str,),
+        'authority': (str,),
+        'members': (list,),
+        'non_committee_members': (list,),
+        'staff': (list,)
+    }
+}
+
+# fields a file may have on top of its schema
+OPTIONAL_FIELDS = {
+    'bills': {
+        'session_law': (int,)
+    }
+}
+
+ACTION_COMMITTEE_FIELDS = ['committee_id_action', 'committee_id_assigned']
+
+
+def type_names(types):
+    return ' or '.join('null' if x is type(None) else x.__name__ for x in types)
+
+
+def is_type(value, types):
+    # bool is a subclass of int, but True isn't an ID
+    if isinstance(value, bool) and bool not in types:
+        return False
+
+    return isinstance(value, types)
+
+
+def check_schema(object_type, data, violations, severity='error'):
+    ''' Missing fields and fields of the wrong type '''
+
+    schema = SCHEMAS[object_type]
+    optional = OPTIONAL_FIELDS.get(object_type, {})
+
+    missing = [x for x in schema if x not in data]
+
+    if missing:
+        violations.append((severity, 'schema', f'missing {", ".join(missing)}'))
+
+    for field, types in schema.items():
+        if field in data and not is_type(data[field], types):
+            violations.append((severity, 'schema', f'{field} is {type(data[field]).__name__}, not {type_names(types)}'))
+
+    for field, value in data.items():
+        if field in optional:
+            if not is_type(value, optional[field]):
+                violations.append(('error', 'schema', f'{field} is {type(value).__name__}, not {type_names(optional[field])}'))
+        elif field not in schema:
+            violations.append(('warning', 'schema', f'unexpected field {field}'))
+
+
+def profile_ids(items, where, violations):
+    ''' legislator_profile_id of each item in a list of sponsors or members '''
+
+    ids = []
+
+    for i, item in enumerate(items if isinstance(items, list) else []):
+        profile_id = item.get('legislator_profile_id') if isinstance(item, dict) else None
+
+        if not is_type(profile_id, (int,)):
+            violations.append(('error', 'schema', f'{where}[{i}] has no legislator_profile_id'))
+            continue
+
+        ids.append(profile_id)
+
+    return ids
+
+
+def summarize_session(data, violations):
+    session_laws = data.get('session_laws') if isinstance(data.get('session_laws'), dict) else {}
+
+    for key in ('bills', 'legislators', 'committees'):
+        if isinstance(data.get(key), list) and not all(is_type(x, (int,)) for x in data[key]):
+            violations.append(('error', 'schema', f'{key} has IDs that aren\'t ints'))
+
+    return {
+        'bills': [x for x in data.get('bills') or [] if is_type(x, (int,))],
+        'legislators': [x for x in data.get('legislators') or [] if is_type(x, (int,))],
+        'committees': [x for x in data.get('committees') or [] if is_type(x, (int,))],
+        # the API lists some laws without a bill; they come out as "null"
+        'session_laws': {k: v for k, v in session_laws.items() if k != 'null'},
+        'conference_bills': [x.get('bill_id') for x in data.get('conference_committees') or [] if isinstance(x, dict)]
+    }
+
+
+def summarize_bill(data, violations):
+    try:
+        expand_bill_versions(data)
+    except Exception as e:
+        violations.append(('error', 'bill_text', f'bill text deltas don\'t apply: {type(e).__name__}: {e}'))
+
+    committees = []
+    voters = set()
+
+    for i, action in enumerate(data.get('action_log') or []):
+        if not isinstance(action, dict):
+            violations.append(('error', 'schema', f'action_log[{i}] is {type(action).__name__}, not dict'))
+            continue
+
+        for field in ACTION_COMMITTEE_FIELDS:
+            committee_id = action.get(field)
+
+            if committee_id is not None:
+                committees.append((i, field, committee_id))
+
+        vote = action.get('vote')
+
+        if not isinstance(vote, dict):
+            violations.append(('error', 'schema', f'action_log[{i}].vote is {type(vote).__name__}, not dict'))
+            continue
+
+        if vote and not is_type(vote.get('vote_id'), (int,)):
+            violations.append(('error', 'schema', f'action_log[{i}].vote has no vote_id'))
+
+        for category, member_ids in vote.items():
+            if isinstance(member_ids, list):
+                voters.update(x for x in member_ids if is_type(x, (int,)))
+
+    return {
+        'sponsors': profile_ids(data.get('sponsors'), 'sponsors', violations),
+        'session_law': data.get('session_law'),
+        'committees': committees,
+        'voters': sorted(voters)
+    }
+
+
+def summarize_legislator(data, violations):
+    if data.get('legislator_canonical_id') in (None, ''):
+        violations.append(('warning', 'xwalk', 'no legislator_canonical_id; add it to crawler/sd-legislator-xwalk.csv'))
+
+    return {}
+
+
+def summarize_committee(data, violations):
+    return {
+        'members': profile_ids(data.get('members'), 'members', violations)
+    }
+
+
+SUMMARIZERS = {
+    'sessions': summarize_session,
+    'bills': summarize_bill,
+    'legislators': summarize_legislator,
+    'committees': summarize_committee
+}
+
+
+def check_file(job):
+    ''' Parse and check one data file in a worker process. Returns its violations and a small summary of the IDs it refers to, for the cross-file checks '''
+
+    object_type, filepath = job
+    violations = []
+
+    try:
+        with open(filepath, 'r') as infile:
+            data = json.load(infile)
+    except (OSError, UnicodeDecodeError, ValueError) as e:
+        return object_type, filepath, None, [('error', 'json', f'{type(e).__name__}: {e}')]
+
+    if not isinstance(data, dict):
+        return object_type, filepath, None, [('error', 'json', f'top level is {type(data).__name__}, not an object')]
+
+    # get_bill_data() sometimes comes back empty, which leaves a bill file
+    # with only the parts fetched separately and its ID as a string. That's
+    # the API's gap, not a broken file, and the next crawl fills it in
+    incomplete = object_type == 'bills' and 'session_id' not in data
+
+    check_schema(object_type, data, violations, severity='warning' if incomplete else 'error')
+
+    id_field = SOURCES[object_type][1]
+    object_id = data.get(id_field)
+    file_id = int(ID_RE.search(filepath).group(1))
+
+    try:
+        object_id = int(object_id)
+    except (TypeError, ValueError):
+        object_id = file_id
+
+    if object_id != file_id:
+        violations.append(('error', 'id', f'{id_field} is {object_id}, but the file is named for {file_id}'))
+
+    try:
+        session_id = int(data.get('session_id'))
+    except (TypeError, ValueError):
+        session_id = None
+
+    summary = {
+        'id': object_id,
+        'session_id': session_id,
+        **SUMMARIZERS[object_type](data, violations)
+    }
+
+    return object_type, filepath, summary, violations
+
+
+def data_files(data_dir):
+    ''' (object type, path) of every data file, lazily '''
+
+    for object_type, (pattern, id_field) in SOURCES.items():
+        for filepath in glob.iglob(os.path.join(data_dir, pattern)):
+            yield object_type, filepath
+
+
+def id_list(ids, limit=10):
+    ''' A few IDs for a message, and how many more there are '''
+
+    listed = ', '.join(map(str, ids[:limit]))
+
+    return listed if len(ids) <= limit else f'{listed} and {len(ids) - limit:,} more'
+
+
+def check_references(summaries, paths, violations):
+    ''' Cross-file checks: that the IDs each file refers to belong to files that exist, in the same session. These are warnings, since they're gaps in what the API returned or what a time-limited crawl got to, which a later crawl can fill in '''
+
+    sessions = summaries['sessions']
+    bills = summaries['bills']
+    legislators = summaries['legislators']
+    committees = summaries['committees']
+
+    def report(object_type, object_id, check, message):
+        violations.append(('warning', paths[object_type][object_id], check, message))
+
+    for session_id, session in sessions.items():
+        for object_type, key in (('bills', 'bills'), ('legislators', 'legislators'), ('committees', 'committees')):
+            for object_id in session[key]:
+                found = summaries[object_type].get(object_id)
+
+                if found is None:
+                    report('sessions', session_id, 'reference', f'{key} lists {object_id}, which has no readable data file')
+                elif found['session_id'] is not None and found['session_id'] != session_id:
+                    report('sessions', session_id, 'reference', f'{key} lists {object_id}, which is in session {found["session_id"]}')
+
+        for bill_id in session['conference_bills']:
+            if bill_id not in bills:
+                report('sessions', session_id, 'reference', f'conference committee on bill {bill_id}, which has no readable data file')
+
+    for bill_id, bill in bills.items():
+        session = sessions.get(bill['session_id'])
+
+        for i, field, committee_id in bill['committees']:
+            committee = committees.get(committee_id)
+
+            if committee is None:
+                report('bills', bill_id, 'reference', f'action_log[{i}].{field} is committee {committee_id}, which has no readable data file')
+            elif bill['session_id'] is not None and committee['session_id'] != bill['session_id']:
+                report('bills', bill_id, 'reference', f'action_log[{i}].{field} is committee {committee_id}, from session {committee["session_id"]}')
+
+        if session is None:
+            if bill['session_id'] is not None:
+                report('bills', bill_id, 'reference', f'session {bill["session_id"]} has no data file')
+            continue
+
+        members = session['member_set']
+
+        for profile_id in bill['sponsors']:
+            if profile_id not in members:
+                report('bills', bill_id, 'reference', f'sponsor {profile_id} isn\'t among session {bill["session_id"]}\'s legislators')
+
+        stray = [x for x in bill['voters'] if x not in members]
+
+        if stray:
+            report('bills', bill_id, 'reference', f'roll calls include {id_list(stray)}, not among session {bill["session_id"]}\'s legislators')
+
+        # session_law should be exactly what Session.get_session_laws
+        # mapped this bill to
+        expected = session['session_laws'].get(str(bill_id))
+
+        if bill['session_law'] != expected:
+            report('bills', bill_id, 'session_law', f'session_law is {bill["session_law"]}, but session {bill["session_id"]} maps this bill to {expected}')
+
+    for committee_id, committee in committees.items():
+        session = sessions.get(committee['session_id'])
+
+        if session is None:
+            report('committees', committee_id, 'reference', f'session {committee["session_id"]} has no data file')
+            continue
+
+        stray = [x for x in committee['members'] if x not in session['member_set']]
+
+        if stray:
+            report('committees', committee_id, 'reference', f'members include {id_list(stray)}, not among session {committee["session_id"]}\'s legislators')
+
+    for profile_id, legislator in legislators.items():
+        if legislator['session_id'] not in sessions:
+            report('legislators', profile_id, 'reference', f'session {legislator["session_id"]} has no data file')
+
+
+def validate(data_dir=DATA_DIR, workers=None, chunksize=64):
+    ''' Check every data file in a pool of processes, then check references between them; returns a list of (severity, path, check, message) '''
+
+    start = time.perf_counter()
+
+    workers = workers or multiprocessing.cpu_count()
+
+    summaries = {x: {} for x in SOURCES}
+    paths = {x: {} for x in SOURCES}
+    violations = []
+    files = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for object_type, filepath, summary, file_violations in executor.map(check_file, data_files(data_dir), chunksize=chunksize):
+            files += 1
+
+            path = os.path.relpath(filepath, os.path.dirname(data_dir))
+
+            violations.extend((severity, path, check, message) for severity, check, message in file_violations)
+
+            if summary is None:
+                continue
+
+            summaries[object_type][summary['id']] = summary
+            paths[object_type][summary['id']] = path
+
+    for session in summaries['sessions'].values():
+        session['member_set'] = set(session['legislators'])
+
+    check_references(summaries, paths, violations)
+
+    violations.sort(key=lambda x: (x[1], x[0], x[2], x[3]))
+
+    print(f'Checked {files:,} files with {workers} processes in {time.perf_counter() - start:,.1f}s')
+
+    return violations
+
+
+def read_report(filepath):
+    ''' Violations saved with --report, as (severity, path, check, message) '''
+
+    with open(filepath, 'r') as infile:
+        return {(x['severity'], x['path'], x['check'], x['message']) for x in json.load(infile)}
+
+
+def write_report(violations, filepath):
+    ''' Save violations as JSON, one object per violation '''
+
+    with open(filepath, 'w') as outfile:
+        json.dump(
+            [dict(zip(('severity', 'path', 'check', 'message'), x)) for x in violations],
+            outfile,
+            indent=2
+        )
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Check every data file for well-formed JSON, the expected fields, and references to other files that exist. Exits with status 1 if anything fails')
+
+    parser.add_argument(
+        '--data-dir',
+        default=DATA_DIR,
+        help='Directory of crawled data files'
+    )
+
+    parser.add_argument(
+        '--workers',
+        type=int,
+        help='Number of processes; defaults to one per CPU'
+    )
+
+    parser.add_argument(
+        '--strict',
+        action='store_true',
+        help='Fail on warnings, too'
+    )
+
+    parser.add_argument(
+        '--report',
+        help='Also write every violation to this file as JSON'
+    )
+
+    parser.add_argument(
+        '--baseline',
+        help='A saved --report of known violations; only violations that aren\'t in it fail the run'
+    )
+
+    args = parser.parse_args()
+
+    violations = validate(data_dir=args.data_dir, workers=args.workers)
+
+    known = read_report(args.baseline) if args.baseline else set()
+
+    for violation in violations:
+        severity, path, check, message = violation
+        print(f'{path}: {severity}: [{check}] {message}' + (' (known)' if violation in known else ''))
+
+    counts = Counter(x[0] for x in violations)
+    new = Counter(x[0] for x in violations if x not in known)
+
+    print(f'{counts["error"]:,} errors, {counts["warning"]:,} warnings' + (f' ({new["error"]:,} and {new["warning"]:,} new since the baseline)' if args.baseline else ''))
+
+    if args.baseline:
+        fixed = len(known - set(violations))
+
+        if fixed:
+            print(f'{fixed:,} violations in the baseline are gone; save a new one with --report')
+
+    if args.report:
+        write_report(violations, args.report)
+
+    if new['error'] or (args.strict and new['warning']):
+        sys.exit(1)
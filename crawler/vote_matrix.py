@@ -0,0 +1,280 @@
+# flake8: noqa
+
+import os
+import io
+import csv
+import ast
+import json
+import glob
+import struct
+import argparse
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from storage import write_atomic
+
+
+DATA_DIR = os.path.abspath(
+    os.path.join(
+        os.path.dirname( __file__ ),
+        '..',
+        'data'
+    )
+)
+
+VOTES_DIR = os.path.abspath(
+    os.path.join(
+        os.path.dirname( __file__ ),
+        '..',
+        'exports',
+        'votes'
+    )
+)
+
+# matrix cell values. Yea and Nay are +1 and -1 so sums along a row or
+# column come out as net support; 0 means the legislator wasn't on the
+# roll call at all, e.g. a House member on a Senate vote, and 9
+# (OTHER_CODE) is any category not listed here
+VOTE_CODES = {
+    'Yea': 1,
+    'Nay': -1,
+    'Excused': 2,
+    'Absent': 3,
+    'Not Voting': 4,
+    'Present': 5,
+    'Suspended': 6
+}
+
+# a vote category the API hasn't used before; build_vote_matrix() prints
+# how many votes got it
+OTHER_CODE = 9
+
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+
+COLUMN_FIELDS = [
+    'vote_id',
+    'bill_ids',
+    'action_date',
+    'status_text',
+    'result',
+    'president_vote',
+    'yeas',
+    'nays'
+]
+
+
+def write_npy(filepath, shape, values):
+    ''' Save int8 values as a row-major .npy file (format version 1.0) that numpy.load() can read, without needing numpy '''
+
+    header = f"{{'descr': '|i1', 'fortran_order': False, 'shape': {tuple(shape)}, }}"
+
+    # the header is padded with spaces so the data starts on a 64-byte
+    # boundary, and ends with a newline
+    padding = 64 - (len(NPY_MAGIC) + 2 + len(header) + 1) % 64
+    header = (header + ' ' * padding + '\n').encode('latin1')
+
+    write_atomic(filepath, [NPY_MAGIC, struct.pack('<H', len(header)), header, bytes(values)])
+
+
+def read_npy(filepath):
+    ''' The shape and raw int8 bytes of a file written by write_npy() '''
+
+    with open(filepath, 'rb') as infile:
+        if infile.read(len(NPY_MAGIC)) != NPY_MAGIC:
+            raise ValueError(f'{filepath} is not a version 1.0 .npy file')
+
+        header_length, = struct.unpack('<H', infile.read(2))
+        header = ast.literal_eval(infile.read(header_length).decode('latin1'))
+
+        return header['shape'], infile.read()
+
+
+def session_votes(session_id, data_dir=DATA_DIR):
+    ''' Every roll call on a session's bills, one per vote ID, in date order, with the IDs of the bills it's listed on '''
+
+    with open(os.path.join(data_dir, 'sessions', f'sd-legislature-session-{session_id}.json'), 'r') as infile:
+        session_data = json.load(infile)
+
+    votes = {}
+
+    for bill_id in session_data.get('bills') or []:
+        filepath = os.path.join(data_dir, 'bills', f'sd-legislature-bill-{bill_id}.json')
+
+        try:
+            with open(filepath, 'r') as infile:
+                bill_data = json.load(infile)
+        except FileNotFoundError:
+            continue
+
+        for action in bill_data.get('action_log') or []:
+            vote = action.get('vote')
+
+            if not vote or vote.get('vote_id') is None:
+                continue
+
+            # the same roll call can be listed on more than one bill
+            if vote['vote_id'] in votes:
+                votes[vote['vote_id']]['bill_ids'].append(bill_id)
+                continue
+
+            votes[vote['vote_id']] = {
+                'vote': vote,
+                'action': action,
+                'bill_ids': [bill_id]
+            }
+
+    ordered = sorted(votes.values(), key=lambda x: (x['action'].get('action_date') or '', x['vote']['vote_id']))
+
+    return session_data, ordered
+
+
+def build_vote_matrix(session_id, data_dir=DATA_DIR, votes_dir=VOTES_DIR):
+    ''' Write one session's legislator x roll call matrix as matrix.npy, with rows.csv and columns.csv saying which legislator and vote each row and column is '''
+
+    session_data, votes = session_votes(session_id, data_dir=data_dir)
+
+    legislators = set(session_data.get('legislators') or [])
+
+    for x in votes:
+        for category, member_ids in x['vote'].items():
+            if isinstance(member_ids, list):
+                legislators.update(member_ids)
+
+    rows = sorted(legislators)
+    row_numbers = {x: i for i, x in enumerate(rows)}
+
+    values = bytearray(len(rows) * len(votes))
+    other = 0
+
+    for j, x in enumerate(votes):
+        for category, member_ids in x['vote'].items():
+            if not isinstance(member_ids, list):
+                continue
+
+            code = VOTE_CODES.get(category, OTHER_CODE)
+
+            if code == OTHER_CODE:
+                other += len(member_ids)
+
+            for member_id in member_ids:
+                # int8 in two's complement, so Nay is stored as 0xff
+                values[row_numbers[member_id] * len(votes) + j] = code & 0xff
+
+    out_dir = os.path.join(votes_dir, f'session-{session_id}')
+
+    os.makedirs(out_dir, exist_ok=True)
+
+    # the matrix goes last; load_vote_matrix() checks the three agree
+    row_file = io.StringIO(newline='')
+
+    writer = csv.writer(row_file)
+    writer.writerow(['row', 'legislator_profile_id'])
+    writer.writerows(enumerate(rows))
+
+    write_atomic(os.path.join(out_dir, 'rows.csv'), [row_file.getvalue()])
+
+    column_file = io.StringIO(newline='')
+
+    writer = csv.DictWriter(column_file, fieldnames=['column'] + COLUMN_FIELDS)
+    writer.writeheader()
+
+    for j, x in enumerate(votes):
+        writer.writerow({
+            'column': j,
+            'vote_id': x['vote']['vote_id'],
+            'bill_ids': ';'.join(str(b) for b in x['bill_ids']),
+            'action_date': x['action'].get('action_date'),
+            'status_text': x['action'].get('status_text'),
+            'result': x['action'].get('result'),
+            'president_vote': x['vote'].get('president_vote'),
+            'yeas': len(x['vote'].get('Yea') or []),
+            'nays': len(x['vote'].get('Nay') or [])
+        })
+
+    write_atomic(os.path.join(out_dir, 'columns.csv'), [column_file.getvalue()])
+
+    write_npy(os.path.join(out_dir, 'matrix.npy'), (len(rows), len(votes)), values)
+
+    if other:
+        print(f'Session {session_id}: {other:,} votes in categories without a code, stored as {OTHER_CODE}')
+
+    return out_dir, (len(rows), len(votes))
+
+
+def build_vote_matrices(data_dir=DATA_DIR, votes_dir=VOTES_DIR, session_ids=None):
+    ''' Write a vote matrix for every session, or just the ones given '''
+
+    if session_ids is None:
+        session_ids = sorted(
+            int(os.path.basename(x).split('-')[-1].split('.')[0])
+            for x in glob.glob(os.path.join(data_dir, 'sessions', 'sd-legislature-session-*.json'))
+        )
+
+    for session_id in session_ids:
+        out_dir, shape = build_vote_matrix(session_id, data_dir=data_dir, votes_dir=votes_dir)
+
+        print(f'Session {session_id}: {shape[0]:,} legislators x {shape[1]:,} roll calls -> {out_dir}')
+
+
+def load_vote_matrix(session_id, votes_dir=VOTES_DIR):
+    ''' A session's vote matrix as (legislator_profile_ids, vote_ids, matrix): a numpy array if numpy is installed, otherwise a list of rows of ints '''
+
+    out_dir = os.path.join(votes_dir, f'session-{session_id}')
+
+    with open(os.path.join(out_dir, 'rows.csv'), 'r') as infile:
+        rows = [int(x['legislator_profile_id']) for x in csv.DictReader(infile)]
+
+    with open(os.path.join(out_dir, 'columns.csv'), 'r') as infile:
+        columns = [int(x['vote_id']) for x in csv.DictReader(infile)]
+
+    filepath = os.path.join(out_dir, 'matrix.npy')
+
+    if numpy is not None:
+        matrix = numpy.load(filepath, mmap_mode='r')
+        shape = matrix.shape
+    else:
+        shape, values = read_npy(filepath)
+
+    # each file is swapped in whole, but a build can die between them
+    if tuple(shape) != (len(rows), len(columns)):
+        raise ValueError(f'{filepath} is {shape[0]} x {shape[1]}, but rows.csv and columns.csv list {len(rows)} x {len(columns)}; build the matrix again')
+
+    if numpy is not None:
+        return rows, columns, matrix
+
+    n_rows, n_columns = shape
+
+    signed = struct.unpack(f'{len(values)}b', values)
+
+    return rows, columns, [list(signed[i * n_columns:(i + 1) * n_columns]) for i in range(n_rows)]
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Build a legislator x roll call vote matrix for each session')
+
+    parser.add_argument(
+        '--session-id',
+        type=int,
+        nargs='+',
+        help='Only build these sessions'
+    )
+
+    parser.add_argument(
+        '--data-dir',
+        default=DATA_DIR,
+        help='Directory of crawled data files'
+    )
+
+    parser.add_argument(
+        '--output',
+        default=VOTES_DIR,
+        help='Directory to write a folder of matrix files per session into'
+    )
+
+    args = parser.parse_args()
+
+    build_vote_matrices(data_dir=args.data_dir, votes_dir=args.output, session_ids=args.session_id)
@@ -0,0 +1,361 @@
+# flake8: noqa
+
+import io
+import os
+import re
+import csv
+import json
+import glob
+import argparse
+import threading
+import unicodedata
+from collections import defaultdict
+
+from storage import write_atomic
+
+
+XWALK_FILE = os.path.abspath(
+    os.path.join(
+        os.path.dirname( __file__ ),
+        'sd-legislator-xwalk.csv'
+    )
+)
+
+PROPOSALS_FILE = os.path.abspath(
+    os.path.join(
+        os.path.dirname( __file__ ),
+        'sd-legislator-xwalk-proposed.csv'
+    )
+)
+
+LEGISLATORS_DIR = os.path.abspath(
+    os.path.join(
+        os.path.dirname( __file__ ),
+        '..',
+        'data',
+        'legislators'
+    )
+)
+
+PROPOSAL_COLUMNS = [
+    'legislator_profile_id',
+    'legislator_id_canon',
+    'confidence',
+    'session_id',
+    'profile_name',
+    'matched_name',
+    'candidates'
+]
+
+NAME_SUFFIXES = {'jr', 'sr', 'ii', 'iii', 'iv'}
+
+CHAMBERS = {
+    'H': 'House',
+    'S': 'Senate'
+}
+
+# how much each kind of agreement counts toward a match; they add up to 1
+WEIGHTS = {
+    'first_name': 0.45,
+    'year': 0.3,
+    'chamber': 0.15,
+    'county': 0.1
+}
+
+# a runner-up this close to the best match makes the best one a coin flip
+AMBIGUITY_MARGIN = 0.15
+
+
+def name_tokens(name):
+    ''' Lowercase ASCII words of a name, without punctuation or suffixes like Jr. '''
+
+    name = unicodedata.normalize('NFKD', name or '')
+    name = ''.join(x for x in name if not unicodedata.combining(x)).lower()
+
+    # O'Brien -> obrien, but Smith-Jones -> smith jones
+    name = re.sub(r"['’.]", '', name)
+    tokens = re.sub(r'[^a-z]+', ' ', name).split()
+
+    return [x for x in tokens if x not in NAME_SUFFIXES]
+
+
+def name_key(name):
+    ''' One string for a surname however it's spaced or punctuated: Van Gerpen -> vangerpen '''
+
+    return ''.join(name_tokens(name))
+
+
+def session_year(profile_data):
+    ''' The calendar year of a profile's session; years look like "2010", "1997s" or "2021i" '''
+
+    match = re.match(r'\d{4}', str(profile_data.get('year') or ''))
+
+    return int(match.group()) if match else None
+
+
+def first_name_score(profile_first, member):
+    ''' How well a profile's first name fits a member's: the same name, one that starts the other, or just the same initial '''
+
+    best = 0
+
+    names = name_tokens(member.get('name_first')) + name_tokens(member.get('name_middle'))
+
+    for i, name in enumerate(names):
+        # a profile going by the middle name is a little less likely
+        discount = 1 if i == 0 else 0.8
+
+        if name == profile_first:
+            score = 1
+        elif len(name) > 1 and len(profile_first) > 1 and (name.startswith(profile_first) or profile_first.startswith(name)):
+            score = 0.75
+        elif name[:1] == profile_first[:1]:
+            score = 0.4
+        else:
+            score = 0
+
+        best = max(best, score * discount)
+
+    return best
+
+
+class LegislatorResolver(object):
+    ''' Matches session legislator profiles to canonical member IDs from the historical members list, using an index of surnames built once per run '''
+
+    def __init__(self, historical_legislator_data=None, year_slack=1):
+        self.members = historical_legislator_data or []
+
+        # sessions early in January can fall outside a member's listed years
+        self.year_slack = year_slack
+
+        self.by_surname = defaultdict(list)
+
+        for member in self.members:
+            self.by_surname[name_key(member.get('name_last'))].append(member)
+
+        self.lock = threading.Lock()
+        self.proposals = {}
+
+    def candidates(self, profile_data):
+        ''' Members whose surname fits the end of the profile's name '''
+
+        name = profile_data.get('name') or ''
+        tokens = name_tokens(name)
+
+        # surnames can run to several words, so try the last one, two and three
+        keys = {''.join(tokens[-n:]) for n in range(1, min(len(tokens), 4))} or set(tokens)
+
+        # and a hyphenated married name may be listed under either half
+        if '-' in name:
+            keys.update(name_key(x) for x in name.split()[-1].split('-'))
+
+        found = {}
+
+        for key in keys:
+            for member in self.by_surname.get(key, []):
+                found[member.get('legislator_id_canon')] = member
+
+        return list(found.values())
+
+    def score(self, profile_data, member):
+        ''' 0 to 1: how well a member fits a profile, by first name, years served, chamber and county '''
+
+        tokens = name_tokens(profile_data.get('name'))
+
+        score = WEIGHTS['first_name'] * first_name_score(tokens[0], member) if tokens else 0
+
+        year = session_year(profile_data)
+        year_start = member.get('year_start')
+        year_end = member.get('year_end') or year
+
+        if year and year_start and year_start - self.year_slack <= year <= year_end + self.year_slack:
+            score += WEIGHTS['year']
+
+        if CHAMBERS.get(profile_data.get('chamber')) in (member.get('chambers') or []):
+            score += WEIGHTS['chamber']
+
+        counties = {name_key(x) for x in (profile_data.get('counties') or '').split(',')}
+
+        if counties & {name_key(x) for x in member.get('counties') or []}:
+            score += WEIGHTS['county']
+
+        return round(score, 4)
+
+    def resolve(self, profile_data):
+        ''' The best canonical ID for a profile as a dict with a confidence from 0 to 1, or None if no member has the surname '''
+
+        scored = sorted(
+            ((self.score(profile_data, x), x) for x in self.candidates(profile_data)),
+            key=lambda x: x[0],
+            reverse=True
+        )
+
+        if not scored:
+            return None
+
+        best_score, best = scored[0]
+        confidence = best_score
+
+        # knock the confidence down when a runner-up is nearly as good
+        if len(scored) > 1:
+            gap = best_score - scored[1][0]
+
+            if gap < AMBIGUITY_MARGIN:
+                confidence *= gap / AMBIGUITY_MARGIN
+
+        return {
+            'legislator_profile_id': profile_data.get('legislator_profile_id'),
+            'legislator_id_canon': best.get('legislator_id_canon'),
+            'confidence': round(confidence, 2),
+            'session_id': profile_data.get('session_id'),
+            'profile_name': profile_data.get('name'),
+            'matched_name': ' '.join(x for x in [best.get('name_first'), best.get('name_middle'), best.get('name_last')] if x),
+            'candidates': len(scored)
+        }
+
+    def propose(self, profile_data):
+        ''' Resolve a profile and keep the match to write out with the others '''
+
+        # a profile that failed to download has nothing to go on
+        if not profile_data.get('legislator_profile_id'):
+            return None
+
+        proposal = self.resolve(profile_data)
+
+        if proposal:
+            with self.lock:
+                self.proposals[str(proposal['legislator_profile_id'])] = proposal
+
+        return proposal
+
+    def write_proposals(self, filepath=PROPOSALS_FILE):
+        ''' Save every proposed match as rows for review, most confident first '''
+
+        with self.lock:
+            proposals = sorted(self.proposals.values(), key=lambda x: (-x['confidence'], int(x['legislator_profile_id'])))
+
+        if not proposals:
+            return 0
+
+        rows = io.StringIO(newline='')
+
+        writer = csv.DictWriter(rows, fieldnames=PROPOSAL_COLUMNS)
+        writer.writeheader()
+        writer.writerows(proposals)
+
+        write_atomic(filepath, [rows.getvalue()])
+
+        print(f'Wrote {len(proposals):,} proposed crosswalk rows to {filepath}')
+
+        return len(proposals)
+
+    def __str__(self):
+        return f'Legislator resolver - {len(self.members):,} members under {len(self.by_surname):,} surnames, {len(self.proposals):,} proposed matches'
+
+
+def read_xwalk(filepath=XWALK_FILE):
+    ''' Legislator profile ID -> canonical ID, as strings; blank if it's known to need one '''
+
+    with open(filepath, 'r') as infile:
+        return {x['legislator_profile_id']: x['legislator_id_canon'] for x in csv.DictReader(infile)}
+
+
+def unmapped_profiles(legislators_dir=LEGISLATORS_DIR, xwalk_file=XWALK_FILE):
+    ''' Saved legislator profiles without a canonical ID in the crosswalk '''
+
+    xwalk = read_xwalk(xwalk_file)
+    profiles = []
+
+    for filepath in sorted(glob.glob(os.path.join(legislators_dir, 'sd-legislature-legislator-*.json'))):
+        with open(filepath, 'r') as infile:
+            profile_data = json.load(infile)
+
+        if not xwalk.get(str(profile_data.get('legislator_profile_id'))):
+            profiles.append(profile_data)
+
+    return profiles
+
+
+def apply_proposals(min_confidence=0.9, proposals_file=PROPOSALS_FILE, xwalk_file=XWALK_FILE):
+    ''' Fill in the crosswalk from proposed matches at or above min_confidence; returns how many went in '''
+
+    xwalk = read_xwalk(xwalk_file)
+
+    with open(proposals_file, 'r') as infile:
+        accepted = {
+            x['legislator_profile_id']: x['legislator_id_canon']
+            for x in csv.DictReader(infile)
+            if float(x['confidence']) >= min_confidence and not xwalk.get(x['legislator_profile_id'])
+        }
+
+    if not accepted:
+        return 0
+
+    # blank rows get filled in where they are; new ones go on the end
+    xwalk.update(accepted)
+
+    rows = io.StringIO()
+
+    writer = csv.writer(rows)
+    writer.writerow(['legislator_profile_id', 'legislator_id_canon'])
+    writer.writerows(xwalk.items())
+
+    # the file has never ended with a line break; keep diffs to the new rows
+    with open(xwalk_file, 'w', newline='') as outfile:
+        outfile.write(rows.getvalue().rstrip('\r\n'))
+
+    return len(accepted)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Propose canonical member IDs for saved legislator profiles missing from the crosswalk')
+
+    parser.add_argument(
+        '--historical',
+        default=os.path.join(LEGISLATORS_DIR, 'sd-legislature-legislators-historical.json'),
+        help='Historical members list to match against'
+    )
+
+    parser.add_argument(
+        '--output',
+        default=PROPOSALS_FILE,
+        help='Where to write the proposed rows'
+    )
+
+    parser.add_argument(
+        '--apply',
+        action='store_true',
+        help=f'Then add proposed rows at or above --min-confidence to {os.path.basename(XWALK_FILE)}'
+    )
+
+    parser.add_argument(
+        '--min-confidence',
+        type=float,
+        default=0.9,
+        help='Lowest confidence --apply accepts'
+    )
+
+    args = parser.parse_args()
+
+    with open(args.historical, 'r') as infile:
+        resolver = LegislatorResolver(json.load(infile))
+
+    profiles = unmapped_profiles()
+
+    print(f'{len(profiles):,} saved profiles need a canonical ID')
+
+    for profile_data in profiles:
+        proposal = resolver.propose(profile_data)
+
+        if proposal:
+            print(f'{proposal["profile_name"]} ({proposal["legislator_profile_id"]}) -> {proposal["matched_name"]} ({proposal["legislator_id_canon"]}), confidence {proposal["confidence"]}')
+        else:
+            print(f'No match for {profile_data.get("name")} ({profile_data.get("legislator_profile_id")})')
+
+    print(resolver)
+
+    resolver.write_proposals(args.output)
+
+    if args.apply and resolver.proposals:
+        applied = apply_proposals(args.min_confidence, proposals_file=args.output)
+        print(f'Added {applied:,} rows to {XWALK_FILE}')
@@ -1,4 +1,4 @@
-import glob
+import json
 from datetime import date
 
 
@@ -7,23 +7,42 @@ today = date.today().strftime('%B %d, %Y')
 with open('README-TEMPLATE.md', 'r') as infile:
     tmpl = infile.read().splitlines()
 
-count_sessions = len(glob.glob('data/sessions/*.json'))
-count_bills = len(glob.glob('data/bills/*.json'))
+# kept up to date by the crawler as it writes files; rebuild it with
+# `python crawler/manifest.py`
+with open('data/manifest.json', 'r') as infile:
+    stats = json.load(infile)['stats']
 
-# don't count the historical file
-count_legislators = len(glob.glob('data/legislators/*.json')) - 1 
-count_committees = len(glob.glob('data/committees/*.json'))
+count_sessions = stats['types']['sessions']['count']
+count_bills = stats['types']['bills']['count']
+count_legislators = stats['types']['legislators']['count']
+count_committees = stats['types']['committees']['count']
+
+session_rows = [
+    '| Session | Bills | Legislator profiles | Committees | Size | Last updated |',
+    '| --- | ---: | ---: | ---: | ---: | --- |'
+]
+
+# session IDs aren't in date order, but names start with the year
+for session_id, session in sorted(stats['sessions'].items(), key=lambda x: x[1]['name'] or '', reverse=True):
+    session_rows.append(
+        f"| {session['name'] or session_id} | {session['bills']:,} | {session['legislators']:,} | {session['committees']:,} | {session['bytes'] / 1024 ** 2:,.1f} MB | {session['last_updated'][:10]} |"
+    )
 
 replacements = (
     ('{% updated %}', today),
     ('{% count_sessions %}', f'{count_sessions:,}'),
     ('{% count_legislators %}', f'{count_legislators:,}'),
     ('{% count_committees %}', f'{count_committees:,}'),
-    ('{% count_bills %}', f'{count_bills:,}')
+    ('{% count_bills %}', f'{count_bills:,}'),
+    ('{% total_size %}', f"{stats['total_bytes'] / 1024 ** 2:,.0f} MB")
 )
 
 new_file = []
 for line in tmpl:
+    if line.strip() == '{% session_stats %}':
+        new_file.extend(session_rows)
+        continue
+
     for repl in replacements:
         line = line.replace(*repl)
     new_file.append(line)